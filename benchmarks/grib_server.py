@@ -0,0 +1,179 @@
+"""Local stand-in of the NOMADS server for the GRIB downloader.
+
+Serves a directory over HTTP/1.1 (persistent connections) with single byte-range
+requests, as NOMADS does, and writes GFS-like fixtures (GRIB records and their
+.idx inventories) in the layout of the NOMADS urls:
+
+    <root>/gfs.<YYYYMMDD>/<HH>/atmos/gfs.t<HH>z.pgrb2.0p25.f<FFF>[.idx]
+
+    python benchmarks/grib_server.py --root /tmp/nomads --port 8800 --fixtures 2024042200
+    HWI_GFS_URL='http://127.0.0.1:8800/gfs.{init:%Y%m%d}/{init:%H}/atmos/gfs.t{init:%H}z.pgrb2.0p25.f{hour:03d}' \\
+        python download_gfs.py --date 2024042200 --hours 0,24,3 --output-dir /tmp/gfs
+"""
+import argparse
+import functools
+import os
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# Records of each fixture file: variable, level
+GFS_RECORDS = [
+    ('PRMSL', 'mean sea level'),
+    ('HGT', '500 mb'),
+    ('TMP', '500 mb'),
+    ('TMP', '2 m above ground'),
+    ('RH', '2 m above ground'),
+    ('TMAX', '2 m above ground'),
+    ('TMIN', '2 m above ground'),
+    ('UGRD', '10 m above ground'),
+    ('VGRD', '10 m above ground'),
+]
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static files with 'Range: bytes=start-[end]' support and persistent connections.
+    drop_after: when set, the first `failures` responses are cut after that many bytes
+    (to exercise the retries and the resumed downloads).
+    ignore_range: answer the whole file (200) to the range requests, as some servers do.
+    """
+    protocol_version = 'HTTP/1.1'
+    drop_after = None
+    ignore_range = False
+    state = {'failures': 0, 'lock': threading.Lock()}
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return None
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and not self.ignore_range:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start > end:
+                self.send_error(416, 'Requested range not satisfiable')
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        self.range = (start, end)
+        return open(path, 'rb')
+
+    def copyfile(self, source, output):
+        start, end = self.range
+        source.seek(start)
+        remaining = end - start + 1
+
+        with self.state['lock']:
+            drop = self.drop_after is not None and self.state['failures'] > 0
+            if drop:
+                self.state['failures'] -= 1
+        if drop:
+            output.write(source.read(min(remaining, self.drop_after)))
+            self.close_connection = True
+            return
+
+        while remaining > 0:
+            chunk = source.read(min(remaining, 2**20))
+            if not chunk:
+                break
+            output.write(chunk)
+            remaining -= len(chunk)
+
+
+def serve(root, port=0, drop_after=None, failures=0, ignore_range=False):
+    """Serve root in a background thread.
+
+    :param port: port (0: any free port).
+    :param drop_after: bytes sent before cutting the first `failures` responses.
+    :param ignore_range: answer the whole file to the range requests.
+    :return: (server, base url); stop with server.shutdown().
+    """
+    # The counter of failures is shared by the requests of this server
+    handler = type('Handler', (RangeRequestHandler,), {
+        'drop_after': drop_after,
+        'ignore_range': ignore_range,
+        'state': {'failures': failures, 'lock': threading.Lock()},
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), functools.partial(handler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def gfs_url_template(base):
+    """Url template of the fixtures served from base (format of [gfs] url)."""
+    return base + '/gfs.{init:%Y%m%d}/{init:%H}/atmos/gfs.t{init:%H}z.pgrb2.0p25.f{hour:03d}'
+
+
+def make_gfs_fixtures(root, init, hours, resolution=0.25, seed=3):
+    """GFS-like files (records of random bytes between 'GRIB' and '7777') and .idx inventories.
+
+    :param init: initialization (YYYYMMDDHH).
+    :param hours: forecast hours.
+    :param resolution: grid spacing (degrees) of the global grid, which sets the record size.
+    :return: list of the files.
+    """
+    init = pd.to_datetime(init, format='%Y%m%d%H')
+    rng = np.random.default_rng(seed)
+    n_points = int(360 / resolution) * (int(180 / resolution) + 1)
+    record_size = n_points * 3 // 2  # ~12 bits per value, as the GFS records
+
+    files = []
+    for hour in hours:
+        filename = root + gfs_url_template('').format(init=init, hour=hour)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        lines, offset = [], 0
+        with open(filename, 'wb') as f:
+            for number, (variable, level) in enumerate(GFS_RECORDS, start=1):
+                forecast = 'anl' if hour == 0 else f'{hour} hour fcst'
+                lines.append(f'{number}:{offset}:d={init.strftime("%Y%m%d%H")}:{variable}:{level}:{forecast}:')
+                record = b'GRIB' + rng.bytes(record_size - 8) + b'7777'
+                f.write(record)
+                offset += len(record)
+        with open(f'{filename}.idx', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        files.append(filename)
+
+    return files
+
+
+def arguments():
+    parser = argparse.ArgumentParser(prog='grib_server.py')
+    parser.add_argument('--root', type=str, required=True, help='Directory served')
+    parser.add_argument('--port', type=int, default=8800, help='Port')
+    parser.add_argument('--fixtures', type=str, default=None, help='Create the fixtures of an initialization (YYYYMMDDHH)')
+    parser.add_argument('--hours', type=str, default='0,168,3', help='Forecast hours of the fixtures: first,last,step')
+    return parser.parse_args()
+
+
+def main():
+    args = arguments()
+    if args.fixtures:
+        first, last, step = (int(value) for value in args.hours.split(','))
+        make_gfs_fixtures(args.root, args.fixtures, range(first, last + 1, step))
+    server, base = serve(args.root, args.port)
+    print(f'Serving {args.root} at {base} (url template: {gfs_url_template(base)})')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
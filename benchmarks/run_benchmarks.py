@@ -0,0 +1,263 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR_REPO)
+
+from benchmarks.synthetic_data import make_fixtures  # noqa: E402
+
+warnings.filterwarnings('ignore')
+
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Stages
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+def stage_read_era5(paths):
+    from bias_correction import read_era5_reanalysis
+    read_era5_reanalysis(dates=paths['bias_dates'], dir_out=paths['era5']).load()
+
+
+def stage_bias_correction(paths):
+    from bias_correction import bias_correction, read_era5_reanalysis
+    reference = read_era5_reanalysis(dates=paths['bias_dates'], dir_out=paths['era5'])
+    bias_correction(
+        h=0,
+        day_fcst=paths['day'],
+        dates=paths['bias_dates'],
+        file_obs=reference,
+        dir_fcst=paths['monan'],
+    )
+
+
+def stage_forecast_detection(paths):
+    from id_heatwaves_fcst import previsao_onda_de_calor
+    previsao_onda_de_calor(
+        paths['day'],
+        model='monan',
+        area=paths['area'],
+        coverage=0.25,
+        dir_forecast=paths['correction'],
+        dir_climatology=paths['climatology'],
+        dir_out=paths['out'],
+    )
+
+
+def stage_reference_detection(paths):
+    from id_heatwaves_obs import onda_de_calor
+    onda_de_calor(
+        paths['dates'][0],
+        paths['dates'][-1],
+        area=paths['area'],
+        coverage=0.25,
+        dir_reference=paths['era5'],
+        dir_climatology=paths['climatology'],
+        dir_out=paths['out'],
+    )
+
+
+def stage_mask_from_shape(paths):
+    from shapely.geometry import box
+    from tools.tools_idhw_v2 import mask_from_shape
+    latitude, longitude = paths['era5_grid']
+    mask_from_shape(box(-48, -18, -35, -2), longitude, latitude)
+
+
+def stage_figures(paths):
+    import xarray as xr
+    from tools.make_figure_map_days import make_figure, make_figure_anomaly
+
+    data = xr.open_dataset(f'{paths["correction"]}/monan.t00z.t2m.p18Z.nc')
+    data['anomalia'] = data['t2m'] - 30
+    make_figure(data=data, row=2, col=3, filename=f'{paths["out"]}/figure.png', area='BR', model='monan')
+    make_figure_anomaly(data=data, row=2, col=3, filename=f'{paths["out"]}/anomaly.png', area='BR', model='monan')
+
+
+def stage_download_gfs(paths):
+    # The stand-in NOMADS server runs in a thread of the same process
+    from benchmarks.grib_server import gfs_url_template, serve
+    from download_gfs import gfs_urls
+    from tools.grib_download import download_forecast
+
+    server, base = serve(paths['nomads'])
+    try:
+        urls = gfs_urls(paths['day'], paths['gfs_hours'], gfs_url_template(base))
+        download_forecast(urls, paths['gfs'], 'TMP:TMAX', '2_m_above_ground', workers=8)
+    finally:
+        server.shutdown()
+
+
+STAGES = {
+    'read_era5_reanalysis': stage_read_era5,
+    'bias_correction': stage_bias_correction,
+    'previsao_onda_de_calor': stage_forecast_detection,
+    'onda_de_calor': stage_reference_detection,
+    'mask_from_shape': stage_mask_from_shape,
+    'figures': stage_figures,
+    'download_gfs': stage_download_gfs,
+}
+
+
+# Peak memory budget of the stages: fixed MB + bytes per point of the benchmark grid.
+# Checked against the peak traced memory (numpy and Python allocations of the stage).
+MEMORY_BUDGET = {
+    'bias_correction': (8, 128),
+    'previsao_onda_de_calor': (8, 48),
+    'onda_de_calor': (8, 48),
+}
+
+
+def memory_budget_mb(stage, grid):
+    """Function: Peak memory budget (MB) of a stage for a grid, None when the stage has no budget."""
+    if stage not in MEMORY_BUDGET:
+        return None
+    base, per_point = MEMORY_BUDGET[stage]
+    return base + per_point * int(np.prod(grid)) / 2**20
+
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Measurement
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _measure(stage, paths, queue):
+    """Run one stage in a child process and report its time and memory."""
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            STAGES[stage](paths)
+        error = None
+    except Exception as exc:  # the other stages are still measured
+        error = f'{type(exc).__name__}: {exc}'
+
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queue.put({
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'baseline_rss_mb': baseline_rss / 1024,
+        'peak_traced_mb': peak_traced / 2**20,
+        'error': error,
+    })
+
+
+def preload():
+    """Import the chain before forking, so the import time is not measured."""
+    for module in ['bias_correction', 'id_heatwaves_fcst', 'id_heatwaves_obs',
+                   'tools.tools_idhw_v2', 'tools.make_figure_map_days', 'download_gfs']:
+        try:
+            __import__(module)
+        except ImportError as exc:
+            print(f'Warning: {exc}')
+
+
+def measure(stage, paths):
+    """Time one stage in a fresh (forked) process, so the peak RSS is the stage's."""
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(stage, paths, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def arguments():
+    parser = argparse.ArgumentParser(prog='run_benchmarks.py')
+    parser.add_argument(
+        '--resolutions',
+        type=str,
+        default='1.0,0.5,0.25',
+        help='Grid spacings (degrees) separated by commas',
+    )
+    parser.add_argument(
+        '--stages',
+        type=str,
+        default=','.join(STAGES),
+        help='Stages separated by commas: ' + ', '.join(STAGES),
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='Number of runs of each stage (the fastest is kept)',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=f'benchmark_{datetime.now().strftime("%Y%m%d%H%M")}.json',
+        help='JSON file with the results',
+    )
+    parser.add_argument(
+        '--keep',
+        action='store_true',
+        help='Keep the synthetic fixtures',
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = arguments()
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            print(f'Unknown stage {stage}: {", ".join(STAGES)}')
+            exit()
+
+    preload()
+
+    results = []
+    for resolution in [float(r) for r in args.resolutions.split(',')]:
+        workdir = tempfile.mkdtemp(prefix=f'hwi_bench_{resolution}_')
+        print(f'\nResolution {resolution}°: creating fixtures in {workdir}')
+        paths = make_fixtures(f'{workdir}/data', workdir, resolution, day='2024-04-22')
+        os.symlink(f'{DIR_REPO}/shape', f'{workdir}/shape')
+
+        # The chain reads the masks and the shapefiles relative to the working directory
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            shape = tuple(len(c) for c in paths['era5_grid'])
+            for stage in stages:
+                runs = [measure(stage, paths) for _ in range(args.repeat)]
+                best = min(runs, key=lambda r: r['wall_s'])
+                best.update(stage=stage, resolution=resolution, grid=shape, budget_mb=memory_budget_mb(stage, shape))
+                results.append(best)
+                status = best['error'] or 'ok'
+                if best['error'] is None and best['budget_mb'] is not None and best['peak_traced_mb'] > best['budget_mb']:
+                    status = f'over budget ({best["budget_mb"]:.1f} MB)'
+                print(
+                    f'  {stage:<24} {best["wall_s"]:8.2f} s  cpu {best["cpu_s"]:8.2f} s  '
+                    f'rss {best["peak_rss_mb"]:8.1f} MB  traced {best["peak_traced_mb"]:8.1f} MB  {status}'
+                )
+        finally:
+            os.chdir(cwd)
+            if not args.keep:
+                shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, default=lambda value: np.asarray(value).tolist())
+    print(f'\nSaving results in {args.output}\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Synthetic ERA5 / climatology / MONAN / mask fixtures for the benchmarks.
+
+The files follow the layout read by the heatwave chain:
+
+    <root>/era5_reanalysis/<YYYY>/t2m_max_era5_<YYYYMMDD>_p050.nc
+    <root>/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc
+    <root>/monan_forecasts/<YYYYMMDD>00/MONAN_DIAG_R_POS_<init>_<valid>18.00.00.x1.nc
+    <root>/forecast_correction/monan.t00z.t2m.p18Z.nc
+    <workdir>/tools/mask_region_<area>.nc
+    <root>/nomads/gfs.<YYYYMMDD>/00/atmos/gfs.t00z.pgrb2.0p25.f<FFF>[.idx]  (served by grib_server.py)
+"""
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from benchmarks.grib_server import make_gfs_fixtures
+
+# South America domain of the region masks
+DOMAIN = (-52.0, 16.0, -88.0, -20.0)  # lat_min, lat_max, lon_min, lon_max
+
+# Window of the synthetic heat wave (days after the start of the period)
+HEATWAVE_DAYS = (10, 16)
+
+
+def era5_grid(resolution):
+    """ERA5-like grid (descending latitudes)."""
+    lat_min, lat_max, lon_min, lon_max = DOMAIN
+    latitude = np.arange(lat_max, lat_min - resolution / 2, -resolution)
+    longitude = np.arange(lon_min, lon_max + resolution / 2, resolution)
+    return latitude, longitude
+
+
+def model_grid(resolution):
+    """MONAN-like grid (ascending latitudes, shifted by half a grid spacing)."""
+    lat_min, lat_max, lon_min, lon_max = DOMAIN
+    latitude = np.arange(lat_min + resolution / 2, lat_max, resolution)
+    longitude = np.arange(lon_min + resolution / 2, lon_max, resolution)
+    return latitude, longitude
+
+
+def tmax_field(latitude, longitude, anomaly, rng):
+    """Tmax (°C): meridional gradient + noise + anomaly."""
+    lat2d = latitude[:, None] * np.ones(len(longitude))
+    field = 30 - 0.15 * np.abs(lat2d + 10) + rng.normal(0, 1.0, lat2d.shape) + anomaly
+    return field.astype('float32')
+
+
+def make_climatology(filename, latitude, longitude):
+    """Daily climatology (2020 calendar) with t2m, std and percentil75."""
+    times = pd.date_range('2020-01-01', '2020-12-31', freq='D')
+    lat2d = latitude[:, None] * np.ones(len(longitude))
+    t2m = (30 - 0.15 * np.abs(lat2d + 10)).astype('float32')
+    shape = (len(times),) + t2m.shape
+
+    clim = xr.Dataset(
+        {
+            't2m': (('time', 'latitude', 'longitude'), np.broadcast_to(t2m, shape)),
+            'std': (('time', 'latitude', 'longitude'), np.full(shape, 1.5, dtype='float32')),
+            'percentil75': (('time', 'latitude', 'longitude'), np.broadcast_to(t2m + 1.0, shape)),
+        },
+        coords={'time': times, 'latitude': latitude, 'longitude': longitude},
+    )
+    clim.to_netcdf(filename)
+
+
+def make_era5(dir_era5, dates, latitude, longitude, seed=0):
+    """Daily ERA5 Tmax files, with a heat wave between HEATWAVE_DAYS."""
+    rng = np.random.default_rng(seed)
+    for idx, day in enumerate(dates):
+        anomaly = 4.0 if HEATWAVE_DAYS[0] <= idx <= HEATWAVE_DAYS[1] else 0.0
+        ds = xr.Dataset(
+            {'t2m': (('time', 'latitude', 'longitude'), tmax_field(latitude, longitude, anomaly, rng)[None])},
+            coords={'time': [day], 'latitude': latitude, 'longitude': longitude},
+        )
+        os.makedirs(f'{dir_era5}/{day.year}', exist_ok=True)
+        ds.to_netcdf(f'{dir_era5}/{day.year}/t2m_max_era5_{day.strftime("%Y%m%d")}_p050.nc')
+
+
+def make_monan(dir_fcst, inits, n_leads, latitude, longitude, heatwave, seed=1):
+    """MONAN-like 18Z forecast files (t2m in K with a 'Time' dimension).
+
+    :param heatwave: (first, last) valid days with the heat wave anomaly.
+    """
+    rng = np.random.default_rng(seed)
+    for init in inits:
+        dir_init = f'{dir_fcst}/{init.strftime("%Y%m%d")}00'
+        os.makedirs(dir_init, exist_ok=True)
+        for lead in range(n_leads):
+            valid = init + timedelta(days=lead)
+            anomaly = 4.0 if heatwave[0] <= valid <= heatwave[1] else 0.0
+            t2m = tmax_field(latitude, longitude, anomaly + 1.0, rng) + 273.16
+            ds = xr.Dataset(
+                {'t2m': (('Time', 'latitude', 'longitude'), t2m[None])},
+                coords={'Time': [valid + timedelta(hours=18)], 'latitude': latitude, 'longitude': longitude},
+            )
+            ds.to_netcdf(
+                f'{dir_init}/MONAN_DIAG_R_POS_{init.strftime("%Y%m%d")}00_{valid.strftime("%Y%m%d")}18.00.00.x1.nc'
+            )
+
+
+def make_corrected_forecast(filename, day, n_leads, latitude, longitude, heatwave, seed=2):
+    """Corrected forecast as written by bias_correction.py (°C)."""
+    rng = np.random.default_rng(seed)
+    times = [day + timedelta(days=lead, hours=18) for lead in range(n_leads)]
+    fields = [
+        tmax_field(latitude, longitude, 4.0 if heatwave[0] <= t.normalize() <= heatwave[1] else 0.0, rng)
+        for t in times
+    ]
+    ds = xr.Dataset(
+        {'t2m': (('time', 'latitude', 'longitude'), np.stack(fields))},
+        coords={'time': times, 'latitude': latitude, 'longitude': longitude},
+    )
+    ds.to_netcdf(filename)
+
+
+def make_region_mask(filename, latitude, longitude, bbox=(-18.0, -2.0, -48.0, -35.0)):
+    """Rectangular region mask (lat_min, lat_max, lon_min, lon_max) in the layout of tools/mask_region_*.nc."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    inside = (
+        (latitude[:, None] >= lat_min) & (latitude[:, None] <= lat_max)
+        & (longitude[None, :] >= lon_min) & (longitude[None, :] <= lon_max)
+    )
+    ds = xr.Dataset(
+        {'mask': (('latitude', 'longitude'), inside.astype('int64'))},
+        coords={'latitude': latitude, 'longitude': longitude},
+    )
+    ds.to_netcdf(filename)
+
+
+def make_fixtures(root, workdir, resolution, day, n_leads=6, n_bias_days=10, area='BENCH'):
+    """Create every fixture needed by the benchmarks of one grid resolution.
+
+    :param root: data directory.
+    :param workdir: working directory of the chain (masks in <workdir>/tools).
+    :param resolution: grid spacing in degrees.
+    :param day: forecast initialization; the ERA5 period starts HEATWAVE_DAYS[0] days before it.
+    :return: dict with the paths and dates of the fixtures.
+    """
+    day = pd.to_datetime(day)
+    era5_lat, era5_lon = era5_grid(resolution)
+    model_lat, model_lon = model_grid(resolution)
+
+    start = day - timedelta(days=HEATWAVE_DAYS[0])
+    dates = pd.date_range(start, day + timedelta(days=n_leads + 10), freq='D')
+    heatwave = (start + timedelta(days=HEATWAVE_DAYS[0]), start + timedelta(days=HEATWAVE_DAYS[1]))
+
+    paths = {
+        'era5': f'{root}/era5_reanalysis',
+        'climatology': f'{root}/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc',
+        'monan': f'{root}/monan_forecasts',
+        'correction': f'{root}/forecast_correction',
+        'out': f'{root}/out_HWI/',
+        'mask_dir': f'{workdir}/tools',
+        'area': area,
+        'day': day,
+        'dates': dates,
+        'bias_dates': pd.date_range(day - timedelta(days=n_bias_days), day - timedelta(days=1), freq='D'),
+        'era5_grid': (era5_lat, era5_lon),
+        'nomads': f'{root}/nomads',
+        'gfs': f'{root}/gfs_forecasts',
+        'gfs_hours': list(range(0, 49, 6)),
+    }
+    for key in ['era5', 'monan', 'correction', 'out', 'mask_dir']:
+        os.makedirs(paths[key], exist_ok=True)
+
+    make_climatology(paths['climatology'], era5_lat, era5_lon)
+    make_era5(paths['era5'], dates, era5_lat, era5_lon)
+    make_monan(
+        paths['monan'],
+        pd.date_range(day - timedelta(days=n_bias_days), day, freq='D'),
+        n_leads, model_lat, model_lon, heatwave,
+    )
+    make_corrected_forecast(
+        f'{paths["correction"]}/monan.t00z.t2m.p18Z.nc', day, n_leads, model_lat, model_lon, heatwave,
+    )
+    make_region_mask(f'{paths["mask_dir"]}/mask_region_{area}.nc', era5_lat, era5_lon)
+    make_gfs_fixtures(paths['nomads'], day.strftime('%Y%m%d00'), paths['gfs_hours'], resolution)
+
+    return paths
@@ -1,6 +1,7 @@
 import argparse
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from glob import glob
 
@@ -8,29 +9,46 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
-from tools.tools_idhw_v2 import check_dir
+from tools.config import get_option, get_path, stage_in
+from tools.daily_max import TMAX_SOURCES, daily_max, file_pattern, forecast_files
+from tools.instrumentation import save_report, stage, start_report
+from tools.netcdf_io import write_netcdf
+from tools.prefetch import load_netcdf, prefetch
+from tools.stage_cache import code_files, is_fresh, record, stage_key
+from tools.tools_idhw_v2 import check_dir, corrected_file, region_bounds, subset_region
 
 warnings.filterwarnings('ignore')
 
+# Subdirectory of each ensemble member inside the initialization directory
+MEMBER_DIR = 'mem{:02d}'
 
-def read_era5_reanalysis(dates, dir_out):
+# Directory ([paths]) of the forecasts of each model (default: forecasts)
+FORECAST_PATHS = {
+    'gfs': 'gfs_netcdf',
+}
+
+
+def read_era5_reanalysis(dates, dir_out, bounds=None):
         """
-        Read ERA5 reanalysis data.
+        Read ERA5 reanalysis data (only the window of the region when bounds is given).
+        The next days are read in background threads (prefetch).
         """
         files = [
             f'{dir_out}/{t.strftime("%Y")}/t2m_max_era5_{t.strftime("%Y%m%d")}_p050.nc'
             for t in dates
         ]
-        list_datasets = []
+        list_files = []
         for filename in files:
             if not os.path.isfile(filename):
                 print(f'ERROR in Accessing {filename.split("/")[-1]}')
             else:
                 print(f'File {filename.split("/")[-1]} exists!')
-                dataset = xr.open_dataset(filename)
-                list_datasets.append(dataset)
+                list_files.append(filename)
+
+        def read(filename):
+            return load_netcdf(filename, lambda ds: subset_region(ds, bounds))
 
-        data_obs = xr.concat(list_datasets, dim='time')
+        data_obs = xr.concat(list(prefetch(list_files, read)), dim='time')
 
         return data_obs
 
@@ -41,6 +59,9 @@ def bias_correction(
         dates=list,
         file_obs=str,
         dir_fcst=str,
+        bounds=None,
+        tmax_source='18z',
+        workers=None,
 ):
     """Function: Bias correction.
     Args:
@@ -54,50 +75,167 @@ def bias_correction(
     :type dates: forecast time
         :param dir_fcst: Directory where the t2m forecast file is located.
     :type dir: str
+        :param bounds: Region window (region_bounds), None for the full grid.
+    :type bounds: tuple
+        :param tmax_source: Daily Tmax of the forecast: '18z' or 'hourly' (tools/daily_max.py).
+    :type tmax_source: str
+        :param workers: Number of hourly files read at the same time.
+    :type workers: int
     """
 
-    list_vies = []
-    for tt in dates:
-        if tt + timedelta(days=h) < day_fcst:
+    def read(tt):
+        valid = tt + timedelta(days=h)
+        with stage('file_discovery'):
+            files = forecast_files(f'{dir_fcst}/{tt.strftime("%Y%m%d")}00', valid, tmax_source)
+
+        with stage('read_forecast', files=len(files)):
+            data_prev = daily_max(files, valid + timedelta(hours=18), bounds, workers=workers)
+        data_prev -= 273.16  # Convert from K to °C (in place)
+        return data_prev.rename({'Time': 'time'})
+
+    # The next forecast files are read while the current one is processed
+    days = [tt for tt in dates if tt + timedelta(days=h) < day_fcst]
+
+    final_vies = None
+    for data_prev in prefetch(days, read):
+        # Regrid observation data
+        # Extract target coordinates from the target dataset
+        target_coords = {
+            'latitude': data_prev['latitude'],
+            'longitude': data_prev['longitude']
+        }
+
+        data_prev = data_prev.sel(
+            time=slice(str(file_obs.time[0].data).split('T')[0],
+                    str(file_obs.time[-1].data).split('T')[0])
+        )
 
-            file = glob(f'{dir_fcst}/{tt.strftime("%Y%m%d")}00/*{(tt + timedelta(days=h)).strftime("%Y%m%d")}18.00.00*.nc')[0]
+        # Regrid the source dataset using target coordinates (only the days of the forecast)
+        with stage('regrid'):
+            regridded_obs = file_obs.sel(
+                time=slice(str(data_prev.time[0].data).split('T')[0],
+                        str(data_prev.time[-1].data).split('T')[0])
+            )
+            regridded_obs = regridded_obs.interp(coords=target_coords, method='linear').load().astype(np.float32, copy=False)
 
-            data_prev = xr.open_dataset(file)['t2m'] - 273.16  # Convert from K to °C
-            data_prev = data_prev.rename({'Time': 'time'})
+        # Running sum of the daily biases (one array instead of one per day)
+        with stage('bias_computation'):
+            vies = data_prev.data
+            vies -= regridded_obs.t2m.data
+            final_vies = vies if final_vies is None else np.add(final_vies, vies, out=final_vies)
 
-            # Regrid observation data
-            # Extract target coordinates from the target dataset
-            target_coords = {
-                'latitude': data_prev['latitude'],
-                'longitude': data_prev['longitude']
-            }
+    with stage('bias_computation'):
+        final_vies /= len(days)
 
-            # Regrid the source dataset using target coordinates
-            regridded_obs = file_obs.interp(coords=target_coords, method='linear')
+    return final_vies
 
 
-            data_prev = data_prev.sel(
-                time=slice(str(file_obs.time[0].data).split('T')[0],
-                        str(file_obs.time[-1].data).split('T')[0])
-            )
-            regridded_obs = regridded_obs.sel(
-                time=slice(str(data_prev.time[0].data).split('T')[0],
-                        str(data_prev.time[-1].data).split('T')[0])
-            )
+def member_files(dir_fcst, init, valid, members, tmax_source='18z'):
+    """Function: Forecast files of each ensemble member for one valid day (18Z or hourly).
+    Members are stored in subdirectories of the initialization directory
+    ({dir_fcst}/{init}00/{member}/).
+    """
+    return [
+        forecast_files(f'{dir_fcst}/{init.strftime("%Y%m%d")}00/{member}', valid, tmax_source)
+        for member in members
+    ]
+
+
+def read_members(files, members, valid, workers=None, bounds=None):
+    """Function: Read the daily Tmax of all members in a pool of threads.
+    The netCDF files are opened and loaded one at a time (tools/prefetch.py): the
+    threads overlap the reading of a member with the reduction of the others.
+    :param files: forecast files of each member (member_files).
+    :type files: list
+    :param members: member names (coordinate of the member dimension).
+    :type members: list
+    :param valid: valid day.
+    :type valid: datetime
+    :param workers: number of reading threads (default: one per member).
+    :type workers: int
+    :param bounds: region window (region_bounds), None for the full grid.
+    :type bounds: tuple
+    :return: t2m in °C with dimensions (member, time, latitude, longitude).
+    """
+    def read(member):
+        # The members are already read in threads: the hourly files of one member one at a time
+        return daily_max(member, valid + timedelta(hours=18), bounds, workers=1)
 
-            vies = data_prev - regridded_obs.t2m.data
-    
-            list_vies.append(vies)
+    with stage('read_forecast', members=len(files)), ThreadPoolExecutor(max_workers=workers or len(files)) as executor:
+        fields = list(executor.map(read, files))
 
-    final_vies = np.array(list_vies)
-    # print(final_vies.shape)
-    final_vies = np.mean(final_vies, axis=0)
-    # print(final_vies.shape)
+    data = xr.concat(fields, dim='member').astype(np.float32, copy=False)
+    data -= 273.16  # Convert from K to °C (in place)
+    data = data.rename({'Time': 'time'}).assign_coords(member=members)
 
-    return final_vies
+    return data
+
+
+def bias_correction_ensemble(
+        h,
+        day_fcst,
+        dates=list,
+        reference=None,
+        dir_fcst=str,
+        members=list,
+        workers=None,
+        bounds=None,
+        tmax_source='18z',
+):
+    """Function: Bias of each ensemble member (all members at once).
+    Args:
+        :param h: Forecast hour index (0 for 18Z, 1 for 42Z, 2 for 66Z).
+    :type h: int
+        :param day_fcst: Forecast day.
+    :type day_fcst: forecast time
+        :param dates: Dates for bias calculation (previous days).
+    :type dates: list
+        :param reference: Reference data already regridded to the forecast grid.
+    :type reference: xarray.Dataset
+        :param dir_fcst: Directory where the t2m forecast members are located.
+    :type dir_fcst: str
+        :param members: Member subdirectories.
+    :type members: list
+        :param workers: Number of reading threads.
+    :type workers: int
+        :param bounds: Region window (region_bounds), None for the full grid.
+    :type bounds: tuple
+        :param tmax_source: Daily Tmax of the forecast: '18z' or 'hourly'.
+    :type tmax_source: str
+    """
+    def read(tt):
+        valid = tt + timedelta(days=h)
+        with stage('file_discovery'):
+            files = member_files(dir_fcst, tt, valid, members, tmax_source)
+        return valid, read_members(files, members, valid, workers, bounds)
+
+    # The members of the next day are read while the current day is processed
+    days = [tt for tt in dates if tt + timedelta(days=h) < day_fcst]
+
+    total = None
+    for valid, data_prev in prefetch(days, read):
+        obs = reference.t2m.sel(time=valid.strftime('%Y-%m-%d')).data
+
+        # (member, time, lat, lon) - (time, lat, lon)
+        with stage('bias_computation'):
+            vies = data_prev.data
+            vies -= obs
+            total = vies if total is None else np.add(total, vies, out=total)
+
+    total /= len(days)
+    return total
+
+
+def output_file(model, members=0, day=None, region=None):
+    """Function: Corrected forecast file (deterministic or ensemble, tools_idhw_v2.corrected_file).
+    With day, the file of that initialization ({model}.<YYYYMMDD>.t00z.t2m.p18Z.nc), which is
+    kept for the hindcast mode of id_heatwaves_fcst.py instead of being overwritten by the next run.
+    With region, the file only holds the window of the region ({model}.<region>.t00z.t2m.p18Z.nc).
+    """
+    return corrected_file(get_path('corrected'), model, region, day, members)
 
 
-def arguments():
+def arguments(argv=None):
     parser = argparse.ArgumentParser(prog='bias_correction.py')
     parser.add_argument(
         '--date',
@@ -111,17 +249,52 @@ def arguments():
         default=None,
         help='Forecast model',
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--region',
+        type=str,
+        default=None,
+        help='Region: CE or NEB or BR or area1-summer (only its window is corrected)',
+    )
+    parser.add_argument(
+        '--members',
+        type=int,
+        default=0,
+        help='Number of ensemble members (0: deterministic forecast)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('run', 'workers', int),
+        help='Threads used to read the ensemble members',
+    )
+    parser.add_argument(
+        '--tmax-source',
+        type=str,
+        choices=list(TMAX_SOURCES),
+        default=get_option('run', 'tmax_source') or '18z',
+        help='Daily Tmax of the forecast: the 18Z field or the maximum of the hourly files of each day',
+    )
+    parser.add_argument(
+        '--dated',
+        action='store_true',
+        help='Write {model}.<YYYYMMDD>.t00z.t2m.p18Z.nc (input of id_heatwaves_fcst.py --date-end)',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Recompute even if the output is up to date',
+    )
+    return parser.parse_args(argv)
 
 
-def main():
-    args = arguments()
+def main(argv=None):
+    args = arguments(argv)
     day = pd.to_datetime(args.date)
     model = args.model
+    start_report('bias_correction', date=day.strftime('%Y%m%d'), model=model, region=args.region, members=args.members,
+                 tmax_source=args.tmax_source)
 
-    dir_local = os.getcwd()
-    #dir_obs = f'{dir_local}/data/era5_reanalysis'
-    dir_obs = '/pesq/share/monan/curso_OMM_INPE_2025/Validation/HeatWave/HWI-tool/data/era5_reanalysis/'
+    dir_obs = get_path('era5')
 
     if day.strftime('%Y%m%d') == date.today().strftime('%Y%m%d'):
         time = day - timedelta(days=6)
@@ -131,51 +304,160 @@ def main():
     # Apply bias correction using the previous 10 days of data
     times = pd.date_range(time - timedelta(days=9), time)
 
+    # Only the window around the region is read and corrected
+    bounds = None
+    bounds_obs = None
+    if args.region is not None:
+        bounds = region_bounds(args.region, get_path('masks'))
+        bounds_obs = region_bounds(args.region, get_path('masks'), halo=2.0)
+
+    dir_prev = get_path(FORECAST_PATHS.get(model, 'forecasts'))
+
+    hours_lookahead = [18, 42, 66, 90, 114, 138]
+    #hours_lookahead = [18, 42, 66]  # Forecast hour to be corrected
+
+    files_obs = [f'{t.strftime("%Y")}/t2m_max_era5_{t.strftime("%Y%m%d")}_p050.nc' for t in times]
+    members = '*/' if args.members > 0 else ''
+    files_prev = [f'{t.strftime("%Y%m%d")}00/{members}{file_pattern(args.tmax_source)}' for t in times.append(pd.DatetimeIndex([day]))]
+
+    # Skipped when the last run had the same inputs and parameters
+    file_out = output_file(model, args.members, day if args.dated else None, args.region)
+    tag = f'{model}.{day.strftime("%Y%m%d")}.{args.region}{".dated" if args.dated else ""}'
+    with stage('cache_check'):
+        inputs = [f'{dir_obs}/{name}' for name in files_obs] + code_files(__file__)
+        inputs += sorted(f for pattern in files_prev for f in glob(f'{dir_prev}/{pattern}'))
+        if args.region is not None:
+            inputs.append(f'{get_path("masks")}/mask_region_{args.region}.nc')
+        key = stage_key(inputs, {'members': args.members, 'region': args.region, 'leads': hours_lookahead,
+                                 'tmax_source': args.tmax_source})
+    if not args.force and is_fresh('bias_correction', tag, key, [file_out]):
+        print(f'\n{file_out} is up to date (same inputs and parameters)\n')
+        save_report()
+        return
+
+    # Inputs copied to the scratch directory ([scratch] stage_in)
+    with stage('stage_in'):
+        dir_obs = stage_in(dir_obs, files_obs, 'era5_reanalysis')
+        dir_prev = stage_in(dir_prev, files_prev, f'{model}_forecasts')
+
     print('\n\nStarting to read ERA5 data...\n')
-    reference = read_era5_reanalysis(dates=times, dir_out=dir_obs)
+    with stage('read_era5'):
+        reference = read_era5_reanalysis(dates=times, dir_out=dir_obs, bounds=bounds_obs).load()
     print('Completed!')
 
     # Bias Correction
     print(f'\n\nStarting bias correction for {model} forecast - Day {day.strftime("%Y%m%d")}...\n')
 
-    #dir_prev = f'{os.getcwd()}/data/monan_forecasts'
-    dir_prev = '/pesq/share/monan/curso_OMM_INPE_2025/Validation/HeatWave/HWI-tool/data/monan_forecasts'
+    if args.members > 0:
+        main_ensemble(args, day, reference, dir_prev, hours_lookahead, bounds)
+        record('bias_correction', tag, key, [file_out])
+        save_report()
+        return
 
-    hours_lookahead = [18, 42, 66, 90, 114, 138]
-    #hours_lookahead = [18, 42, 66]  # Forecast hour to be corrected
+    today = day - timedelta(days=0)
+
+    def read_lead(idx):
+        valid = today + timedelta(days=idx)
+        with stage('file_discovery'):
+            files_today = forecast_files(f'{dir_prev}/{today.strftime("%Y%m%d")}00', valid, args.tmax_source)
+        with stage('read_forecast', files=len(files_today)):
+            prev_init_today = daily_max(files_today, valid + timedelta(hours=18), bounds, workers=args.workers)
+        prev_init_today -= 273.16
+        return prev_init_today.rename({'Time': 'time'})
+
+    # The forecast of each lead is read while the bias of the previous one is computed
+    leads = prefetch(range(len(hours_lookahead)), read_lead)
 
     list_ds = []
-    for idx, h in enumerate(hours_lookahead):
+    for (idx, h), prev_init_today in zip(enumerate(hours_lookahead), leads):
         print(f'Forecast hour: {h}Z')
-        bias = bias_correction(
-            h=idx,
-            day_fcst=day,
-            dates=pd.date_range(str(reference.time[0].data).split('T')[0], str(reference.time[-1].data).split('T')[0], freq='D'),
-            file_obs=reference,
-            dir_fcst=dir_prev,
-        )
+        with stage('bias', lead=h):
+            bias = bias_correction(
+                h=idx,
+                day_fcst=day,
+                dates=pd.date_range(str(reference.time[0].data).split('T')[0], str(reference.time[-1].data).split('T')[0], freq='D'),
+                file_obs=reference,
+                dir_fcst=dir_prev,
+                bounds=bounds,
+                tmax_source=args.tmax_source,
+                workers=args.workers,
+            )
 
         print(f'\nApplying bias correction to {model} forecast - Day {day.strftime("%Y%m%d")}00Z | Valid: {(day + timedelta(days=idx)).strftime("%Y%m%d")}18Z...\n')
-        dir_out=dir_local + '/data/forecast_correction/'
+        dir_out = get_path('corrected') + '/'
         check_dir(dir_out)
 
-        today = day - timedelta(days=0)
-        file_today = glob(f'{dir_prev}/{today.strftime("%Y%m%d")}00/*{(today + timedelta(days=idx)).strftime("%Y%m%d")}18.00.00*.nc')[0]
-        prev_init_today = xr.open_dataset(file_today)['t2m'] - 273.16
-        prev_init_today = prev_init_today.rename({'Time': 'time'})
-
         # Removing bias from the forecast
-        prev_corr = prev_init_today - bias
-        list_ds.append(prev_corr)
+        with stage('apply_correction', lead=h):
+            prev_init_today -= bias
+        list_ds.append(prev_init_today)
 
     # Concatenate all forecast hours into a single dataset
     prev_corr_final = xr.concat(list_ds, dim='time')
 
     # Save corrected forecast to NetCDF
-    prev_corr_final.to_netcdf(f'{dir_out}/{model}.t00z.t2m.p18Z.nc')
-    print(f'\nSaving file in {dir_out}/{model}.t00z.t2m.p18Z.nc\n')
+    with stage('write_output'):
+        write_netcdf(prev_corr_final, file_out, stage='bias_correction')
+    record('bias_correction', tag, key, [file_out])
+    print(f'\nSaving file in {file_out}\n')
+
+    print('Completed!\n')
+    save_report()
+
+
+def main_ensemble(args, day, reference, dir_prev, hours_lookahead, bounds=None):
+    """Bias correction of all ensemble members, written in a single file with a member dimension."""
+    model = args.model
+    members = [MEMBER_DIR.format(m) for m in range(1, args.members + 1)]
+    dir_out = get_path('corrected') + '/'
+    check_dir(dir_out)
+
+    dates = pd.date_range(str(reference.time[0].data).split('T')[0], str(reference.time[-1].data).split('T')[0], freq='D')
+
+    # Regrid the reference once to the forecast grid
+    first = subset_region(xr.open_dataset(member_files(dir_prev, day, day, members[:1], args.tmax_source)[0][0]), bounds)
+    target_coords = {
+        'latitude': first['latitude'],
+        'longitude': first['longitude']
+    }
+    with stage('regrid'):
+        reference = reference.interp(coords=target_coords, method='linear').load().astype(np.float32, copy=False)
+
+    list_ds = []
+    for idx, h in enumerate(hours_lookahead):
+        print(f'Forecast hour: {h}Z ({len(members)} members)')
+        with stage('bias', lead=h):
+            bias = bias_correction_ensemble(
+                h=idx,
+                day_fcst=day,
+                dates=dates,
+                reference=reference,
+                dir_fcst=dir_prev,
+                members=members,
+                workers=args.workers,
+                bounds=bounds,
+                tmax_source=args.tmax_source,
+            )
+
+        valid = day + timedelta(days=idx)
+        with stage('file_discovery'):
+            files = member_files(dir_prev, day, valid, members, args.tmax_source)
+        prev_init_today = read_members(files, members, valid, args.workers, bounds)
+
+        # Removing bias from the forecast
+        with stage('apply_correction', lead=h):
+            prev_init_today -= bias
+        list_ds.append(prev_init_today)
+
+    prev_corr_final = xr.concat(list_ds, dim='time')
+
+    file_out = output_file(model, args.members, day if args.dated else None, args.region)
+    with stage('write_output'):
+        write_netcdf(prev_corr_final, file_out, stage='bias_correction')
+    print(f'\nSaving file in {file_out}\n')
 
     print('Completed!\n')
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import warnings
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from tools.checkpoint import (READ_ERRORS, checkpoint_dir, chunk_info, inputs_key, is_done, is_quarantined, quarantine,
+                              save_done)
+from tools.climatology import CALENDAR, HISTOGRAM_BINS, DailyAccumulator, bytes_per_point
+from tools.config import get_option, get_path
+from tools.instrumentation import save_report, stage, start_report
+from tools.netcdf_io import write_netcdf
+from tools.tools_idhw_v2 import check_dir
+
+warnings.filterwarnings('ignore')
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Daily Tmax (or Tmin) climatology (t2m, std and percentiles) from the ERA5 daily files.
+# The Tmin variables have the prefix tmin_ (e.g. tmin_percentil90 of the tmax_tmin
+# definition) and can be added to the Tmax climatology read by the detectors (--add-to).
+# The grid is split in bands of latitude that fit the memory budget; each band
+# reads only its rows of every daily file and is accumulated in a worker process.
+# Each band is saved in [paths] cache/checkpoints when it is done, so a build stopped
+# before the end only computes the remaining bands when it is run again; the daily
+# files that cannot be read are quarantined and the climatology is built without them.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Daily variable of the ERA5 files: prefix of the climatology variables, long name
+VARIABLES = {
+    'max': ('', 'maximum'),
+    'min': ('tmin_', 'minimum'),
+}
+
+
+def era5_files(dir_era5, year_init, year_end, variable='max'):
+    """Function: Daily ERA5 Tmax (or Tmin) files of the period (dates, file names), missing and quarantined files are skipped."""
+    dates = pd.date_range(f'{year_init}-01-01', f'{year_end}-12-31', freq='D')
+    files = [f'{dir_era5}/{t.strftime("%Y")}/t2m_{variable}_era5_{t.strftime("%Y%m%d")}_p050.nc' for t in dates]
+    found = [(t, f) for t, f in zip(dates, files) if os.path.isfile(f)]
+    if len(found) < len(files):
+        print(f'Warning: {len(files) - len(found)} of {len(files)} daily files are missing')
+    readable = [(t, f) for t, f in found if not is_quarantined(f)]
+    if len(readable) < len(found):
+        print(f'Warning: {len(found) - len(readable)} daily files are quarantined ([paths] cache/quarantine.json)')
+    found = readable
+
+    return found
+
+
+def build_band(rows, files, n_lon, bins, n_years, window, percentiles, checkpoint=None, key=None):
+    """Function: Climatology of one band of latitude (run in a worker process).
+    The files are read one after the other: the worker processes already overlap
+    reading and accumulation, and netCDF/HDF5 is not safe in threads of forked processes.
+    The band is saved in the checkpoint file (tools/checkpoint.py) as soon as it is done.
+    :return: (rows, climatology of the band, unreadable files and their errors).
+    """
+    accumulator = DailyAccumulator((rows.stop - rows.start, n_lon), bins=bins, max_count=n_years)
+    unreadable = []
+    for time, filename in files:
+        try:
+            with xr.open_dataset(filename) as ds:
+                field = ds['t2m'].isel(latitude=rows).values.reshape(-1, n_lon)
+        except READ_ERRORS as error:
+            unreadable.append([filename, str(error)])
+            continue
+        accumulator.add(time, field)
+    band = accumulator.finalize(window=window, percentiles=percentiles)
+
+    if checkpoint is not None:
+        save_done(checkpoint, key, lambda filename: np.savez(filename, **band), unreadable=unreadable)
+
+    return rows, band, unreadable
+
+
+def build_climatology(files, latitude, longitude, window=15, percentiles=(75,), bins=HISTOGRAM_BINS,
+                      workers=1, memory_budget=2000, checkpoint=None, variable='max'):
+    """Function: Daily climatology on the grid of the ERA5 files.
+    :param files: (date, file) of the daily ERA5 Tmax (or Tmin) files.
+    :type files: list
+    :param latitude: latitudes of the files.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the files.
+    :type longitude: numpy.ndarray
+    :param window: moving window (calendar days).
+    :type window: int
+    :param percentiles: percentiles (0-100).
+    :type percentiles: list
+    :param bins: (first bin, last bin, width) of the histograms of the percentiles.
+    :type bins: tuple
+    :param workers: number of bands accumulated at the same time.
+    :type workers: int
+    :param memory_budget: memory budget (MB) of all the workers.
+    :type memory_budget: float
+    :param checkpoint: directory of the band checkpoints (None: not saved).
+    :type checkpoint: str
+    :param variable: daily variable of the files (key of VARIABLES): 'max' or 'min' (variables tmin_*).
+    :type variable: str
+    :return: xarray.Dataset in the layout of the climatology read by the detectors.
+    """
+    n_lat, n_lon = len(latitude), len(longitude)
+    n_years = len({time.year for time, _ in files})
+
+    rows_band = int(max(1, memory_budget * 2**20 // (workers * n_lon * bytes_per_point(bins, len(percentiles)))))
+    bands = [slice(start, min(start + rows_band, n_lat)) for start in range(0, n_lat, rows_band)]
+    print(f'{len(files)} days, {n_years} years, {len(bands)} bands of {rows_band} latitudes, {workers} workers')
+
+    variables = ['t2m', 'std'] + [f'percentil{q:g}' for q in percentiles]
+    data = {name: np.empty((len(CALENDAR), n_lat, n_lon), dtype=np.float32) for name in variables}
+
+    # Bands saved by a previous run with the same files and parameters
+    key = inputs_key([filename for _, filename in files], {'window': window, 'percentiles': list(percentiles),
+                                                           'bins': list(bins), 'n_lat': n_lat, 'n_lon': n_lon})
+    tasks, unreadable = [], {}
+    for rows in bands:
+        band_file = None if checkpoint is None else f'{checkpoint}/band.{rows.start}-{rows.stop}.npz'
+        if band_file is not None and is_done(band_file, key):
+            with np.load(band_file) as band:
+                for name in variables:
+                    data[name][:, rows] = band[name]
+            unreadable.update(chunk_info(band_file).get('unreadable', []))
+        else:
+            tasks.append((rows, files, n_lon, bins, n_years, window, percentiles, band_file, key))
+    if len(tasks) < len(bands):
+        print(f'{len(bands) - len(tasks)} of {len(bands)} bands read from the checkpoints in {checkpoint}')
+
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.starmap(build_band, tasks)
+    else:
+        results = (build_band(*task) for task in tasks)
+
+    for rows, band, band_unreadable in results:
+        for name in variables:
+            data[name][:, rows] = band[name]
+        unreadable.update(band_unreadable)
+
+    # The worker processes only report the files: the quarantine is written here
+    for filename, error in unreadable.items():
+        if not is_quarantined(filename):
+            quarantine(filename, error)
+
+    prefix, long_name = VARIABLES[variable]
+    clim = xr.Dataset(
+        {prefix + name: (('time', 'latitude', 'longitude'), value) for name, value in data.items()},
+        coords={'time': CALENDAR, 'latitude': latitude, 'longitude': longitude},
+    )
+    clim[f'{prefix}t2m'].attrs['long_name'] = f'Mean daily {long_name} temperature'
+    clim[f'{prefix}std'].attrs['long_name'] = f'Standard deviation of the daily {long_name} temperature'
+    for q in percentiles:
+        clim[f'{prefix}percentil{q:g}'].attrs['long_name'] = f'{q:g}th percentile of the daily {long_name} temperature'
+    clim.attrs['window'] = f'{window} days'
+    clim.attrs['histogram_bins'] = f'{bins[0]}:{bins[1]}:{bins[2]}'
+
+    return clim
+
+
+def add_to(clim, filename):
+    """Function: Add the variables of a climatology to an existing climatology file on the same grid.
+    The file is rewritten through a partial file, so an interrupted run leaves it unchanged.
+    :param clim: climatology (e.g. the tmin_* variables).
+    :type clim: xarray.Dataset
+    :param filename: climatology file (e.g. the Tmax climatology of [paths] climatology).
+    :type filename: str
+    """
+    base = xr.load_dataset(filename)
+    for name in ('latitude', 'longitude'):
+        if base.sizes[name] != clim.sizes[name] or not np.allclose(base[name].values, clim[name].values):
+            print(f'{filename} is not on the grid of the ERA5 files ({name})')
+            exit()
+    if base.sizes['time'] != clim.sizes['time']:
+        print(f'{filename} does not have the {clim.sizes["time"]} days of the calendar')
+        exit()
+
+    # Same calendar days and grid: the coordinates of the file are kept
+    base.update(clim.assign_coords(time=base['time'], latitude=base['latitude'], longitude=base['longitude']).data_vars)
+    root, extension = os.path.splitext(filename)
+    partial = f'{root}.{os.getpid()}.part{extension}'
+    write_netcdf(base, partial)
+    os.replace(partial, filename)
+
+
+def list_of(kind):
+    """Parse a comma-separated list of values."""
+    return lambda text: [kind(value) for value in text.split(',')]
+
+
+def arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='build_climatology.py')
+    parser.add_argument(
+        '--year-init',
+        type=int,
+        default=1981,
+        help='First year of the baseline',
+    )
+    parser.add_argument(
+        '--year-end',
+        type=int,
+        default=2020,
+        help='Last year of the baseline',
+    )
+    parser.add_argument(
+        '--variable',
+        type=str,
+        choices=sorted(VARIABLES),
+        default='max',
+        help='Daily variable: max (t2m_max_era5_* files) or min (t2m_min_era5_* files, variables tmin_*)',
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=15,
+        help='Moving window (calendar days centred on each day)',
+    )
+    parser.add_argument(
+        '--percentiles',
+        type=list_of(float),
+        default=[75],
+        help='Percentiles separated by commas (e.g. 75,90,95 for the p90 and ehf definitions)',
+    )
+    parser.add_argument(
+        '--bins',
+        type=list_of(float),
+        default=list(HISTOGRAM_BINS),
+        help='First bin, last bin and bin width (°C) of the percentile histograms',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('run', 'workers', int) or 1,
+        help='Worker processes (bands of latitude accumulated at the same time)',
+    )
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=get_option('run', 'memory_budget', float),
+        help='Memory budget of all the workers (MB)',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Output file (default: data/climatology/climatology.daily.t2m_<variable>.ERA5.<year-init>_<year-end>.nc)',
+    )
+    parser.add_argument(
+        '--add-to',
+        type=str,
+        default=None,
+        help='Add the variables to this climatology file instead (e.g. --variable min --add-to <Tmax climatology>)',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = arguments(argv)
+    start_report('build_climatology', year_init=args.year_init, year_end=args.year_end, window=args.window,
+                 variable=args.variable)
+
+    file_out = args.add_to or args.output or (f'{get_path("output_root")}/climatology/'
+                                              f'climatology.daily.t2m_{args.variable}.ERA5.{args.year_init}_{args.year_end}.nc')
+    if args.add_to and not os.path.isfile(args.add_to):
+        print(f'ERROR in Accessing {args.add_to}')
+        exit()
+
+    with stage('file_discovery'):
+        files = era5_files(get_path('era5'), args.year_init, args.year_end, args.variable)
+    if len(files) == 0:
+        print(f'No ERA5 file between {args.year_init} and {args.year_end} in {get_path("era5")}')
+        exit()
+
+    with xr.open_dataset(files[0][1]) as ds:
+        latitude = ds['latitude'].values
+        longitude = ds['longitude'].values
+
+    checkpoint = checkpoint_dir(f'climatology.t2m_{args.variable}.{args.year_init}_{args.year_end}')
+    with stage('climatology', days=len(files)):
+        clim = build_climatology(
+            files,
+            latitude,
+            longitude,
+            window=args.window,
+            percentiles=args.percentiles,
+            bins=tuple(args.bins),
+            workers=args.workers,
+            memory_budget=args.memory_budget,
+            checkpoint=checkpoint,
+            variable=args.variable,
+        )
+    clim.attrs['period'] = f'{args.year_init}-{args.year_end}'
+
+    with stage('write_output'):
+        if args.add_to:
+            add_to(clim, args.add_to)
+        else:
+            check_dir(os.path.dirname(file_out))
+            write_netcdf(clim, file_out)
+    shutil.rmtree(checkpoint)  # the bands are in the output
+    print(f'\nSaving file in {file_out}\n')
+    save_report()
+
+
+if __name__ == '__main__':
+    main()
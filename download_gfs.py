@@ -0,0 +1,110 @@
+import argparse
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from tools.config import get_option, get_path
+from tools.grib_download import download_forecast, read_inventory, select_records
+from tools.instrumentation import save_report, stage, start_report
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# GFS forecasts from NOMADS (replaces tools/get_gfs.pl).
+# Only the records of the requested variables and levels are downloaded (byte
+# ranges of the .idx inventory); the forecast hours are downloaded at the same time.
+# The url of the files is [gfs] url of hwi_config.ini.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def gfs_urls(init, hours, template=None):
+    """Function: Urls of the forecast hours of a GFS run.
+    :param init: initialization (date and hour).
+    :type init: datetime
+    :param hours: forecast hours.
+    :type hours: list
+    :param template: url with {init:...} and {hour:03d} fields (default: [gfs] url).
+    :type template: str
+    """
+    template = template or get_option('gfs', 'url')
+    return [template.format(init=init, hour=hour) for hour in hours]
+
+
+def forecast_hours(text):
+    """Parse HR0,HR1,DHR (first hour, last hour and step, as in get_gfs.pl)."""
+    first, last, step = (int(value) for value in text.split(','))
+    return list(range(first, last + 1, step))
+
+
+def arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='download_gfs.py')
+    parser.add_argument(
+        '--date',
+        type=str,
+        default=datetime.today().strftime('%Y%m%d00'),
+        help='Initialization: %Y%m%d%H',
+    )
+    parser.add_argument(
+        '--hours',
+        type=forecast_hours,
+        default=forecast_hours('0,168,3'),
+        help='Forecast hours: first,last,step (e.g. 0,168,3)',
+    )
+    parser.add_argument(
+        '--vars',
+        type=str,
+        default='TMP:TMAX',
+        help='Variables separated by colons (e.g. TMP:TMAX) or all',
+    )
+    parser.add_argument(
+        '--levels',
+        type=str,
+        default='2_m_above_ground',
+        help='Levels separated by colons, blanks replaced by underscores, or all',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('gfs', 'workers', int),
+        help='Forecast hours downloaded at the same time',
+    )
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        default=None,
+        help='Output directory (default: [paths] gfs/<YYYYMMDDHH>)',
+    )
+    parser.add_argument(
+        '--inv',
+        action='store_true',
+        help='Only print the inventory of the first forecast hour (with the byte ranges)',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = arguments(argv)
+    init = pd.to_datetime(args.date, format='%Y%m%d%H')
+    urls = gfs_urls(init, args.hours)
+
+    if args.inv:
+        for record in select_records(read_inventory(urls[0]), args.vars, args.levels):
+            print(f'{record["line"]}:range={record["start"]}-{"" if record["end"] is None else record["end"]}')
+        return
+
+    start_report('download_gfs', date=args.date, hours=len(args.hours), vars=args.vars, levels=args.levels)
+    dir_out = args.output_dir or f'{get_path("gfs")}/{init.strftime("%Y%m%d%H")}'
+
+    with stage('download', files=len(urls)):
+        files = download_forecast(urls, dir_out, args.vars, args.levels, workers=args.workers)
+
+    downloaded = [f for f in files.values() if f is not None]
+    size = sum(os.path.getsize(f) for f in downloaded)
+    print(f'\n\nfinished download: {len(downloaded)} of {len(urls)} files ({size / 2**20:.1f} MB) in {dir_out}\n')
+    failed = [url for url, f in files.items() if f is None]
+    if failed:
+        print('Not downloaded:\n' + '\n'.join(failed))
+    save_report()
+
+
+if __name__ == '__main__':
+    main()
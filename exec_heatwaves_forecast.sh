@@ -19,11 +19,16 @@ echo "Estou no diretório:$path_local"
 
 mkdir -p "$path_local/figs"
 
+# Run reports of the three stages (timing, CPU, I/O and memory of each step) go to data/reports/<run id>/
+# HWI_TRACE=1 ./exec_heatwaves_forecast.sh ... also writes Chrome traces
+export HWI_RUN_ID=${HWI_RUN_ID:-${date}_${region}_$(date +%Y%m%d%H%M%S)}
+export HWI_REPORT_DIR=${HWI_REPORT_DIR:-$path_local/data/reports}
+
 ################################# Heatwave Forecast ##########################################
 
 echo
 echo "Applying bias correction to model data"
-python $path_local/bias_correction.py --model='monan' --date $date
+python $path_local/bias_correction.py --model='monan' --region $region --date $date
 
 echo
 echo "Identifying extreme Tmax based on the Tmax climatology + Tmax std; a minimum of 3 consecutive days; area coverage"
@@ -41,5 +46,6 @@ minutos=$((duracao / 60))
 segundos=$((duracao % 60))
 
 echo "Time Duration:" $minutos":"$segundos"s"
+echo "Run reports: $HWI_REPORT_DIR/$HWI_RUN_ID"
 echo
 echo "END OF EXECUTION!"
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from tools import assets
+from tools.config import get_option, get_path
+from tools.tools_idhw_v2 import check_dir, region_bounds
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Heat wave service.
+# Keeps the scientific stack imported and the climatology, region masks and
+# shapefiles in memory, and runs the forecast chain for the submitted jobs:
+#
+#   POST /jobs       {"model": "monan", "date": "20250115", "region": "BR", "stages": [...], "cov": 0.25}
+#   GET  /jobs       all jobs
+#   GET  /jobs/<id>  status of one job
+#   GET  /health     workers and queue
+#
+# The jobs run in a pool of worker processes forked after the warm-up, so the
+# preloaded inputs are shared. Jobs of the same model run one after the other,
+# since they write the same heat wave and figure files.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Stage: (module, arguments of its main)
+STAGES = {
+    'bias_correction': ('bias_correction', lambda job: [
+        '--model', job['model'], '--date', job['date'], '--region', job['region'],
+    ]),
+    'detection': ('id_heatwaves_fcst', lambda job: [
+        '--model', job['model'], '--date', job['date'], '--region', job['region'], '--cov', str(job['cov']),
+    ]),
+    'figures': ('mapa_dias_OC_basemap', lambda job: [
+        '--model', job['model'], '--date', job['date'], '--region', job['region'],
+    ]),
+}
+
+
+def preload(regions):
+    """Import the chain and read the static inputs of the regions before forking the workers."""
+    for module, _ in STAGES.values():
+        try:
+            importlib.import_module(module)
+        except ImportError as exc:
+            print(f'Warning: {exc}')
+
+    assets.keep_warm()
+    try:
+        assets.read_shapefile(get_path('shapes') + '/BR_UF_2021/BR_UF_2021.shp')
+    except Exception as exc:  # only the figures need it
+        print(f'Warning: {exc}')
+    for region in regions:
+        print(f'Preloading {region}...')
+        assets.read_climatology(get_path('climatology'), region_bounds(region, get_path('masks'), halo=2.0))
+
+
+def run_job(job, dir_log):
+    """Run the stages of a job (in a worker process); returns the fields updated in the job table."""
+    os.environ['HWI_RUN_ID'] = f'{job["date"]}_{job["region"]}_{job["id"]}'
+    durations = {}
+    error = None
+    with open(f'{dir_log}/{job["id"]}.log', 'w') as log, contextlib.redirect_stdout(log):
+        for stage in job['stages']:
+            module, argv = STAGES[stage]
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module).main(argv(job))
+            except SystemExit as exc:
+                error = f'{stage}: exit({exc.code})'
+            except Exception:
+                error = f'{stage}: {traceback.format_exc(limit=3)}'
+            durations[stage] = round(time.perf_counter() - start, 3)
+            if error is not None:
+                break
+
+    return {
+        'status': 'failed' if error else 'done',
+        'error': error,
+        'durations': durations,
+        'finished': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def worker(jobs, results, dir_log):
+    """Worker process: run the jobs of the queue until None is received."""
+    assets.keep_warm()
+    for job in iter(jobs.get, None):
+        results.put((job['id'], {'status': 'running', 'started': datetime.now().isoformat(timespec='seconds')}))
+        results.put((job['id'], run_job(job, dir_log)))
+
+
+class Scheduler:
+    """Job table and dispatch of the pending jobs to the worker processes."""
+
+    def __init__(self, workers, dir_log):
+        context = multiprocessing.get_context('fork')
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.table = {}
+        self.pending = deque()
+        self.busy_models = set()
+        self.in_flight = 0
+        self.n_workers = workers
+        self.lock = threading.Lock()
+        self.processes = [
+            context.Process(target=worker, args=(self.jobs, self.results, dir_log), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+        threading.Thread(target=self.collect, daemon=True).start()
+
+    def submit(self, request):
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'model': request['model'],
+            'date': pd.to_datetime(str(request['date'])).strftime('%Y%m%d'),
+            'region': request.get('region', 'BR'),
+            'cov': float(request.get('cov', 0.25)),
+            'stages': request.get('stages', list(STAGES)),
+            'status': 'queued',
+            'submitted': datetime.now().isoformat(timespec='seconds'),
+        }
+        unknown = [stage for stage in job['stages'] if stage not in STAGES]
+        if unknown:
+            raise ValueError(f'Unknown stages {unknown}: {", ".join(STAGES)}')
+
+        with self.lock:
+            self.table[job['id']] = job
+            self.pending.append(job['id'])
+            self.dispatch()
+        return job
+
+    def dispatch(self):
+        """Send pending jobs to idle workers (called with the lock held)."""
+        for job_id in list(self.pending):
+            if self.in_flight >= self.n_workers:
+                break
+            job = self.table[job_id]
+            if job['model'] in self.busy_models:
+                continue
+            self.pending.remove(job_id)
+            self.busy_models.add(job['model'])
+            self.in_flight += 1
+            self.jobs.put({key: job[key] for key in ['id', 'model', 'date', 'region', 'cov', 'stages']})
+
+    def collect(self):
+        for job_id, update in iter(self.results.get, None):
+            with self.lock:
+                job = self.table[job_id]
+                job.update(update)
+                if job['status'] in ('done', 'failed'):
+                    self.busy_models.discard(job['model'])
+                    self.in_flight -= 1
+                    self.dispatch()
+
+    def health(self):
+        with self.lock:
+            return {
+                'workers': [process.is_alive() for process in self.processes],
+                'queued': len(self.pending),
+                'running': self.in_flight,
+                'preloaded': assets.cached_keys(),
+            }
+
+
+def make_handler(scheduler):
+    class Handler(BaseHTTPRequestHandler):
+
+        def reply(self, code, body):
+            data = json.dumps(body, indent=2).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            if parts == ['health']:
+                self.reply(200, scheduler.health())
+            elif parts == ['jobs']:
+                with scheduler.lock:
+                    self.reply(200, list(scheduler.table.values()))
+            elif len(parts) == 2 and parts[0] == 'jobs' and parts[1] in scheduler.table:
+                with scheduler.lock:
+                    self.reply(200, scheduler.table[parts[1]])
+            else:
+                self.reply(404, {'error': f'Not found: {self.path}'})
+
+        def do_POST(self):
+            if self.path.strip('/') != 'jobs':
+                self.reply(404, {'error': f'Not found: {self.path}'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                job = scheduler.submit(request)
+            except (ValueError, KeyError, TypeError) as exc:
+                self.reply(400, {'error': f'{type(exc).__name__}: {exc}'})
+                return
+            self.reply(202, job)
+
+        def log_message(self, format, *args):
+            print(f'{datetime.now().isoformat(timespec="seconds")} {self.address_string()} {format % args}')
+
+    return Handler
+
+
+def arguments():
+    parser = argparse.ArgumentParser(prog='hwi_service.py')
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='Address of the service (localhost only by default)',
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8765,
+        help='Port of the service',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('run', 'workers', int) or 2,
+        help='Number of worker processes (jobs running at the same time)',
+    )
+    parser.add_argument(
+        '--preload',
+        type=str,
+        default='BR',
+        help='Regions whose climatology is read at start, separated by commas',
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = arguments()
+    regions = [region for region in args.preload.split(',') if region]
+
+    preload(regions)
+
+    dir_log = f'{get_path("output_root")}/service'
+    check_dir(dir_log)
+    scheduler = Scheduler(args.workers, dir_log)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(scheduler))
+    print(f'Heat wave service on http://{args.host}:{args.port} ({args.workers} workers, logs in {dir_log})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for _ in scheduler.processes:
+            scheduler.jobs.put(None)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,13 +10,23 @@ __email__ = "glicia.garcia@inpe.br"
 import argparse
 import os
 import warnings
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
 import xarray as xr
+from tools.assets import read_climatology
+from tools.chunking import chunks_for_budget, local_scheduler
+from tools.config import get_option, get_path, stage_in_file
+from tools.heatwave_core import exceedance_statistics, heatwave_days
+from tools.instrumentation import save_report, stage, start_report
+from tools.netcdf_io import write_netcdf
+from tools.prefetch import load_netcdf, prefetch
+from tools.stage_cache import code_files, is_fresh, record, stage_key
+from tools.thresholds import DEFINITIONS, check_climatology, check_definitions, definition_suffix, exceedance
 from tools.tools_idhw_v2 import (  # Subroutines of the necessary functions
-    check_dir, split_list)
+    check_dir, find_corrected, read_region_mask, region_bounds, split_list, subset_region)
 
 warnings.filterwarnings('ignore')
 
@@ -29,6 +39,8 @@ def previsao_onda_de_calor(
         dir_forecast=str,
         dir_climatology=str,
         dir_out=str,
+        chunks=None,
+        definition='std',
 ):
     """This script identifies heat wave events in forecast data.
 
@@ -39,15 +51,20 @@ def previsao_onda_de_calor(
         dir_forecast (str): forecast data directory.
         dir_climatology (str): climatology data directory.
         dir_out (str): output data directory.
+        chunks (dict): dask chunks (chunked mode), None reads the data in memory.
+        definition (str): heat wave definition (tools/thresholds.py).
     """
     if model is None:
         print('Especifique o modelo de previsão no terminal!\n')
         print('Exemplo: --model gfs')
         exit()
 
+    # The forecast has Tmax only and starts at the initialization
+    check_definitions([definition], fields=['tmax'], lookback=False)
+
     # -----------------------------------------------------------------------------------------------------------------------------------------
 
-    dir_local = os.getcwd()
+    dir_mask = get_path('masks')
 
     # -----------------------------------------------------------------------------------------------------------------------------------------
     # Reading data
@@ -66,7 +83,15 @@ def previsao_onda_de_calor(
     # ----------------------------------------------------------------
     # Forecast
     # ----------------------------------------------------------------
-    nc_prev = xr.open_dataset(f'{dir_forecast}/{model}.t00z.t2m.p18Z.nc')
+    with stage('read_forecast'):
+        nc_prev = xr.open_dataset(find_corrected(dir_forecast, model, area), chunks=chunks)
+
+        # Only the window around the region is processed
+        bounds = region_bounds(area, dir_mask)
+        nc_prev = subset_region(nc_prev, bounds)
+        if chunks is None:
+            nc_prev = nc_prev.load()
+        nc_prev = nc_prev.astype(np.float32, copy=False)
 
     # Extract target coordinates from the target dataset
     target_coords = {
@@ -77,64 +102,56 @@ def previsao_onda_de_calor(
     # ----------------------------------------------------------------
     # ERA5 Climatology
     # ----------------------------------------------------------------
-    nc = xr.open_dataset(dir_climatology)
-    nc = nc.sel(time=slice(times[0], times[-1]))
+    with stage('read_climatology'):
+        nc = read_climatology(dir_climatology, region_bounds(area, dir_mask, halo=2.0), chunks=chunks)
+        check_climatology([definition], nc, dir_climatology)
+        nc = nc[DEFINITIONS[definition]['climatology'] + ['percentil75']]
+        nc = nc.sel(time=slice(times[0], times[-1]))
+        if chunks is None:
+            nc = nc.load()
 
     # Regrid the source dataset using target coordinates
-    nc = nc.interp(coords=target_coords, method='linear')
+    with stage('regrid'):
+        nc = nc.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
 
     # Region Mask
-    try:
-        read_mask = xr.open_dataset(f'{dir_local}/tools/mask_region_{area}.nc').rename({'lon': 'longitude', 'lat': 'latitude'})
-    except:
-        read_mask = xr.open_dataset(f'{dir_local}/tools/mask_region_{area}.nc')
-    regrid_mask = read_mask.interp(coords=target_coords, method='linear')
-
-    if len(regrid_mask.mask.data.shape) == 2:
-        mask = regrid_mask.mask.data
-    else:
-        mask = regrid_mask.mask[0].data
+    with stage('mask'):
+        mask = read_region_mask(area, target_coords, dir_mask)
     
-    # Climatology mask
-    nc = nc.where(mask, np.nan)
+        # Climatology mask
+        nc = nc.where(mask, np.nan)
 
-    # Forecast mask
-    nc1 = nc_prev.where(mask, np.nan)
-    del nc_prev
+        # Forecast mask
+        nc1 = nc_prev.where(mask, np.nan)
+        del nc_prev
 
-    # Fixing the required variables
-    Tmax = np.array(nc1['t2m'])
-    tmax_count = np.array(nc1['t2m'][0, :, :])
+    # Fixing the required variables (lazy dask arrays in the chunked mode)
+    Tmax = nc1['t2m']
 
     # --------------------------------------------------------------------------------------------------------------------------------------------------
     # COUNTING THE NUMBER OF GRID POINTS IN THE REGION
     # --------------------------------------------------------------------------------------------------------------------------------------------------
-    points_land = np.count_nonzero(~np.isnan(tmax_count))      # Total number of grid points over the continent.
-    print("total points over the continent:", points_land, '\n')
-
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    # First criterion: clim Tmax + std for each grid point - climatological reference from 1981 to 2020 of ERA5.
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    P1 = (nc['t2m'] + nc['std']).data
-
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    # APPLICATION OF THE CRITERION TMAX > clim Tmax + std WITH A MINIMUM OF 3 CONSECUTIVE DAYS.
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    crit = np.where(Tmax > P1, Tmax, np.nan)
-    nc1['crit90'] = (('time', 'latitude', 'longitude'), crit)
-
-
-    # Applying the second condition (minimum of three days).
+    with stage('detection'):
+        points_land = int(Tmax[0].notnull().sum())      # Total number of grid points over the continent.
+        print("total points over the continent:", points_land, '\n')
+
+        # ----------------------------------------------------------------------------------------------------------------------------------------------
+        # First criterion: exceedance of the definition for each grid point (default: Tmax > clim Tmax + std) -
+        # climatological reference from 1981 to 2020 of ERA5.
+        # ----------------------------------------------------------------------------------------------------------------------------------------------
+        # Boolean mask (1 byte per point): Tmax above the threshold (crit90) is only built for the days written
+        exceed = Tmax.copy(data=exceedance([definition], {'tmax': Tmax.data}, nc)[definition])
+
+        # Applying the second condition (minimum of three days).
+        count_valid = exceed.sum(dim=['latitude', 'longitude']).values
     list_index = []
-    for idx, value_time in enumerate(nc1.time.data):
-        value_time = pd.to_datetime(value_time)
-        count_valid = np.count_nonzero(~np.isnan(nc1.sel(time=value_time).crit90.data))
-        if (count_valid/points_land) > coverage:  # Spatial extent (default: 0.25).
+    for idx in range(len(count_valid)):
+        if (count_valid[idx]/points_land) > coverage:  # Spatial extent (default: 0.25).
             list_index.append(idx)
 
     # Eliminating list sequences of indices with a size smaller than 3
     list_filter = split_list(list_index)  # Separating by sequence of values
-    file_out = dir_out + f'{model}.{today.strftime("%Y%m%d")}.onda_de_calor.nc'
+    file_out = dir_out + f'{model}.{today.strftime("%Y%m%d")}.onda_de_calor{definition_suffix(definition)}.nc'
 
     # Saving the files with extreme temperatures
     check_dir(dir_out)
@@ -149,7 +166,7 @@ def previsao_onda_de_calor(
         for idx in list_filter:
             # Days with heatwave
             evento = nc1.isel(time=idx)
-            evento = evento.drop('t2m').rename_vars({'crit90': 't2m'})
+            evento['t2m'] = evento['t2m'].where(exceed.isel(time=idx))
             PI = evento.mean(dim=['time', 'latitude', 'longitude']).t2m.data
 
             #--------------------------------------------------------------------------------------------------------------------------------------------------
@@ -172,19 +189,21 @@ def previsao_onda_de_calor(
             list_datasets.append(dataset)
 
         dataset_final = xr.merge(list_datasets)
-        dataset_final.to_netcdf(file_out)
+        with stage('write_output'):
+            write_netcdf(dataset_final, file_out, stage='forecast_detection')
     else:
         if len(list_index) == 0:
             msg = "No extreme TMAX events were identified (No heat wave)! \n"
             print('Forecast: ' + str(today.strftime('%d/%m/%Y')) + f' Valid: {prev_day.strftime("%d/%m/%Y")}\n')
             # Mask the entire dataset with NaN values
             file_empty = nc1.where(False, np.nan)
-            file_empty.to_netcdf(file_out)
+            with stage('write_output'):
+                write_netcdf(file_empty, file_out, stage='forecast_detection')
         else:
             msg = "Extreme TMAX event identified (No heat wave)! \n"
             print('Forecast: ' + str(today.strftime('%d/%m/%Y')) + f' Valid: {prev_day.strftime("%d/%m/%Y")}\n')
             evento = nc1.isel(time=list_index)
-            evento = evento.drop('t2m').rename_vars({'crit90': 't2m'})
+            evento['t2m'] = evento['t2m'].where(exceed.isel(time=list_index))
 
             # Days that did not meet the heatwave criterion
             dates_without_oc = [list_dates[index] for index in range(len(list_dates)) if index not in list_index]
@@ -193,12 +212,269 @@ def previsao_onda_de_calor(
 
             dataset = xr.concat([evento, days_empty], dim='time')
             dataset = dataset.sortby('time')
-            dataset.to_netcdf(file_out)
+            with stage('write_output'):
+                write_netcdf(dataset, file_out, stage='forecast_detection')
     print(msg)
     print(f'\nSaving file in... {file_out}\n')
 
 
-def arguments():
+def previsao_onda_de_calor_ensemble(
+        day,
+        model=str,
+        area=str,
+        coverage=float,
+        dir_forecast=str,
+        dir_climatology=str,
+        dir_out=str,
+        definition='std',
+):
+    """This script computes the heat wave probability of an ensemble forecast.
+
+    The criteria are the same as in previsao_onda_de_calor (exceedance of the
+    definition, spatial coverage, minimum of 3 consecutive days and intensity
+    above the 75th percentile), evaluated for all members at once.
+
+    Args:
+        day (str): forecast day
+        model (str): model name.
+        area (str): region of interest.
+        coverage (float): spatial coverage of the heat wave.
+        dir_forecast (str): corrected ensemble forecast directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+        definition (str): heat wave definition (tools/thresholds.py).
+    """
+    check_definitions([definition], fields=['tmax'], lookback=False)
+    dir_mask = get_path('masks')
+
+    today = day - timedelta(days=0)
+    print(f'\nInicialização em {today.strftime("%d-%m-%Y")} \n')
+
+    # ----------------------------------------------------------------
+    # Ensemble forecast (member, time, latitude, longitude)
+    # ----------------------------------------------------------------
+    with stage('read_forecast'):
+        nc_prev = xr.open_dataset(find_corrected(dir_forecast, model, area, members=1))
+        nc_prev = subset_region(nc_prev, region_bounds(area, dir_mask))
+        nc_prev = nc_prev.transpose('member', 'time', 'latitude', 'longitude').load().astype(np.float32, copy=False)
+    times = nc_prev.time.dt.strftime('2020-%m-%d').data
+
+    target_coords = {
+        'latitude': nc_prev['latitude'],
+        'longitude': nc_prev['longitude']
+    }
+
+    # ----------------------------------------------------------------
+    # ERA5 Climatology
+    # ----------------------------------------------------------------
+    with stage('read_climatology'):
+        nc = read_climatology(dir_climatology, region_bounds(area, dir_mask, halo=2.0))
+        check_climatology([definition], nc, dir_climatology)
+        nc = nc[DEFINITIONS[definition]['climatology'] + ['percentil75']]
+        nc = nc.sel(time=slice(times[0], times[-1])).load()
+    with stage('regrid'):
+        nc = nc.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
+
+    # Region Mask
+    with stage('mask'):
+        mask = read_region_mask(area, target_coords, dir_mask)
+        nc = nc.where(mask, np.nan)
+        nc_prev = nc_prev.where(mask, np.nan)
+
+    # Criteria for all members at once
+    with stage('detection'):
+        exceed = exceedance([definition], {'tmax': nc_prev['t2m'].data}, nc)[definition]
+        stats = exceedance_statistics(exceed, nc_prev['t2m'].data, nc['percentil75'].data)
+        criteria = heatwave_days(stats, coverage=coverage)
+
+        # Fraction of members with heat wave in each grid point / in the region
+        heatwave = stats['exceed'] & criteria['heatwave'][..., None, None]
+        prob = np.where(mask, heatwave.mean(axis=0), np.nan)
+        prob_extreme = np.where(mask, stats['exceed'].mean(axis=0), np.nan)
+
+    dataset = xr.Dataset(
+        {
+            'prob': (('time', 'latitude', 'longitude'), prob),
+            'prob_extreme': (('time', 'latitude', 'longitude'), prob_extreme),
+            'prob_region': (('time',), criteria['heatwave'].mean(axis=0)),
+        },
+        coords={
+            'time': nc_prev.time.data,
+            'latitude': nc_prev.latitude.data,
+            'longitude': nc_prev.longitude.data,
+        },
+    )
+    dataset['prob'].attrs['long_name'] = 'Fraction of members with heat wave'
+    dataset['prob_extreme'].attrs['long_name'] = f'Fraction of members with {DEFINITIONS[definition]["long_name"]}'
+    dataset['prob_region'].attrs['long_name'] = f'Fraction of members with heat wave in {area}'
+    dataset.attrs['members'] = nc_prev.sizes['member']
+    dataset.attrs['coverage'] = coverage
+    dataset.attrs['definition'] = definition
+
+    check_dir(dir_out)
+    file_out = dir_out + f'{model}.{today.strftime("%Y%m%d")}.onda_de_calor{definition_suffix(definition)}.prob.nc'
+    with stage('write_output'):
+        write_netcdf(dataset, file_out, stage='forecast_detection')
+
+    for value_time, p in zip(dataset.time.dt.strftime('%d/%m/%Y').data, dataset.prob_region.data):
+        print(f'{value_time}: heat wave probability in {area} = {p:.0%}')
+    print(f'\nSaving file in... {file_out}\n')
+
+
+def hindcast_file(dir_forecast, model, init, area):
+    """Function: Corrected forecast of one initialization (bias_correction.py --dated) for a region."""
+    return find_corrected(dir_forecast, model, area, day=init)
+
+
+def previsao_onda_de_calor_hindcast(
+        inits,
+        model=str,
+        area=str,
+        coverage=float,
+        dir_forecast=str,
+        dir_climatology=str,
+        dir_out=str,
+        definition='std',
+        workers=None,
+):
+    """This script identifies heat wave events in the forecasts of many initializations.
+
+    The corrected forecasts of the initializations are stacked in an (init, lead,
+    latitude, longitude) array and the criteria of previsao_onda_de_calor are
+    evaluated for all of them at once. The climatology is regridded once for the
+    calendar days of all valid dates and taken for each (init, lead).
+
+    Args:
+        inits (DatetimeIndex): initialization days.
+        model (str): model name.
+        area (str): region of interest.
+        coverage (float): spatial coverage of the heat wave.
+        dir_forecast (str): corrected forecast directory (bias_correction.py --dated).
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+        definition (str): heat wave definition (tools/thresholds.py).
+        workers (int): forecast files read ahead.
+    """
+    check_definitions([definition], fields=['tmax'], lookback=False)
+    dir_mask = get_path('masks')
+    bounds = region_bounds(area, dir_mask)
+
+    file_out = dir_out + hindcast_output(model, inits[0], inits[-1], definition)
+
+    # Initializations without corrected forecast are skipped
+    files = {init: hindcast_file(dir_forecast, model, init, area) for init in inits}
+    missing = [init.strftime('%Y%m%d') for init, filename in files.items() if not os.path.isfile(filename)]
+    if missing:
+        print(f'No corrected forecast (skipped): {", ".join(missing)}\n')
+    inits = pd.DatetimeIndex([init for init in inits if init.strftime('%Y%m%d') not in missing])
+    if len(inits) == 0:
+        print(f'ERROR in Accessing {dir_forecast}/{model}.<YYYYMMDD>[.{area}].t00z.t2m.p18Z.nc')
+        exit()
+    print(f'\nHindcast: {len(inits)} initializations from {inits[0].strftime("%d-%m-%Y")} to {inits[-1].strftime("%d-%m-%Y")}\n')
+
+    # ----------------------------------------------------------------
+    # Forecasts (init, lead, latitude, longitude), read while the previous ones are copied
+    # ----------------------------------------------------------------
+    def read(init):
+        return load_netcdf(files[init], lambda ds: subset_region(ds['t2m'], bounds))
+
+    with stage('read_forecast', files=len(inits)):
+        tmax = None
+        for i, field in enumerate(prefetch(inits, read, depth=workers)):
+            if tmax is None:
+                grid = field
+                tmax = np.empty((len(inits),) + field.shape, dtype=np.float32)
+                valid = np.empty((len(inits), field.sizes['time']), dtype='datetime64[ns]')
+            if field.shape != grid.shape:
+                print(f'ERROR: {files[inits[i]]} has {field.sizes["time"]} days (expected {grid.sizes["time"]})')
+                exit()
+            tmax[i] = field.data
+            valid[i] = field.time.data
+
+    target_coords = {
+        'latitude': grid['latitude'],
+        'longitude': grid['longitude']
+    }
+
+    # ----------------------------------------------------------------
+    # ERA5 Climatology: the calendar days of all valid dates, regridded once
+    # ----------------------------------------------------------------
+    days = pd.DatetimeIndex(valid.ravel()).strftime('2020-%m-%d')
+    calendar, day_index = np.unique(days, return_inverse=True)
+    with stage('read_climatology'):
+        nc = read_climatology(dir_climatology, region_bounds(area, dir_mask, halo=2.0))
+        check_climatology([definition], nc, dir_climatology)
+        nc = nc[DEFINITIONS[definition]['climatology'] + ['percentil75']]
+        nc = nc.sel(time=calendar).load()
+    with stage('regrid'):
+        nc = nc.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
+
+    # Region Mask
+    with stage('mask'):
+        mask = read_region_mask(area, target_coords, dir_mask)
+        nc = nc.where(mask, np.nan)
+        tmax[:, :, ~mask.astype(bool)] = np.nan
+
+    # Climatology of each (init, lead)
+    with stage('climatology_days'):
+        clim = xr.Dataset({
+            name: (('init', 'time', 'latitude', 'longitude'), var.data[day_index].reshape(tmax.shape))
+            for name, var in nc.data_vars.items()
+        })
+
+    # Criteria for all initializations at once
+    with stage('detection'):
+        exceed = exceedance([definition], {'tmax': tmax}, clim)[definition]
+        stats = exceedance_statistics(exceed, tmax, clim['percentil75'].data)
+        criteria = heatwave_days(stats, coverage=coverage)
+
+        # Tmax of the grid points above the threshold on the heat wave days (NaN elsewhere)
+        heatwave = stats['exceed'] & criteria['heatwave'][..., None, None]
+        t2m = np.where(heatwave, tmax, np.nan)
+
+    dataset = xr.Dataset(
+        {
+            't2m': (('init', 'lead', 'latitude', 'longitude'), t2m),
+            'heatwave': (('init', 'lead'), criteria['heatwave'].astype(np.int8)),
+            'extreme': (('init', 'lead'), criteria['extreme'].astype(np.int8)),
+            'fraction': (('init', 'lead'), criteria['fraction'].astype(np.float32)),
+            'intensity': (('init', 'lead'), criteria['intensity'].astype(np.float32)),
+            'p75': (('init', 'lead'), criteria['p75'].astype(np.float32)),
+        },
+        coords={
+            'init': inits,
+            'lead': np.arange(tmax.shape[1]),
+            'time': (('init', 'lead'), valid),
+            'latitude': grid.latitude.data,
+            'longitude': grid.longitude.data,
+        },
+    )
+    dataset['t2m'].attrs['long_name'] = f'Tmax of the heat wave days ({DEFINITIONS[definition]["long_name"]})'
+    dataset['heatwave'].attrs['long_name'] = f'Heat wave day in {area}'
+    dataset['extreme'].attrs['long_name'] = f'Fraction of {area} above the threshold > {coverage}'
+    dataset['fraction'].attrs['long_name'] = f'Fraction of {area} above the threshold'
+    dataset['intensity'].attrs['long_name'] = 'Intensity parameter (mean Tmax above the threshold in the event)'
+    dataset['p75'].attrs['long_name'] = 'Climatological 75th percentile (mean in the event)'
+    dataset['lead'].attrs['units'] = 'days'
+    dataset.attrs['coverage'] = coverage
+    dataset.attrs['definition'] = definition
+
+    check_dir(dir_out)
+    with stage('write_output'):
+        # One chunk per initialization
+        write_netcdf(dataset, file_out, stage='forecast_detection', time_dim='init')
+
+    n_events = int(np.count_nonzero(criteria['heatwave'].any(axis=-1)))
+    print(f'Heat wave identified in {n_events} of {len(inits)} initializations')
+    print(f'\nSaving file in... {file_out}\n')
+
+
+def hindcast_output(model, first, last, definition='std'):
+    """Function: Output file of the hindcast mode."""
+    return f'{model}.{first.strftime("%Y%m%d")}-{last.strftime("%Y%m%d")}.onda_de_calor{definition_suffix(definition)}.hindcast.nc'
+
+
+def arguments(argv=None):
     parser = argparse.ArgumentParser(prog='id_heatwaves_fcst.py')
     parser.add_argument(
         '--date',
@@ -230,37 +506,176 @@ def arguments():
 
     )
 
+    parser.add_argument(
+        '--definition',
+        type=str,
+        default='std',
+        choices=list(DEFINITIONS),
+        help='Heat wave definition (tools/thresholds.py)',
+    )
+
+    parser.add_argument(
+        '--chunked',
+        action='store_true',
+        help='Lazy computation over chunks (large domains)',
+    )
+
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=get_option('run', 'memory_budget', float),
+        help='Memory budget of the chunked mode (MB)',
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('run', 'workers', int),
+        help='Threads of the chunked mode (default: number of cores)',
+    )
+
+    parser.add_argument(
+        '--ensemble',
+        action='store_true',
+        help='Heat wave probability from the corrected ensemble forecast',
+    )
+
+    parser.add_argument(
+        '--date-end',
+        type=str,
+        default=None,
+        help='Hindcast: last initialization (%Y%m%d); every day from --date to --date-end in one output',
+    )
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Recompute even if the output is up to date',
+    )
 
-    return parser.parse_args()
 
+    return parser.parse_args(argv)
 
-def main():
 
-    args = arguments()
+def main(argv=None):
+
+    args = arguments(argv)
     model = args.model
     region = args.region
     day = pd.to_datetime(args.date)
     cov = args.cov
     
-    dir_pesq = '/pesq/share/monan/curso_OMM_INPE_2025/Validation/HeatWave/HWI-tool/'
-
-    dir_local = os.getcwd()
-    #path_fcst = f'{dir_local}/data/forecast_correction'
-    path_fcst = f'{dir_local}/data/forecast_correction'
-
-    #path_clim = f'{dir_local}/data/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc'
-    path_clim = f'{dir_pesq}/data/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc'
+    path_fcst = get_path('corrected')
+    dir_out = get_path('heatwaves') + '/'
 
     print(f'\n\nIdentifying heat waves in the forecast - {model.upper()}\n\n')
-    previsao_onda_de_calor(
-        day,
+    check_definitions([args.definition], fields=['tmax'], lookback=False)
+    start_report('id_heatwaves_fcst', date=day.strftime('%Y%m%d'), model=model, region=region,
+                 ensemble=args.ensemble, chunked=args.chunked, date_end=args.date_end)
+
+    if args.date_end is not None:
+        main_hindcast(args, day, path_fcst, dir_out)
+        return
+
+    # Skipped when the last run had the same inputs and parameters
+    suffix = '.ens' if args.ensemble else ''
+    name = f'{model}.{day.strftime("%Y%m%d")}.onda_de_calor{definition_suffix(args.definition)}'
+    file_out = dir_out + f'{name}.{"prob.nc" if args.ensemble else "nc"}'
+    tag = f'{model}.{day.strftime("%Y%m%d")}.{region}{suffix}{definition_suffix(args.definition)}'
+    with stage('cache_check'):
+        inputs = [
+            find_corrected(path_fcst, model, region, members=int(args.ensemble)),
+            get_path('climatology'),
+            f'{get_path("masks")}/mask_region_{region}.nc',
+        ] + code_files(__file__)
+        key = stage_key(inputs, {'cov': cov, 'region': region, 'ensemble': args.ensemble, 'definition': args.definition})
+    if not args.force and is_fresh('detection', tag, key, [file_out]):
+        print(f'{file_out} is up to date (same inputs and parameters)\n')
+        save_report()
+        return
+
+    # Climatology copied to the scratch directory ([scratch] stage_in)
+    with stage('stage_in'):
+        path_clim = stage_in_file(get_path('climatology'), 'era5_reanalysis')
+    if args.ensemble:
+        previsao_onda_de_calor_ensemble(
+            day,
+            model=model,
+            area=region,
+            coverage=cov,
+            dir_forecast=path_fcst,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+            definition=args.definition,
+        )
+        record('detection', tag, key, [file_out])
+        save_report()
+        return
+
+    chunks = None
+    if args.chunked:
+        with xr.open_dataset(find_corrected(path_fcst, model, region)) as nc:
+            sizes = dict(nc.sizes)
+        chunks = chunks_for_budget(sizes, args.memory_budget, workers=args.workers or os.cpu_count())
+        print(f'Chunked mode: {chunks}')
+
+    with local_scheduler(args.workers) if args.chunked else nullcontext():
+        previsao_onda_de_calor(
+            day,
+            model=model,
+            area=region,
+            coverage=cov,
+            dir_forecast=path_fcst,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+            chunks=chunks,
+            definition=args.definition,
+        )
+    record('detection', tag, key, [file_out])
+    save_report()
+
+
+def main_hindcast(args, day, path_fcst, dir_out):
+    """Hindcast mode: detection for every initialization from --date to --date-end."""
+    if args.ensemble:
+        print('The hindcast mode reads the deterministic corrected forecasts (no --ensemble)')
+        exit()
+    model, region = args.model, args.region
+    inits = pd.date_range(day, pd.to_datetime(args.date_end), freq='D')
+    if len(inits) == 0:
+        print('--date-end must not be before --date')
+        exit()
+
+    file_out = dir_out + hindcast_output(model, inits[0], inits[-1], args.definition)
+    tag = f'{model}.{inits[0].strftime("%Y%m%d")}-{inits[-1].strftime("%Y%m%d")}.{region}.hindcast{definition_suffix(args.definition)}'
+    with stage('cache_check'):
+        inputs = [hindcast_file(path_fcst, model, init, region) for init in inits]
+        inputs += [
+            get_path('climatology'),
+            f'{get_path("masks")}/mask_region_{region}.nc',
+        ] + code_files(__file__)
+        key = stage_key(inputs, {'cov': args.cov, 'region': region, 'definition': args.definition})
+    if not args.force and is_fresh('detection', tag, key, [file_out]):
+        print(f'{file_out} is up to date (same inputs and parameters)\n')
+        save_report()
+        return
+
+    with stage('stage_in'):
+        path_clim = stage_in_file(get_path('climatology'), 'era5_reanalysis')
+    previsao_onda_de_calor_hindcast(
+        inits,
         model=model,
         area=region,
-        coverage=cov,
+        coverage=args.cov,
         dir_forecast=path_fcst,
         dir_climatology=path_clim,
-        dir_out=f'{dir_local}/data/out_HWI/'
+        dir_out=dir_out,
+        definition=args.definition,
+        workers=args.workers,
     )
+    record('detection', tag, key, [file_out])
+    save_report()
 
 
-main()
+if __name__ == '__main__':
+    main()
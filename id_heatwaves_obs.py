@@ -10,27 +10,53 @@ __email__ = "glicia.garcia@inpe.br"
 import argparse
 import os
 import warnings
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
 import xarray as xr
+from tools.assets import read_climatology
+from tools.checkpoint import checkpoint_dir, chunk_info, inputs_key, is_done, is_quarantined, load_checked, save_done
+from tools.chunking import chunks_for_budget, local_scheduler
+from tools.config import get_option, get_path, stage_in, stage_in_file
+from tools.heatwave_core import exceedance_statistics, heatwave_days, label_runs, sweep_events, sweep_statistics
+from tools.instrumentation import save_report, stage, start_report
+from tools.monitor import events_table, load_state, save_state, update_state
+from tools.netcdf_io import write_netcdf
+from tools.prefetch import load_netcdf, prefetch
+from tools.stage_cache import code_files
+from tools.thresholds import (DEFINITIONS, check_climatology, check_definitions, definition_suffix, exceedance,
+                              requirements)
+from tools.tracking import track_heatwaves
 from tools.tools_idhw_v2 import (  # Subroutines of the necessary functions
-    check_dir, split_list)
+    check_dir, read_region_mask, region_bounds, split_list, subset_region)
 
 warnings.filterwarnings('ignore')
 
 
-def onda_de_calor(
+def fill_missing(days, times):
+    """Function: NaN fields in place of the days that could not be read (None), so the period keeps all its days."""
+    template = next((day for day in days if day is not None), None)
+    if template is None:
+        print(f'ERROR: none of the reference files from {times[0]:%Y-%m-%d} to {times[-1]:%Y-%m-%d} could be read')
+        exit()
+
+    return [day if day is not None else xr.full_like(template, np.nan).assign_coords(time=[time])
+            for day, time in zip(days, times)]
+
+
+def read_reference_data(
         day_init,
         day_final,
         area=str,
-        coverage=float,
         dir_reference=str,
         dir_climatology=str,
-        dir_out=str,
+        chunks=None,
+        lookback=0,
+        tmin=False,
 ):
-    """This script identifies heat wave events in reference data.
+    """Read the ERA5 reference and the climatology of the period, masked by the region.
 
     Args:
         day_init (str): start date to find the event.
@@ -38,25 +64,36 @@ def onda_de_calor(
         area (str): region of interest.
         dir_reference (str): reference data directory.
         dir_climatology (str): climatology data directory.
-        dir_out (str): output data directory.
-    """
+        chunks (dict): dask chunks (chunked mode), None reads the data in memory.
+        lookback (int): days read before day_init (definitions with an acclimatization window).
+        tmin (bool): also read the daily minimum temperature (t2m_min_era5_*.nc files) as 'tmin'.
 
+    Returns:
+        (climatology dataset, reference dataset)
+    """
     # -----------------------------------------------------------------------------------------------------------------------------------------
 
-    dir_local = os.getcwd()
+    dir_mask = get_path('masks')
 
     # -----------------------------------------------------------------------------------------------------------------------------------------
     # Reading data
     # -----------------------------------------------------------------------------------------------------------------------------------------
 
-    times = pd.date_range(start=day_init, end=day_final, freq='D')
+    times = pd.date_range(start=day_init - timedelta(days=lookback), end=day_final, freq='D')
     times_clim = times.strftime('2020-%m-%d')
 
     print(f'\nStart date: {day_init} \nFinal date: {day_final}\n')
 
     # ERA5 Climatology
-    nc = xr.open_dataset(dir_climatology)
-    nc = nc.sel(time=slice(times_clim[0], times_clim[-1]))
+    # Only the window around the region is read and processed
+    bounds = region_bounds(area, dir_mask)
+
+    with stage('read_climatology'):
+        nc = read_climatology(dir_climatology, bounds, chunks=chunks)
+        nc = nc.sel(time=times_clim)  # calendar day of each day (periods crossing the year, non-leap years)
+        if chunks is None:
+            nc = nc.load()
+        nc = nc.astype(np.float32, copy=False)
 
     # Regrid data forecast
     # Extract target coordinates from the target dataset
@@ -66,67 +103,127 @@ def onda_de_calor(
     }
 
     # Region Mask
-    try:
-        read_mask = xr.open_dataset(f'{dir_local}/tools/mask_region_{area}.nc').rename({'lon': 'longitude', 'lat': 'latitude'})
-    except:
-        read_mask = xr.open_dataset(f'{dir_local}/tools/mask_region_{area}.nc')
-    regrid_mask = read_mask.interp(coords=target_coords, method='linear')
-
-    if len(regrid_mask.mask.data.shape) == 2:
-        mask = regrid_mask.mask.data
-    else:
-        mask = regrid_mask.mask[0].data
+    with stage('mask'):
+        mask = read_region_mask(area, target_coords, dir_mask)
     
-    # Climatology mask
-    nc = nc.where(mask, np.nan)
+        # Climatology mask
+        nc = nc.where(mask, np.nan)
 
     # Reference
-    nc_ref = xr.concat([
-        xr.open_dataset(f'{dir_reference}/{time.year}/t2m_max_era5_{time.strftime("%Y%m%d")}_p050.nc')
-        for time in times
-        ],
-        dim='time'
-    )
+    def file_reference(time, variable='max'):
+        return f'{dir_reference}/{time.year}/t2m_{variable}_era5_{time.strftime("%Y%m%d")}_p050.nc'
+
+    # The files that cannot be read are quarantined (tools/checkpoint.py) and their days are NaN
+    def read(time):
+        nc_day = load_checked(file_reference(time), lambda ds: subset_region(ds, bounds), chunks=chunks)
+        if nc_day is not None and tmin:
+            tmin_day = load_checked(file_reference(time, 'min'), lambda ds: subset_region(ds['t2m'], bounds), chunks=chunks)
+            nc_day = None if tmin_day is None else nc_day.assign(tmin=tmin_day)
+        return nc_day
+
+    if chunks is None:
+        # Each day is regridded while the next days are read (prefetch)
+        with stage('read_era5', days=len(times)):
+            list_days = []
+            for nc_day in prefetch(times, read):
+                if nc_day is not None:
+                    with stage('regrid'):
+                        nc_day = nc_day.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
+                list_days.append(nc_day)
+            nc_ref = xr.concat(fill_missing(list_days, times), dim='time')
+            del list_days
+    else:
+        with stage('read_era5', days=len(times)):
+            nc_ref = xr.concat(fill_missing([read(time) for time in times], times), dim='time')
 
+        # Regrid the source dataset using target coordinates
+        with stage('regrid'):
+            nc_ref = nc_ref.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
 
-    # Regrid the source dataset using target coordinates
-    nc_ref = nc_ref.interp(coords=target_coords, method='linear')
     nc1 = nc_ref.where(mask, np.nan)
     del nc_ref
 
-    # Fixing the required variables
-    Tmax = np.array(nc1['t2m'])
-    tmax_count = np.array(nc1['t2m'][0, :, :])
+    return nc, nc1
 
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    # COUNTING THE NUMBER OF GRID POINTS IN THE REGION
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    points_land = np.count_nonzero(~np.isnan(tmax_count))      # Total number of grid points over the continent.
-    print("total de pontos sobre o continente:", points_land, '\n')
 
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    # First criterion: clim Tmax + std for each grid point - climatological reference from 1981 to 2020 of ERA5.
-    # --------------------------------------------------------------------------------------------------------------------------------------------------
-    P1 = (nc['t2m'] + nc['std']).data
+def onda_de_calor(
+        day_init,
+        day_final,
+        area=str,
+        coverage=float,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_out=str,
+        chunks=None,
+        definition='std',
+):
+    """This script identifies heat wave events in reference data.
+
+    Args:
+        day_init (str): start date to find the event.
+        day_final (str): final date to find the event
+        area (str): region of interest.
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+        chunks (dict): dask chunks (chunked mode), None reads the data in memory.
+        definition (str): heat wave definition (tools/thresholds.py).
+    """
+    check_definitions([definition], fields=['tmax', 'tmin'])
+    fields, lookback = requirements([definition])
+
+    nc, nc1 = read_reference_data(
+        day_init,
+        day_final,
+        area=area,
+        dir_reference=dir_reference,
+        dir_climatology=dir_climatology,
+        chunks=chunks,
+        lookback=lookback,
+        tmin='tmin' in fields,
+    )
+    check_climatology([definition], nc, dir_climatology)
 
     # --------------------------------------------------------------------------------------------------------------------------------------------------
-    # APPLICATION OF THE CRITERION TMAX > clim Tmax + std WITH A MINIMUM OF 3 CONSECUTIVE DAYS.
+    # First criterion: exceedance of the definition for each grid point (default: Tmax > clim Tmax + std) -
+    # climatological reference from 1981 to 2020 of ERA5.
     # --------------------------------------------------------------------------------------------------------------------------------------------------
-    crit = np.where(Tmax > P1, Tmax, np.nan)
-    nc1['crit90'] = (('time', 'latitude', 'longitude'), crit)
+    with stage('detection', definition=definition):
+        inputs = {'tmax': nc1['t2m'].data, 'tmin': nc1['tmin'].data if 'tmin' in nc1 else None}
 
+        # Boolean mask (1 byte per point): Tmax above the threshold (crit90) is only built for the days written
+        exceed = nc1['t2m'].copy(data=exceedance([definition], inputs, nc)[definition])
+        del inputs
 
-    # Applying the second condition (minimum of three days).
+    # The days before the period only feed the definition (e.g. EHF acclimatization)
+    period = slice(lookback, None)
+    exceed = exceed.isel(time=period)
+    nc = nc.isel(time=period)
+    nc1 = nc1[['t2m']].isel(time=period)
+
+    # Fixing the required variables (lazy dask arrays in the chunked mode)
+    Tmax = nc1['t2m']
+
+    # --------------------------------------------------------------------------------------------------------------------------------------------------
+    # COUNTING THE NUMBER OF GRID POINTS IN THE REGION
+    # --------------------------------------------------------------------------------------------------------------------------------------------------
+    with stage('detection'):
+        points_land = int(Tmax[0].notnull().sum())      # Total number of grid points over the continent.
+        print("total de pontos sobre o continente:", points_land, '\n')
+
+        # ----------------------------------------------------------------------------------------------------------------------------------------------
+        # APPLICATION OF THE CRITERION WITH A MINIMUM OF 3 CONSECUTIVE DAYS.
+        # ----------------------------------------------------------------------------------------------------------------------------------------------
+        # Applying the second condition (minimum of three days).
+        count_valid = exceed.sum(dim=['latitude', 'longitude']).values
     list_index = []
-    for idx, value_time in enumerate(nc1.time.data):
-        value_time = pd.to_datetime(value_time)
-        count_valid = np.count_nonzero(~np.isnan(nc1.sel(time=value_time).crit90.data))
-        if (count_valid/points_land) > coverage:  # Spatial extent (default: 0.25).
+    for idx in range(len(count_valid)):
+        if (count_valid[idx]/points_land) > coverage:  # Spatial extent (default: 0.25).
             list_index.append(idx)
 
     # Eliminating list sequences of indices with a size smaller than 3
     list_filter = split_list(list_index)  # Separating by sequence of values
-    file_out = dir_out + f'reference.heatwaves.{day_init.strftime("%Y%m%d")}-{day_final.strftime("%Y%m%d")}.nc'
+    file_out = dir_out + f'reference.heatwaves.{day_init.strftime("%Y%m%d")}-{day_final.strftime("%Y%m%d")}{definition_suffix(definition)}.nc'
 
     # Saving the files with extreme temperatures
     check_dir(dir_out)
@@ -141,7 +238,7 @@ def onda_de_calor(
         for idx in list_filter:
             # Days with heatwave
             evento = nc1.isel(time=idx)
-            evento = evento.drop('t2m').rename_vars({'crit90': 't2m'})
+            evento['t2m'] = evento['t2m'].where(exceed.isel(time=idx))
             PI = evento.mean(dim=['time', 'latitude', 'longitude']).t2m.data
 
             #--------------------------------------------------------------------------------------------------------------------------------------------------
@@ -163,10 +260,485 @@ def onda_de_calor(
 
         if len(list_datasets) != 0:
             dataset_final = xr.merge(list_datasets)
-            dataset_final.to_netcdf(file_out)
+            with stage('write_output'):
+                write_netcdf(dataset_final, file_out, stage='reference_detection')
             print(f'\n\nSaving file in {file_out}')
 
 
+def checkpoint_onda_de_calor(
+        day_init,
+        day_final,
+        area=str,
+        coverage=float,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_out=str,
+        definition='std',
+):
+    """This script identifies heat wave events in reference data one year at a time, with checkpoints.
+
+    The daily sums of the criteria and the Tmax above the threshold of each year are saved
+    in [paths] cache/checkpoints (tools/checkpoint.py) as soon as the year is done, so a run
+    restarted after a failure only computes the years not saved yet. The criteria are
+    applied to the whole period at the end (the events crossing the years are kept) and
+    the output is the one of onda_de_calor.
+
+    Args:
+        day_init (str): start date to find the event.
+        day_final (str): final date to find the event
+        area (str): region of interest.
+        coverage (float): spatial coverage of the heat wave.
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+        definition (str): heat wave definition (tools/thresholds.py).
+    """
+    check_definitions([definition], fields=['tmax', 'tmin'])
+    fields, lookback = requirements([definition])
+    variables = ['max', 'min'] if 'tmin' in fields else ['max']
+    directory = checkpoint_dir(f'reference.{area}{definition_suffix(definition)}')
+    sums = ['points', 'count', 'tmax_sum', 'p75_sum', 'p75_count']
+
+    def file_reference(time, variable):
+        return f'{dir_reference}/{time.year}/t2m_{variable}_era5_{time.strftime("%Y%m%d")}_p050.nc'
+
+    chunks = []
+    for year in range(day_init.year, day_final.year + 1):
+        first, last = max(day_init, pd.Timestamp(year, 1, 1)), min(day_final, pd.Timestamp(year, 12, 31))
+        chunk = f'{directory}/{first.strftime("%Y%m%d")}-{last.strftime("%Y%m%d")}.nc'
+        chunks.append(chunk)
+
+        files = [file_reference(time, variable) for time in pd.date_range(first - timedelta(days=lookback), last, freq='D')
+                 for variable in variables]
+        key = inputs_key(files + [dir_climatology] + code_files(__file__),
+                         {'region': area, 'definition': definition})
+        if is_done(chunk, key):
+            print(f'{year}: checkpoint {chunk}')
+            continue
+
+        nc, nc1 = read_reference_data(
+            first,
+            last,
+            area=area,
+            dir_reference=dir_reference,
+            dir_climatology=dir_climatology,
+            lookback=lookback,
+            tmin='tmin' in fields,
+        )
+        check_climatology([definition], nc, dir_climatology)
+
+        with stage('detection', definition=definition):
+            inputs = {'tmax': nc1['t2m'].data, 'tmin': nc1['tmin'].data if 'tmin' in nc1 else None}
+            exceed = exceedance([definition], inputs, nc)[definition][lookback:]
+            del inputs
+
+            # The days before the year only feed the definition (e.g. EHF acclimatization)
+            result = nc1[['t2m']].isel(time=slice(lookback, None))
+            tmax = result['t2m'].data
+            stats = exceedance_statistics(exceed, tmax, nc['percentil75'].data[lookback:])
+            stats['points'] = np.count_nonzero(~np.isnan(tmax), axis=(-2, -1))  # 0 on the days that could not be read
+            result['t2m'] = result['t2m'].where(exceed)
+            for name in sums:
+                result[name] = ('time', stats[name])
+
+        with stage('checkpoint'):
+            save_done(chunk, key, lambda filename: write_netcdf(result, filename, pack=[], float32=False),
+                      quarantined=[f for f in files if is_quarantined(f)])
+        print(f'{year}: saved in {chunk}')
+        del nc, nc1, result, exceed
+
+    # Criteria over the whole period
+    with stage('detection', definition=definition):
+        daily = xr.concat([load_netcdf(chunk, lambda ds: ds[sums]) for chunk in chunks], dim='time')
+        stats = {name: daily[name].data for name in sums}
+        points = stats['points'][stats['points'] > 0]
+        stats['points'] = points[0] if len(points) != 0 else 0  # first day read, as onda_de_calor
+        print("total de pontos sobre o continente:", stats['points'], '\n')
+        criteria = heatwave_days(stats, coverage=coverage)
+
+    quarantined = sorted({f for chunk in chunks for f in chunk_info(chunk).get('quarantined', [])})
+    if len(quarantined) != 0:
+        print(f'Warning: {len(quarantined)} quarantined files (days without data):', *quarantined, sep='\n    ')
+
+    events = label_runs(criteria['heatwave'])
+    for label in np.unique(events[events > 0]):
+        days = daily.time.dt.strftime('%Y-%m-%d').data[events == label]
+        print("\nEvento de onda de calor identificado!")
+        print(f'Evento com {len(days)} dias de duração: {days[0]} - {days[-1]}')
+
+    file_out = dir_out + f'reference.heatwaves.{day_init.strftime("%Y%m%d")}-{day_final.strftime("%Y%m%d")}{definition_suffix(definition)}.nc'
+    check_dir(dir_out)
+    heatwave = daily.time.data[criteria['heatwave']]
+    if len(heatwave) != 0:
+        with stage('write_output'):
+            dataset = xr.concat([load_netcdf(chunk, lambda ds: ds[['t2m']].isel(time=np.isin(ds.time.data, heatwave)))
+                                 for chunk in chunks], dim='time')
+            write_netcdf(dataset, file_out, stage='reference_detection')
+        print(f'\n\nSaving file in {file_out}')
+
+
+def sensibilidade_onda_de_calor(
+        day_init,
+        day_final,
+        area=str,
+        coverages=list,
+        min_days=list,
+        std_factors=list,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_out=str,
+):
+    """This script evaluates the heat wave criteria for many thresholds in one data pass.
+
+    The reference and the climatology are read once, and the number of events,
+    heat wave days and mean duration are computed for every combination of
+    std multiplier, spatial coverage, minimum duration and P75 intensity test.
+
+    Args:
+        day_init (str): start date to find the event.
+        day_final (str): final date to find the event
+        area (str): region of interest.
+        coverages (list): spatial coverages of the heat wave.
+        min_days (list): minimum numbers of consecutive days.
+        std_factors (list): std multipliers of the threshold (clim Tmax + k * std).
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+    """
+
+    nc, nc1 = read_reference_data(
+        day_init,
+        day_final,
+        area=area,
+        dir_reference=dir_reference,
+        dir_climatology=dir_climatology,
+    )
+
+    with stage('detection', std_factors=len(std_factors)):
+        stats = sweep_statistics(
+            nc1['t2m'].data,
+            nc['t2m'].data,
+            nc['std'].data,
+            nc['percentil75'].data,
+            std_factors,
+        )
+        events = sweep_events(stats, coverages, min_days)
+
+    dims = ('std_factor', 'coverage', 'min_days', 'p75_test')
+    dataset = xr.Dataset(
+        {name: (dims, value) for name, value in events.items()},
+        coords={
+            'std_factor': std_factors,
+            'coverage': coverages,
+            'min_days': min_days,
+            'p75_test': [0, 1],
+        },
+    )
+    dataset['n_events'].attrs['long_name'] = 'Number of heat wave events'
+    dataset['heatwave_days'].attrs['long_name'] = 'Number of heat wave days'
+    dataset['mean_duration'].attrs['long_name'] = 'Mean duration of the events (days)'
+    dataset['p75_test'].attrs['long_name'] = 'Intensity test (mean Tmax of the event > P75) applied'
+
+    check_dir(dir_out)
+    file_out = dir_out + f'reference.sweep.{area}.{day_init.strftime("%Y%m%d")}-{day_final.strftime("%Y%m%d")}.nc'
+    with stage('write_output'):
+        write_netcdf(dataset, file_out)
+
+    table = dataset.to_dataframe().reset_index()
+    print(table.to_string(index=False, float_format='%.2f'))
+    print(f'\n\nSaving file in {file_out}')
+
+
+def definicoes_onda_de_calor(
+        day_init,
+        day_final,
+        area=str,
+        definitions=list,
+        coverage=float,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_out=str,
+):
+    """This script compares heat wave definitions in the reference data in one data pass.
+
+    The reference and the climatology are read once, each definition produces its
+    exceedance field (tools/thresholds.py) and the spatial coverage, minimum
+    duration and intensity criteria are applied to all of them.
+
+    Args:
+        day_init (str): start date to find the event.
+        day_final (str): final date to find the event
+        area (str): region of interest.
+        definitions (list): names of the definitions.
+        coverage (float): spatial coverage of the heat wave.
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+    """
+    check_definitions(definitions, fields=['tmax', 'tmin'])
+    fields, lookback = requirements(definitions)
+
+    nc, nc1 = read_reference_data(
+        day_init,
+        day_final,
+        area=area,
+        dir_reference=dir_reference,
+        dir_climatology=dir_climatology,
+        lookback=lookback,
+        tmin='tmin' in fields,
+    )
+    check_climatology(definitions, nc, dir_climatology)
+
+    # The days before the period only feed the definitions (e.g. EHF acclimatization)
+    period = slice(lookback, None)
+    with stage('detection', definitions=len(definitions)):
+        inputs = {'tmax': nc1['t2m'].data, 'tmin': nc1['tmin'].data if 'tmin' in nc1 else None}
+        tmax = nc1['t2m'].data[period]
+        p75 = nc['percentil75'].data[period]
+
+        results = {}
+        for name, exceed in exceedance(definitions, inputs, nc).items():
+            exceed = exceed[period]
+            criteria = heatwave_days(exceedance_statistics(exceed, tmax, p75), coverage=coverage)
+            criteria['days'] = np.count_nonzero(exceed & criteria['heatwave'][:, None, None], axis=0)
+            results[name] = criteria
+
+    def stack(key):
+        return np.stack([results[name][key] for name in definitions])
+
+    dataset = xr.Dataset(
+        {
+            'fraction': (('definition', 'time'), stack('fraction')),
+            'heatwave': (('definition', 'time'), stack('heatwave')),
+            'intensity': (('definition', 'time'), stack('intensity')),
+            'heatwave_days': (('definition', 'latitude', 'longitude'),
+                              np.where(np.isnan(tmax[0]), np.nan, stack('days'))),
+        },
+        coords={
+            'definition': definitions,
+            'time': nc1.time.data[period],
+            'latitude': nc1.latitude.data,
+            'longitude': nc1.longitude.data,
+        },
+    )
+    dataset['fraction'].attrs['long_name'] = 'Fraction of the region above the threshold of the definition'
+    dataset['heatwave'].attrs['long_name'] = 'Heat wave day'
+    dataset['intensity'].attrs['long_name'] = 'Mean Tmax above the threshold during the event'
+    dataset['heatwave_days'].attrs['long_name'] = 'Number of heat wave days above the threshold at the grid point'
+    dataset['definition'].attrs['long_name'] = '; '.join(f'{name}: {DEFINITIONS[name]["long_name"]}' for name in definitions)
+    dataset.attrs['coverage'] = coverage
+
+    check_dir(dir_out)
+    file_out = dir_out + f'reference.definitions.{area}.{day_init.strftime("%Y%m%d")}-{day_final.strftime("%Y%m%d")}.nc'
+    with stage('write_output'):
+        write_netcdf(dataset, file_out)
+
+    heatwave = dataset['heatwave'].data
+    starts = heatwave & ~np.pad(heatwave, ((0, 0), (1, 0)))[:, :-1]
+    table = pd.DataFrame({
+        'definition': definitions,
+        'events': np.count_nonzero(starts, axis=1),
+        'heatwave_days': np.count_nonzero(heatwave, axis=1),
+        'max_fraction': np.nanmax(dataset['fraction'].data, axis=1),
+    })
+    print(table.to_string(index=False, float_format='%.2f'))
+    print(f'\n\nSaving file in {file_out}')
+
+
+def rastreamento_onda_de_calor(
+        day_init,
+        day_final,
+        area=str,
+        min_points=int,
+        min_days=int,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_out=str,
+):
+    """This script tracks the heat waves in space in the reference data.
+
+    The grid points with Tmax > clim Tmax + std (crit90) are grouped in
+    connected regions each day, and the regions are linked across consecutive
+    days by overlap, so separate hot spots are separate events and a moving
+    hot air mass is followed.
+
+    Args:
+        day_init (str): start date to find the event.
+        day_final (str): final date to find the event
+        area (str): region of interest.
+        min_points (int): minimum number of grid points of a daily region.
+        min_days (int): minimum duration of a tracked event.
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+    """
+
+    nc, nc1 = read_reference_data(
+        day_init,
+        day_final,
+        area=area,
+        dir_reference=dir_reference,
+        dir_climatology=dir_climatology,
+    )
+
+    Tmax = nc1['t2m'].data
+    P1 = (nc['t2m'] + nc['std']).data
+
+    with stage('detection'):
+        event_labels, path, summary = track_heatwaves(
+            Tmax > P1,
+            Tmax,
+            pd.to_datetime(nc1.time.data).normalize(),
+            nc1.latitude.data,
+            nc1.longitude.data,
+            min_points=min_points,
+            min_days=min_days,
+        )
+
+    check_dir(dir_out)
+    name = f'reference.tracks.{area}.{day_init.strftime("%Y%m%d")}-{day_final.strftime("%Y%m%d")}'
+
+    dataset = xr.Dataset(
+        {'event': (('time', 'latitude', 'longitude'), event_labels)},
+        coords={'time': nc1.time.data, 'latitude': nc1.latitude.data, 'longitude': nc1.longitude.data},
+    )
+    dataset['event'].attrs['long_name'] = 'Tracked heat wave event (0: no event)'
+    with stage('write_output'):
+        write_netcdf(dataset, f'{dir_out}{name}.nc')
+        path.to_csv(f'{dir_out}{name}.path.csv', index=False, float_format='%.3f')
+        summary.to_csv(f'{dir_out}{name}.events.csv', index=False, float_format='%.3f')
+
+    print(f'{len(summary)} eventos rastreados\n')
+    if len(summary) != 0:
+        print(summary.to_string(index=False, float_format='%.1f'))
+    print(f'\n\nSaving files in {dir_out}{name}.*')
+
+
+def monitor_onda_de_calor(
+        day_init,
+        day_final,
+        area=str,
+        coverage=float,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_out=str,
+        definition='std',
+        min_days=3,
+):
+    """This script updates the reference heat waves with the ERA5 days not processed yet.
+
+    The regional sums of the criteria of the open sequence of extreme days are kept
+    in a state file ([paths] cache/monitor), so each run only reads the new days and
+    rewrites the file of the event they extend. The criteria are the ones of onda_de_calor.
+
+    Args:
+        day_init (str): first day processed when there is no state yet.
+        day_final (str): last day processed (stops before at the first missing ERA5 file).
+        area (str): region of interest.
+        coverage (float): spatial coverage of the heat wave.
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_out (str): output data directory.
+        definition (str): heat wave definition (tools/thresholds.py).
+        min_days (int): minimum number of consecutive days.
+    """
+    check_definitions([definition], fields=['tmax'], lookback=False)
+    dir_mask = get_path('masks')
+
+    name = f'reference.{area}{definition_suffix(definition)}'
+    dir_state = f'{get_path("cache")}/monitor'
+    dir_days = f'{dir_state}/{name}.days'  # Tmax above the threshold of the days of the open run
+    state = load_state(f'{dir_state}/{name}.json',
+                       {'region': area, 'cov': coverage, 'definition': definition, 'min_days': min_days})
+
+    if state['last_day'] is not None:
+        day_init = pd.Timestamp(state['last_day']) + timedelta(days=1)
+    days = pd.date_range(day_init, day_final, freq='D')
+    print(f'\nLast day processed: {state["last_day"]} - {len(days)} new days until {day_final.strftime("%Y-%m-%d")}\n')
+
+    def file_reference(time):
+        return f'{dir_reference}/{time.year}/t2m_max_era5_{time.strftime("%Y%m%d")}_p050.nc'
+
+    def file_event(start):
+        return f'{dir_out}reference.heatwave.{area}.{pd.Timestamp(start).strftime("%Y%m%d")}{definition_suffix(definition)}.nc'
+
+    def file_day(time):
+        return f'{dir_days}/{pd.Timestamp(time).strftime("%Y%m%d")}.nc'
+
+    # The climatology is opened lazily: only the calendar day of each new day is read
+    bounds = region_bounds(area, dir_mask)
+    clim = read_climatology(dir_climatology, bounds)
+    check_climatology([definition], clim, dir_climatology)
+    clim = clim[DEFINITIONS[definition]['climatology'] + ['percentil75']]
+    target_coords = {
+        'latitude': clim['latitude'],
+        'longitude': clim['longitude']
+    }
+    with stage('mask'):
+        mask = read_region_mask(area, target_coords, dir_mask)
+
+    check_dir(dir_out)
+    check_dir(dir_days)
+    for day in days:
+        if not os.path.isfile(file_reference(day)):
+            print(f'{file_reference(day).split("/")[-1]} is not available yet')
+            break
+
+        with stage('read_era5', days=1):
+            nc_day = load_checked(file_reference(day), lambda ds: subset_region(ds[['t2m']], bounds))
+        if nc_day is None:
+            break  # the days are processed in order: the monitor waits for the file to be replaced
+        with stage('regrid'):
+            nc_day = nc_day.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
+            nc_day = nc_day.where(mask, np.nan)
+        with stage('read_climatology'):
+            clim_day = clim.sel(time=[day.strftime('2020-%m-%d')]).load().astype(np.float32, copy=False)
+            clim_day = clim_day.where(mask, np.nan)
+
+        with stage('detection'):
+            tmax = nc_day['t2m'].data
+            exceed = exceedance([definition], {'tmax': tmax}, clim_day)[definition]
+            stats = exceedance_statistics(exceed, tmax, clim_day['percentil75'].data)
+            result = update_state(state, day, {key: np.ravel(value)[0] for key, value in stats.items() if key != 'exceed'},
+                                  coverage=coverage, min_days=min_days)
+
+        # Days of the open run: kept until the run is closed
+        if state['run'] is not None:
+            day_field = nc_day.where(exceed).assign_coords(time=[day])
+            write_netcdf(day_field, file_day(day), stage='reference_detection')
+
+        # Only the event extended by the day is rewritten
+        event = result['event']
+        if event is not None:
+            with stage('write_output'):
+                if event['heatwave']:
+                    run_days = pd.date_range(event['start'], event['end'], freq='D')
+                    dataset = xr.concat([load_netcdf(file_day(time)) for time in run_days], dim='time')
+                    dataset.attrs.update({key: str(value) for key, value in event.items() if key != 'ongoing'})
+                    write_netcdf(dataset, file_event(event['start']), stage='reference_detection')
+                    print(f'{day.strftime("%Y-%m-%d")}: heat wave since {event["start"]} ({event["days"]} days)')
+                elif os.path.isfile(file_event(event['start'])):
+                    os.remove(file_event(event['start']))  # the intensity fell below the P75
+
+        if result['closed'] is not None:
+            for time in pd.date_range(result['closed']['start'], periods=result['closed']['days'], freq='D'):
+                os.remove(file_day(time))
+
+        save_state(state, f'{dir_state}/{name}.json')
+
+    table = events_table(state)
+    table.to_csv(f'{dir_out}{name}.monitor.events.csv', index=False, float_format='%.3f')
+    print(f'\nLast day processed: {state["last_day"]}')
+    if len(table) != 0:
+        print(table.to_string(index=False, float_format='%.2f'))
+    print(f'\n\nSaving files in {dir_out}reference.heatwave.{area}.*')
+
+
+def list_of(kind):
+    """Parse a comma-separated list of values."""
+    return lambda text: [kind(value) for value in text.split(',')]
+
+
 def arguments():
     parser = argparse.ArgumentParser(prog='id_heatwaves.py')
     parser.add_argument(
@@ -200,6 +772,100 @@ def arguments():
 
     )
 
+    parser.add_argument(
+        '--definition',
+        type=str,
+        default='std',
+        choices=list(DEFINITIONS),
+        help='Heat wave definition (tools/thresholds.py)',
+    )
+
+    parser.add_argument(
+        '--compare-definitions',
+        type=list_of(str),
+        default=None,
+        help='Compare heat wave definitions separated by commas in one pass (e.g. std,p90,ehf)',
+    )
+
+    parser.add_argument(
+        '--chunked',
+        action='store_true',
+        help='Lazy computation over chunks (large domains / long periods)',
+    )
+
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        default=get_option('run', 'memory_budget', float),
+        help='Memory budget of the chunked mode (MB)',
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('run', 'workers', int),
+        help='Threads of the chunked mode (default: number of cores)',
+    )
+
+    parser.add_argument(
+        '--track',
+        action='store_true',
+        help='Spatial tracking of the heat waves (connected regions linked across days)',
+    )
+
+    parser.add_argument(
+        '--track-min-points',
+        type=int,
+        default=10,
+        help='Minimum number of grid points of a tracked region',
+    )
+
+    parser.add_argument(
+        '--track-min-days',
+        type=int,
+        default=3,
+        help='Minimum duration of a tracked event',
+    )
+
+    parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help='Long periods: one year at a time, saved in [paths] cache/checkpoints (a new run resumes from the years saved)',
+    )
+
+    parser.add_argument(
+        '--monitor',
+        action='store_true',
+        help='Incremental detection: only the days after the last run are read (--date-init only starts the monitor)',
+    )
+
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help='Evaluate all combinations of --sweep-cov, --sweep-days and --sweep-std in one pass',
+    )
+
+    parser.add_argument(
+        '--sweep-cov',
+        type=list_of(float),
+        default=[0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5],
+        help='Spatial coverages separated by commas',
+    )
+
+    parser.add_argument(
+        '--sweep-days',
+        type=list_of(int),
+        default=[2, 3, 4, 5],
+        help='Minimum numbers of consecutive days separated by commas',
+    )
+
+    parser.add_argument(
+        '--sweep-std',
+        type=list_of(float),
+        default=[0.5, 1.0, 1.5, 2.0],
+        help='Std multipliers of the threshold separated by commas',
+    )
+
 
     return parser.parse_args()
 
@@ -212,26 +878,132 @@ def main():
     day_end = pd.to_datetime(args.date_end)
     cov = args.cov
 
-    dir_pesq = '/pesq/share/monan/curso_OMM_INPE_2025/Validation/HeatWave/HWI-tool/'
-
-    dir_local = os.getcwd()
-    #path_ref = f'{dir_local}/dados/dados_diarios_era5'
-    path_ref = f'{dir_pesq}/data/era5_reanalysis'
-
-    #path_clim = f'{dir_local}/dados/dados_diarios_era5/climatology.daily.t2m_max.ERA5.1981_2020.nc'
-    path_clim = f'{dir_pesq}/data/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc'
-    
+    dir_out = get_path('heatwaves') + '/'
+
+    mode = 'sweep' if args.sweep else 'track' if args.track else 'definitions' if args.compare_definitions else \
+        'monitor' if args.monitor else 'detection'
+    start_report('id_heatwaves_obs', date_init=day_first.strftime('%Y%m%d'), date_end=day_end.strftime('%Y%m%d'),
+                 region=region, mode=mode)
+
+    # Reference files of the definitions (Tmin, days before the period)
+    definitions = args.compare_definitions if mode == 'definitions' else [args.definition] if mode in ('detection', 'monitor') else ['std']
+    check_definitions(definitions, fields=['tmax', 'tmin'])
+    fields, lookback = requirements(definitions)
+    variables = ['max', 'min'] if 'tmin' in fields else ['max']
+
+    # The monitor reads the new days only (no stage-in of the period)
+    if mode == 'monitor':
+        print('\n\nMonitoramento de onda de calor na referência\n\n')
+        monitor_onda_de_calor(
+            day_first,
+            day_end,
+            area=region,
+            coverage=cov,
+            dir_reference=get_path('era5'),
+            dir_climatology=stage_in_file(get_path('climatology'), 'era5_reanalysis'),
+            dir_out=dir_out,
+            definition=args.definition,
+        )
+        save_report()
+        return
+
+    # Inputs copied to the scratch directory ([scratch] stage_in)
+    with stage('stage_in'):
+        path_ref = stage_in(
+            get_path('era5'),
+            [f'{t.strftime("%Y")}/t2m_{variable}_era5_{t.strftime("%Y%m%d")}_p050.nc'
+             for t in pd.date_range(day_first - timedelta(days=lookback), day_end, freq='D') for variable in variables],
+            'era5_reanalysis',
+        )
+        path_clim = stage_in_file(get_path('climatology'), 'era5_reanalysis')
+
+    if mode == 'definitions':
+        print(f'\n\nComparação de definições de onda de calor na referência\n\n')
+        definicoes_onda_de_calor(
+            day_first,
+            day_end,
+            area=region,
+            definitions=definitions,
+            coverage=cov,
+            dir_reference=path_ref,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+        )
+        save_report()
+        return
+
+    if args.sweep:
+        print(f'\n\nSensibilidade dos critérios de onda de calor na referência\n\n')
+        sensibilidade_onda_de_calor(
+            day_first,
+            day_end,
+            area=region,
+            coverages=args.sweep_cov,
+            min_days=args.sweep_days,
+            std_factors=args.sweep_std,
+            dir_reference=path_ref,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+        )
+        save_report()
+        return
+
+    if args.track:
+        print(f'\n\nRastreamento de onda de calor na referência\n\n')
+        rastreamento_onda_de_calor(
+            day_first,
+            day_end,
+            area=region,
+            min_points=args.track_min_points,
+            min_days=args.track_min_days,
+            dir_reference=path_ref,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+        )
+        save_report()
+        return
+
+    if args.checkpoint and args.chunked:
+        print('--checkpoint reads one year at a time in memory: it is not used with --chunked')
+        exit()
+
+    chunks = None
+    if args.chunked:
+        with xr.open_dataset(path_clim) as nc:
+            sizes = dict(nc.sizes)
+        sizes['time'] = (day_end - day_first).days + 1 + lookback
+        chunks = chunks_for_budget(sizes, args.memory_budget, workers=args.workers or os.cpu_count())
+        print(f'Chunked mode: {chunks}')
 
     print(f'\n\nIdentificação de onda de calor na referência\n\n')
-    onda_de_calor(
-        day_first,
-        day_end,
-        area=region,
-        coverage=cov,
-        dir_reference=path_ref,
-        dir_climatology=path_clim,
-        dir_out=f'{dir_local}/data/out_HWI/'
-    )
-
-
-main()
+    if args.checkpoint:
+        checkpoint_onda_de_calor(
+            day_first,
+            day_end,
+            area=region,
+            coverage=cov,
+            dir_reference=path_ref,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+            definition=args.definition,
+        )
+        save_report()
+        return
+
+    with local_scheduler(args.workers) if args.chunked else nullcontext():
+        onda_de_calor(
+            day_first,
+            day_end,
+            area=region,
+            coverage=cov,
+            dir_reference=path_ref,
+            dir_climatology=path_clim,
+            dir_out=dir_out,
+            chunks=chunks,
+            definition=args.definition,
+        )
+    save_report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import re
+import warnings
+from glob import glob
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from tools.config import get_option, get_path
+from tools.instrumentation import save_report, stage, start_report
+from tools.netcdf_io import write_netcdf
+from tools.tools_idhw_v2 import check_dir
+
+warnings.filterwarnings('ignore')
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# GFS GRIB2 files (download_gfs.py) to NetCDF files in the layout of the MONAN forecasts:
+#   <gfs_netcdf>/<YYYYMMDDHH>/GFS_<init YYYYMMDDHH>_<valid YYYYMMDDHH>.00.00.nc
+# with t2m (K) and dimensions (Time, latitude, longitude), ascending latitudes and
+# longitudes in -180..180, cut to the [gfs] domain window. The forecast hours are
+# decoded in parallel processes. Needs cfgrib (ecCodes).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+# GRIB field written as t2m: 2 m temperature (instantaneous) or 2 m maximum temperature
+# (maximum since the previous output, which gives the true daily maximum with
+# bias_correction.py --tmax-source hourly)
+GRIB_FIELDS = {
+    'tmax': {'typeOfLevel': 'heightAboveGround', 'level': 2, 'stepType': 'max', 'shortName': 'tmax'},
+    'tmp': {'typeOfLevel': 'heightAboveGround', 'level': 2, 'stepType': 'instant', 'shortName': '2t'},
+}
+
+GFS_FILE = re.compile(r'gfs\.t\d{2}z\.pgrb2\.\w+\.f(\d{3})$')
+
+
+def gfs_files(dir_grib):
+    """Function: GRIB files of a run (forecast hour, file name), sorted by forecast hour."""
+    files = []
+    for filename in glob(f'{dir_grib}/gfs.t*z.pgrb2.*.f*'):
+        match = GFS_FILE.search(filename)
+        if match:
+            files.append((int(match.group(1)), filename))
+    return sorted(files)
+
+
+def decode_field(filename, field='tmax', domain=None):
+    """Function: Decode one 2 m temperature field of a GRIB2 file.
+    :param filename: GRIB2 file.
+    :type filename: str
+    :param field: key of GRIB_FIELDS.
+    :type field: str
+    :param domain: (lat_min, lat_max, lon_min, lon_max) window (longitudes in -180..180), None for the globe.
+    :type domain: tuple
+    :return: xarray.DataArray t2m (K) with dimensions (Time, latitude, longitude), None when the file has no such field.
+    """
+    with xr.open_dataset(
+        filename,
+        engine='cfgrib',
+        backend_kwargs={'filter_by_keys': GRIB_FIELDS[field], 'indexpath': ''},
+    ) as ds:
+        if len(ds.data_vars) == 0:
+            return None
+        data = next(iter(ds.data_vars.values()))
+        valid = pd.to_datetime(data['valid_time'].values)
+
+        # MONAN layout: longitudes in -180..180 and ascending latitudes
+        data = data.assign_coords(longitude=(data['longitude'] + 180) % 360 - 180)
+        data = data.sortby('longitude').sortby('latitude')
+
+        # Only the window is read from the decoded message
+        if domain is not None:
+            lat_min, lat_max, lon_min, lon_max = domain
+            data = data.sel(latitude=slice(lat_min, lat_max), longitude=slice(lon_min, lon_max))
+        data = data.load().astype(np.float32, copy=False)
+
+    if data.attrs.get('units') in ('C', 'degC'):
+        data += 273.15
+    data = data.drop_vars([name for name in data.coords if name not in ('latitude', 'longitude')])
+    data = data.expand_dims(Time=[valid]).rename('t2m')
+    data.attrs = {'units': 'K', 'long_name': f'2 m temperature ({field})'}
+
+    return data
+
+
+def output_file(dir_out, init, valid):
+    """Function: NetCDF file of one forecast hour (MONAN-like name)."""
+    return f'{dir_out}/{init.strftime("%Y%m%d%H")}/GFS_{init.strftime("%Y%m%d%H")}_{valid.strftime("%Y%m%d%H")}.00.00.nc'
+
+
+def ingest_file(hour, filename, init, dir_out, field='tmax', domain=None):
+    """Function: Decode one forecast hour and write its NetCDF file (run in a worker process).
+    :return: output file, None when the GRIB file has no such field (e.g. no TMAX at the analysis).
+    """
+    data = decode_field(filename, field, domain)
+    if data is None:
+        return None
+
+    file_out = output_file(dir_out, init, init + pd.Timedelta(hours=hour))
+    check_dir(os.path.dirname(file_out))
+    write_netcdf(data, file_out)
+    return file_out
+
+
+def list_of(kind):
+    """Parse a comma-separated list of values."""
+    return lambda text: [kind(value) for value in text.split(',')]
+
+
+def arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='ingest_gfs.py')
+    parser.add_argument(
+        '--date',
+        type=str,
+        required=True,
+        help='Initialization: %Y%m%d%H',
+    )
+    parser.add_argument(
+        '--field',
+        type=str,
+        choices=list(GRIB_FIELDS),
+        default='tmax',
+        help='GRIB field written as t2m: tmax (TMAX 2 m) or tmp (TMP 2 m)',
+    )
+    parser.add_argument(
+        '--domain',
+        type=list_of(float),
+        default=get_option('gfs', 'domain', list_of(float)),
+        help='Window: lat_min,lat_max,lon_min,lon_max (longitudes in -180..180)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('gfs', 'workers', int) or 1,
+        help='Forecast hours decoded at the same time (processes)',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = arguments(argv)
+    init = pd.to_datetime(args.date, format='%Y%m%d%H')
+    if importlib.util.find_spec('cfgrib') is None:
+        print('ingest_gfs.py needs cfgrib (pip install cfgrib, with the ecCodes library)')
+        exit()
+    start_report('ingest_gfs', date=args.date, field=args.field)
+
+    dir_grib = f'{get_path("gfs")}/{init.strftime("%Y%m%d%H")}'
+    dir_out = get_path('gfs_netcdf')
+    with stage('file_discovery'):
+        files = gfs_files(dir_grib)
+    if len(files) == 0:
+        print(f'ERROR in Accessing {dir_grib}')
+        exit()
+
+    tasks = [(hour, filename, init, dir_out, args.field, args.domain) for hour, filename in files]
+    with stage('decode', files=len(tasks)):
+        if args.workers > 1:
+            with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+                written = pool.starmap(ingest_file, tasks)
+        else:
+            written = [ingest_file(*task) for task in tasks]
+
+    written = [f for f in written if f is not None]
+    print(f'\n{len(written)} of {len(files)} forecast hours written in {dir_out}/{init.strftime("%Y%m%d%H")}\n')
+    save_report()
+
+
+if __name__ == '__main__':
+    main()
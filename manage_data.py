@@ -0,0 +1,118 @@
+import argparse
+import os
+from datetime import date
+
+import pandas as pd
+
+from tools.config import get_option, get_path
+from tools.instrumentation import save_report, stage, start_report
+from tools.retention import LIMITS, apply_policy, archive_files, index_directory, remove_empty_dirs, remove_files
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Lifecycle of the data directories (forecasts, corrected forecasts, heat waves, figures).
+# The policies of each directory are read from the [retention] section of
+# hwi_config.ini (<directory>_max_age, _max_files, _max_size and _compact).
+# The forecasts directory holds the shared MONAN inputs: it is not in the default
+# directories and has no policy in hwi_config.ini.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+DIRECTORIES = ['corrected', 'heatwaves', 'figures', 'tiles']
+
+
+def retention_policy(name):
+    """Function: Policy of a directory of [paths] ([retention] <name>_<limit>, None: no limit)."""
+    return {limit: get_option('retention', f'{name}_{limit}', float) for limit in LIMITS}
+
+
+def manage_directory(name, root, now, dry_run=False, workers=None):
+    """Function: Apply the retention policy to one directory.
+    :param name: key of the directory in [paths] (e.g. heatwaves).
+    :type name: str
+    :param root: directory.
+    :type root: str
+    :param now: reference time of the ages.
+    :type now: datetime
+    :param dry_run: only report what would be done.
+    :type dry_run: bool
+    :param workers: threads used to remove and archive the files.
+    :type workers: int
+    :return: dict with the summary of the directory.
+    """
+    policy = retention_policy(name)
+    with stage('index', directory=name):
+        index = index_directory(root)
+    remove, archive = apply_policy(index, now, **policy)
+
+    summary = {
+        'directory': name,
+        'files': len(index),
+        'size_mb': index['size'].sum() / 2**20,
+        'remove': int(remove.sum()),
+        'remove_mb': index['size'][remove].sum() / 2**20,
+        'archive': int(archive.sum()),
+        'months': index['date'][archive].dt.strftime('%Y%m').nunique(),
+    }
+    if dry_run:
+        return summary
+
+    if archive.any():
+        with stage('archive', directory=name, files=int(archive.sum())):
+            archive_files(root, list(index['path'][archive]), list(index['date'][archive]), workers)
+    with stage('remove', directory=name, files=int((remove | archive).sum())):
+        remove_files(index['path'][remove | archive], workers)
+        remove_empty_dirs(root)
+
+    return summary
+
+
+def arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='manage_data.py')
+    parser.add_argument(
+        '--dirs',
+        type=lambda text: text.split(','),
+        default=DIRECTORIES,
+        help=f'Directories of [paths] separated by commas (default: {",".join(DIRECTORIES)})',
+    )
+    parser.add_argument(
+        '--date',
+        type=str,
+        default=date.today().strftime('%Y%m%d'),
+        help='Reference date of the ages: %Y%m%d',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('retention', 'workers', int),
+        help='Threads used to remove and archive the files',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only report the files that would be removed and archived',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = arguments(argv)
+    now = pd.to_datetime(args.date)
+    start_report('manage_data', date=args.date, dirs=','.join(args.dirs), dry_run=args.dry_run)
+
+    summaries = []
+    for name in args.dirs:
+        root = get_path(name)
+        if not os.path.isdir(root):
+            print(f'ERROR in Accessing {root}')
+            continue
+        summaries.append(manage_directory(name, root, now, args.dry_run, args.workers))
+
+    table = pd.DataFrame(summaries)
+    print(f'\n{"Dry run: nothing was changed" if args.dry_run else "Done"} (reference date {now.strftime("%Y-%m-%d")})\n')
+    if len(table) > 0:
+        print(table.to_string(index=False, float_format='{:.1f}'.format))
+    print()
+    save_report()
+
+
+if __name__ == '__main__':
+    main()
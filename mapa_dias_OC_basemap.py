@@ -1,13 +1,19 @@
 import argparse
-import os
 import xarray as xr
 from datetime import datetime
 import pandas as pd
+from tools.assets import read_climatology
+from tools.color_scales import ANOMALY_SCALE, TMAX_SCALE, scale_legend
+from tools.config import get_option, get_path, stage_in_file
+from tools.instrumentation import save_report, stage, start_report
 from tools.make_figure_map_days import make_figure, make_figure_anomaly
+from tools.stage_cache import code_files, is_fresh, record, stage_key
+from tools.tiles import render_pyramid
+from tools.tools_idhw_v2 import check_dir, region_bounds
 
 
 
-def arguments():
+def arguments(argv=None):
     parser = argparse.ArgumentParser(prog='mapa_dias_OC_basemap.py')
     parser.add_argument(
         '--date',
@@ -30,25 +36,82 @@ def arguments():
         help='Region: BR or NEB or area1-summer',
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--tiles',
+        action='store_true',
+        help='Write an XYZ tile pyramid for the web viewer instead of the PNG panels',
+    )
+
+    parser.add_argument(
+        '--zoom',
+        type=str,
+        default=get_option('tiles', 'zoom') or '3,7',
+        help='Zoom levels of the tiles: first,last',
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('tiles', 'workers', int) or 1,
+        help='Processes rendering the tiles',
+    )
 
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Redraw even if the figures are up to date',
+    )
+
+    return parser.parse_args(argv)
 
-def main():
-    args = arguments()
+
+def main(argv=None):
+    args = arguments(argv)
     model = args.model
     region = args.region
     day = pd.to_datetime(args.date)
 
-    dir = os.getcwd()
-    dir_pesq = '/pesq/share/monan/curso_OMM_INPE_2025/Validation/HeatWave/HWI-tool/'
-
     if model is None:
         print('Especifique o modelo de previsão no terminal!\n')
         print('Exemplo: --model monan')
         exit()
 
-    path_heatwave = dir + '/data/out_HWI/'
-    data_prev = xr.open_dataset(f'{path_heatwave}/{model}.{day.strftime("%Y%m%d")}.onda_de_calor.nc')
+    start_report('mapa_dias_OC_basemap', date=day.strftime('%Y%m%d'), model=model, region=region, tiles=args.tiles)
+
+    path_heatwave = get_path('heatwaves')
+    file_heatwave = f'{path_heatwave}/{model}.{day.strftime("%Y%m%d")}.onda_de_calor.nc'
+    with stage('read_forecast'):
+        data_prev = xr.open_dataset(file_heatwave)
+
+    dir_figs = get_path('figures')
+    check_dir(dir_figs)
+    n_days = data_prev.sizes['time']
+    file_out = f'{dir_figs}/previsao_{n_days}dias_onda_de_calor_{model}_{region}.png'
+    file_out_anomaly = f'{dir_figs}/previsao_anomalia_{n_days}dias_onda_de_calor_{model}_{region}.png'
+    outputs = [file_out, file_out_anomaly]
+
+    first_zoom, last_zoom = (int(z) for z in args.zoom.split(','))
+    zooms = list(range(first_zoom, last_zoom + 1))
+    dir_tiles = f'{get_path("tiles")}/{model}_{region}/{day.strftime("%Y%m%d")}'
+    if args.tiles:
+        outputs = [f'{dir_tiles}/tiles.json']
+
+    # Skipped when the last run had the same inputs and parameters
+    tag = f'{model}.{day.strftime("%Y%m%d")}.{region}{".tiles" if args.tiles else ""}'
+    with stage('cache_check'):
+        inputs = [
+            file_heatwave,
+            get_path('climatology'),
+            f'{get_path("masks")}/mask_region_{region}.nc',
+        ] + code_files(__file__)
+        key = stage_key(inputs, {'region': region, 'zoom': zooms if args.tiles else None})
+    if not args.force and is_fresh('figures', tag, key, outputs):
+        print(f'{outputs[0]} is up to date (same inputs and parameters)\n')
+        save_report()
+        return
+
+    with stage('read_forecast'):
+        data_prev = data_prev.load()
     # Extract target coordinates from the target dataset
     target_coords = {
         'latitude': data_prev['latitude'],
@@ -60,42 +123,68 @@ def main():
     # ----------------------------------------------------------------
     # ERA5 Climatology
     # ----------------------------------------------------------------
-    #data_clim = xr.open_dataset(f'{dir}/data/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc')
-    data_clim = xr.open_dataset(f'{dir_pesq}/data/era5_reanalysis/climatology.daily.t2m_max.ERA5.1981_2020.nc')
+    with stage('read_climatology'):
+        data_clim = read_climatology(
+            stage_in_file(get_path('climatology'), 'era5_reanalysis'),
+            region_bounds(region, get_path('masks'), halo=2.0),
+        )
 
     # Regrid the source dataset using target coordinates
-    data_clim = data_clim.interp(coords=target_coords, method='linear')
-    data_clim = data_clim.sel(time=slice(times[0], times[-1]))
+    with stage('regrid'):
+        data_clim = data_clim.interp(coords=target_coords, method='linear')
+        data_clim = data_clim.sel(time=slice(times[0], times[-1]))
 
-    anomaly_tmax = data_prev.t2m.data - data_clim.t2m.data
+        anomaly_tmax = data_prev.t2m.data - data_clim.t2m.data
 
     data_prev['anomalia'] = (('time', 'latitude', 'longitude'), anomaly_tmax)
 
-    #file_out = f'previsao_3dias_onda_de_calor_{model}_{region}.png'
-    file_out = f'./figs/previsao_{len(times)}dias_onda_de_calor_{model}_{region}.png'
-    #file_out_anomaly = f'previsao_anomalia_3dias_onda_de_calor_{model}_{region}.png'
-    file_out_anomaly = f'./figs/previsao_anomalia_{len(times)}dias_onda_de_calor_{model}_{region}.png'
+    # Tiles of the Tmax and anomaly of each day (same classes and colors as the panels)
+    if args.tiles:
+        layers = {}
+        for index, valid in enumerate(data_prev.time.dt.strftime('%Y%m%d').data):
+            for name, variable, scale in [('tmax', 't2m', TMAX_SCALE), ('anomaly', 'anomalia', ANOMALY_SCALE)]:
+                layers[f'{name}/{valid}'] = (
+                    data_prev[variable][index].data, data_prev.latitude.data, data_prev.longitude.data, scale)
+        metadata = {
+            'model': model,
+            'region': region,
+            'init': day.strftime('%Y%m%d'),
+            'days': list(data_prev.time.dt.strftime('%Y%m%d').data),
+            'legends': {'tmax': scale_legend(TMAX_SCALE), 'anomaly': scale_legend(ANOMALY_SCALE)},
+        }
+        with stage('rendering', figure='tiles', zooms=len(zooms)):
+            written, skipped = render_pyramid(layers, dir_tiles, zooms, workers=args.workers, metadata=metadata)
+        print(f'{written} tiles written ({skipped} empty tiles skipped) in {dir_tiles}\n')
+        record('figures', tag, key, outputs)
+        save_report()
+        return
 
 
     # Figuras onda de calor 6 dias (Tmax)
-    make_figure(
-        data=data_prev,
-        row=2, # 1
-        col=3,
-        filename=file_out,
-        area=region,
-        model=model,
-    )
+    with stage('rendering', figure='tmax'):
+        make_figure(
+            data=data_prev,
+            row=2, # 1
+            col=3,
+            filename=file_out,
+            area=region,
+            model=model,
+        )
 
     # Figuras onda de calor 6 dias (anomalia de Tmax)
-    make_figure_anomaly(
-        data=data_prev,
-        row=2, # 1
-        col=3,
-        filename=file_out_anomaly,
-        area=region,
-        model=model
-    )
-
-
-main()
+    with stage('rendering', figure='anomaly'):
+        make_figure_anomaly(
+            data=data_prev,
+            row=2, # 1
+            col=3,
+            filename=file_out_anomaly,
+            area=region,
+            model=model
+        )
+
+    record('figures', tag, key, outputs)
+    save_report()
+
+
+if __name__ == '__main__':
+    main()
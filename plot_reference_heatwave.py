@@ -1,8 +1,8 @@
 import argparse
-import os
 import xarray as xr
 from datetime import datetime, timedelta
 import pandas as pd
+from tools.config import get_path
 from tools.make_figure_map_days import make_figure_reference
 from tools.tools_idhw_v2 import split_dates_by_sequence, check_dir
 
@@ -38,12 +38,10 @@ def main():
     day_first = args.date_init
     day_end = args.date_end
 
-    dir = os.getcwd()
-
-    path_heatwave = dir + '/data/out_HWI/'
+    path_heatwave = get_path('heatwaves')
     data_ref_full = xr.open_dataset(f'{path_heatwave}/reference.heatwaves.{day_first}-{day_end}.nc')
 
-    path_out = dir + '/figs'
+    path_out = get_path('figures')
     check_dir(path_out)
 
     list_days = split_dates_by_sequence([pd.to_datetime(t) for t in data_ref_full.time.data])
@@ -93,5 +91,5 @@ def main():
 
 
 
-main()
-
+if __name__ == '__main__':
+    main()
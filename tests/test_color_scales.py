@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from matplotlib.colors import BoundaryNorm
+
+from tools.color_scales import ANOMALY_SCALE, TMAX_SCALE, scale_colormap, scale_lut
+from tools.tiles import prepare_layer
+
+
+@pytest.mark.parametrize('scale', [TMAX_SCALE, ANOMALY_SCALE], ids=['tmax', 'anomaly'])
+def test_lut_matches_the_panels(scale):
+    """The tiles give every value the color of the PNG panels (pcolormesh with BoundaryNorm)."""
+    cmap = scale_colormap(scale)
+    levels = np.asarray(scale['levels'], dtype=float)
+    norm = BoundaryNorm(levels, ncolors=cmap.N, clip=False)
+
+    values = np.concatenate([np.linspace(levels[0] - 3, levels[-1] + 3, 301), levels])
+    expected = np.round(cmap(norm(values)) * 255).astype(np.uint8)
+
+    lut = scale_lut(scale)
+    assert lut.shape == (len(levels) + 1, 4)
+    np.testing.assert_array_equal(lut[np.searchsorted(levels, values, side='right')], expected)
+
+
+def test_layer_classes_index_the_lut():
+    """prepare_layer classes are the LUT rows shifted by one (0: NaN, transparent)."""
+    field = np.array([[29.0, 30.0, 35.5], [39.5, 41.0, np.nan]])
+    layer = prepare_layer(field, np.array([-10.0, -9.0]), np.array([-50.0, -49.0, -48.0]), TMAX_SCALE)
+
+    assert layer['classes'][1, 2] == 0
+    assert layer['classes'].max() == len(layer['lut'])
+
+
+def test_layer_of_a_0_360_grid():
+    """A 0..360 grid gives the layer of the same grid in -180..180."""
+    rng = np.random.default_rng(0)
+    longitude = np.arange(0, 360, 10.0)
+    latitude = np.array([-10.0, 0.0, 10.0])
+    field = rng.uniform(20, 45, (len(latitude), len(longitude)))
+
+    layer = prepare_layer(field, latitude, longitude, TMAX_SCALE)
+    order = np.argsort((longitude + 180) % 360 - 180)
+    expected = prepare_layer(field[:, order], latitude, np.sort((longitude + 180) % 360 - 180), TMAX_SCALE)
+
+    np.testing.assert_array_equal(layer['classes'], expected['classes'])
+    np.testing.assert_array_equal(layer['lon_edges'], expected['lon_edges'])
+    assert layer['bounds'][0] < -170 and layer['bounds'][2] > 170
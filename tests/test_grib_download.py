@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from benchmarks.grib_server import gfs_url_template, make_gfs_fixtures, serve
+from tools import grib_download
+from tools.grib_download import DownloadError, download_ranges, merge_ranges, read_inventory, select_records
+
+INIT = '2024042200'
+HOUR = 6
+
+
+@pytest.fixture
+def fixture(tmp_path, monkeypatch):
+    monkeypatch.setattr(grib_download, 'BACKOFF', 0.0)
+    filename, = make_gfs_fixtures(str(tmp_path / 'nomads'), INIT, [HOUR], resolution=10)
+    return tmp_path, filename
+
+
+def download(tmp_path, variables, ignore_range):
+    server, base = serve(str(tmp_path / 'nomads'), ignore_range=ignore_range)
+    try:
+        url = gfs_url_template(base).format(init=pd.to_datetime(INIT, format='%Y%m%d%H'), hour=HOUR)
+        ranges = merge_ranges(select_records(read_inventory(url), variables))
+        output = str(tmp_path / 'out.grib2')
+        download_ranges(url, ranges, output, retries=1)
+        return ranges, output
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.parametrize('variables', ['PRMSL', 'TMAX:TMIN'])
+def test_ranges(fixture, variables):
+    tmp_path, filename = fixture
+    ranges, output = download(tmp_path, variables, ignore_range=False)
+
+    data = open(filename, 'rb').read()
+    expected = b''.join(data[start:None if end is None else end + 1] for start, end in ranges)
+    assert open(output, 'rb').read() == expected
+
+
+@pytest.mark.parametrize('variables', ['PRMSL', 'TMAX:TMIN'])
+def test_server_ignoring_ranges(fixture, variables):
+    # PRMSL is the first record: its range starts at byte 0
+    tmp_path, filename = fixture
+    with pytest.raises(DownloadError, match='ignored the byte range'):
+        download(tmp_path, variables, ignore_range=True)
+    assert not (tmp_path / 'out.grib2').exists()
+    assert (tmp_path / 'out.grib2.part').stat().st_size == 0
@@ -0,0 +1,21 @@
+import tarfile
+
+from tools.retention import archive_files
+
+
+def archive(root, name, text):
+    path = root / name
+    path.write_text(text)
+    archive_files(str(root), [str(path)], ['2024-04-22'])
+    path.unlink()
+
+
+def test_archive_again_replaces_the_file(tmp_path):
+    archive(tmp_path, 'monan.20240422.onda_de_calor.nc', 'first run')
+    archive(tmp_path, 'monan.20240423.onda_de_calor.nc', 'other day')
+    archive(tmp_path, 'monan.20240422.onda_de_calor.nc', 'rerun')
+
+    with tarfile.open(tmp_path / 'archive' / '202404.tar') as tar:
+        assert sorted(tar.getnames()) == ['monan.20240422.onda_de_calor.nc', 'monan.20240423.onda_de_calor.nc']
+        assert tar.extractfile('monan.20240422.onda_de_calor.nc').read() == b'rerun'
+        assert tar.extractfile('monan.20240423.onda_de_calor.nc').read() == b'other day'
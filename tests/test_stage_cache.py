@@ -0,0 +1,42 @@
+import pytest
+
+from tools import config
+from tools.stage_cache import code_files, stage_key
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('HWI_PATHS_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(config, '_config', None)
+    return tmp_path
+
+
+def write(filename, text):
+    filename.write_text(text)
+    return str(filename)
+
+
+def test_key_pairs_inputs_and_contents(cache):
+    obs = write(cache / 'obs.nc', 'a')
+    fcst = write(cache / 'fcst.nc', 'b')
+    key = stage_key([obs, fcst], {})
+
+    # Same contents, swapped between the two inputs
+    write(cache / 'obs.nc', 'b')
+    write(cache / 'fcst.nc', 'a')
+    assert stage_key([obs, fcst], {}) != key
+
+
+def test_key_does_not_depend_on_paths(cache):
+    (cache / 'staged').mkdir()
+    inputs = [write(cache / 'obs.nc', 'a'), write(cache / 'fcst.nc', 'b')]
+    staged = [write(cache / 'staged' / 'obs.nc', 'a'), write(cache / 'staged' / 'fcst.nc', 'b')]
+    assert stage_key(inputs, {'cov': 0.1}) == stage_key(staged, {'cov': 0.1})
+    assert stage_key(inputs, {'cov': 0.1}) != stage_key(inputs, {'cov': 0.2})
+
+
+def test_code_files_include_the_tools():
+    files = code_files(__file__)
+    assert files[0] == __file__
+    assert any(f.endswith('/tools/netcdf_io.py') for f in files)
+    assert any(f.endswith('/tools/tools_idhw_v2.py') for f in files)
@@ -0,0 +1,82 @@
+import threading
+
+import xarray as xr
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Static inputs shared by the runs (climatology, region masks, shapefiles).
+# By default they are read at each call, as before. The service (hwi_service.py)
+# calls keep_warm(), and each of them is then read once and kept in memory.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+_warm = False
+_cache = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def keep_warm(enabled=True):
+    """Function: Keep the static inputs in memory after the first read."""
+    global _warm
+    _warm = enabled
+
+
+def cached(key, build):
+    """Function: Value of build(), kept in memory under key when keep_warm() is enabled.
+    The cached objects are shared: callers must not modify them in place.
+    """
+    if not _warm:
+        return build()
+
+    with _lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _cache:
+            _cache[key] = build()
+    return _cache[key]
+
+
+def cached_keys():
+    """Function: Keys of the inputs kept in memory."""
+    return [str(key) for key in _cache]
+
+
+def read_climatology(path, bounds=None, chunks=None):
+    """Function: Daily climatology of the region window.
+    When kept warm, the whole year of the window is loaded once; otherwise the
+    file is opened lazily (chunks for the dask mode).
+    :param path: climatology file.
+    :type path: str
+    :param bounds: region window (region_bounds), None for the full grid.
+    :type bounds: tuple
+    :param chunks: dask chunks (chunked mode).
+    :type chunks: dict
+    """
+    from tools.tools_idhw_v2 import subset_region  # tools_idhw_v2 reads the masks through this module
+
+    if chunks is not None or not _warm:
+        return subset_region(xr.open_dataset(path, chunks=chunks), bounds)
+
+    def build():
+        with xr.open_dataset(path) as ds:
+            return subset_region(ds, bounds).load()
+
+    return cached(('climatology', path, bounds), build)
+
+
+def read_mask_file(area, dir_mask):
+    """Function: Region mask file (mask_region_{area}.nc) with latitude/longitude coordinates."""
+    def build():
+        with xr.open_dataset(f'{dir_mask}/mask_region_{area}.nc') as ds:
+            read_mask = ds.load()
+        if 'lon' in read_mask.dims:
+            read_mask = read_mask.rename({'lon': 'longitude', 'lat': 'latitude'})
+        return read_mask
+
+    return cached(('mask', dir_mask, area), build)
+
+
+def read_shapefile(path):
+    """Function: Shapefile as a GeoDataFrame."""
+    import geopandas as gpd
+
+    return cached(('shapefile', path), lambda: gpd.read_file(path))
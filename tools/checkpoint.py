@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+import xarray as xr
+
+from tools.config import get_path
+from tools.prefetch import load_netcdf
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Checkpoints and quarantine of the long jobs (multi-year reference detection,
+# climatology).
+#   Checkpoints: the job is split in chunks (years, bands of latitude) and the result
+#   of each chunk is saved in [paths] cache/checkpoints/<job> as soon as it is done, with
+#   the key of its inputs and parameters. A job restarted after a failure (preemption,
+#   time limit) reuses the chunks whose key did not change and only computes the others.
+#   The keys use the name, size and modification time of the inputs (not their content,
+#   which would read every file again); the staged-in copies keep them.
+#   Quarantine: an input that cannot be read is listed in [paths] cache/quarantine.json
+#   with the error, and the job goes on without it (the day is missing). The file is
+#   not read again until it is replaced (different size or modification time).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+# Errors of netCDF4/HDF5/xarray on a truncated or corrupt file
+READ_ERRORS = (OSError, ValueError, RuntimeError, KeyError, IndexError)
+
+_quarantine_lock = threading.Lock()
+
+
+def quarantine_file():
+    directory = get_path('cache')
+    os.makedirs(directory, exist_ok=True)
+    return f'{directory}/quarantine.json'
+
+
+def _read_json(filename, default):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(filename, data):
+    partial = f'{filename}.{os.getpid()}.part'
+    with open(partial, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(partial, filename)
+
+
+def _status(filename):
+    status = os.stat(filename)
+    return [status.st_size, status.st_mtime_ns]
+
+
+def is_quarantined(filename):
+    """Function: True when the file was quarantined and was not replaced since."""
+    entry = _read_json(quarantine_file(), {}).get(os.path.realpath(filename))
+    return entry is not None and os.path.isfile(filename) and entry['status'] == _status(filename)
+
+
+def quarantine(filename, error):
+    """Function: List an unreadable file in the quarantine.
+    :param filename: input file.
+    :type filename: str
+    :param error: error raised when reading it.
+    :type error: Exception or str
+    """
+    print(f'Warning: {filename} cannot be read ({error}), quarantined and skipped')
+    if not os.path.isfile(filename):
+        return
+
+    with _quarantine_lock:
+        index = _read_json(quarantine_file(), {})
+        index[os.path.realpath(filename)] = {
+            'status': _status(filename),
+            'error': str(error),
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        _write_json(quarantine_file(), index)
+
+
+def load_checked(filename, select=None, chunks=None):
+    """Function: load_netcdf of an input, None when it is quarantined or cannot be read (then quarantined).
+    :param filename: netCDF file.
+    :type filename: str
+    :param select: function applied to the dataset (e.g. a region window).
+    :type select: function
+    :param chunks: dask chunks: the file is only opened (lazy), None loads it.
+    :type chunks: dict
+    """
+    if is_quarantined(filename):
+        print(f'Warning: {filename} is quarantined, skipped')
+        return None
+    try:
+        if chunks is None:
+            return load_netcdf(filename, select)
+        ds = xr.open_dataset(filename, chunks=chunks)
+        return ds if select is None else select(ds)
+    except READ_ERRORS as error:
+        quarantine(filename, error)
+        return None
+
+
+def inputs_key(files, params):
+    """Function: Key of a chunk: name, size and modification time of the inputs and the parameters.
+    :param files: input files (missing files are part of the key).
+    :type files: list
+    :param params: parameters of the chunk (JSON serializable).
+    :type params: dict
+    """
+    status = [[os.path.basename(f)] + (_status(f) if os.path.isfile(f) else [None]) for f in files]
+    text = json.dumps({'inputs': status, 'params': params}, sort_keys=True, default=str)
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def checkpoint_dir(job):
+    """Function: Directory of the checkpoints of a job (e.g. reference.BR)."""
+    directory = f'{get_path("cache")}/checkpoints/{job}'
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def is_done(filename, key):
+    """Function: True when the chunk file was saved by save_done with this key."""
+    return os.path.isfile(filename) and _read_json(f'{filename}.json', {}).get('key') == key
+
+
+def save_done(filename, key, write, **info):
+    """Function: Save the result of a chunk and mark it as done.
+    The result is written to a partial file and renamed, so a chunk interrupted while
+    writing is never taken as done.
+    :param filename: chunk file.
+    :type filename: str
+    :param key: output of inputs_key.
+    :type key: str
+    :param write: function writing the result to the file name it receives.
+    :type write: function
+    :param info: entries saved with the key (e.g. the quarantined inputs of the chunk).
+    """
+    root, extension = os.path.splitext(filename)
+    partial = f'{root}.{os.getpid()}.part{extension}'
+    write(partial)
+    os.replace(partial, filename)
+    _write_json(f'{filename}.json', {'key': key, **info})
+
+
+def chunk_info(filename):
+    """Function: Entries saved with the chunk by save_done."""
+    return _read_json(f'{filename}.json', {})
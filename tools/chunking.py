@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+# Number of full-size float32 arrays alive at the same time in the detectors
+# (Tmax, climatology t2m/std/percentil75, threshold; the exceedance mask is boolean).
+ARRAY_COPIES = 5
+
+
+def chunks_for_budget(sizes, memory_budget, workers=1, itemsize=4, copies=ARRAY_COPIES):
+    """Function: Dask chunks that keep the detectors inside a memory budget.
+    Whole days are kept in one chunk while they fit; otherwise each day is
+    split in bands of latitude.
+    :param sizes: sizes of the 'time', 'latitude' and 'longitude' dimensions.
+    :type sizes: dict
+    :param memory_budget: memory budget in MB.
+    :type memory_budget: float
+    :param workers: number of threads computing chunks at the same time.
+    :type workers: int
+    :param itemsize: bytes per value.
+    :type itemsize: int
+    :param copies: number of arrays of the chunk size held by each thread.
+    :type copies: int
+    :return: chunks for xarray.open_dataset.
+    """
+    chunk_bytes = memory_budget * 2**20 / (copies * workers)
+    day_bytes = sizes['latitude'] * sizes['longitude'] * itemsize
+
+    if day_bytes <= chunk_bytes:
+        n_days = int(min(sizes.get('time', 1), chunk_bytes // day_bytes))
+        return {'time': n_days, 'latitude': -1, 'longitude': -1}
+
+    n_lat = int(max(1, chunk_bytes // (sizes['longitude'] * itemsize)))
+    return {'time': 1, 'latitude': n_lat, 'longitude': -1}
+
+
+@contextmanager
+def local_scheduler(workers=None):
+    """Function: Run the dask computations with the local threaded scheduler.
+    :param workers: number of threads (default: number of cores).
+    :type workers: int
+    """
+    import dask
+
+    with dask.config.set(scheduler='threads', num_workers=workers):
+        yield
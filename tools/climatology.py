@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Daily climatology accumulators.
+# The climatology files use the 2020 calendar (366 days, so 29 February has its own
+# day). Each calendar day keeps running moments (Welford) and a histogram of the
+# values of each grid point; the moving window is applied at the end by combining
+# the neighbouring days, so the memory does not depend on the number of years.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+CALENDAR = pd.date_range('2020-01-01', '2020-12-31', freq='D')
+N_DAYS = len(CALENDAR)
+
+# Histograms: first bin, last bin and bin width (°C); values outside go to the edge bins
+HISTOGRAM_BINS = (-30.0, 60.0, 0.25)
+
+
+def calendar_index(time):
+    """Function: Position of a date in the climatology calendar."""
+    time = pd.Timestamp(time)
+    return CALENDAR.get_loc(pd.Timestamp(2020, time.month, time.day))
+
+
+def bytes_per_point(bins=HISTOGRAM_BINS, n_percentiles=1):
+    """Function: Memory of a DailyAccumulator per grid point (histograms, moments and finalize buffers).
+    finalize adds the float64 counts, the window sums (histogram and cumulative histogram
+    in int32, moments) and the float32 outputs (t2m, std and the percentiles).
+    """
+    n_bins = int(round((bins[1] - bins[0]) / bins[2]))
+    return N_DAYS * (n_bins + 2 + 24 + 4 * (2 + n_percentiles)) + 12 * n_bins
+
+
+class DailyAccumulator:
+    """Running mean/std and histogram of a field for each calendar day.
+
+    :param shape: shape of the field (latitude, longitude).
+    :type shape: tuple
+    :param bins: (first bin, last bin, width) of the histograms.
+    :type bins: tuple
+    :param max_count: maximum number of values of one calendar day (number of years).
+    :type max_count: int
+    """
+
+    def __init__(self, shape, bins=HISTOGRAM_BINS, max_count=255):
+        self.shape = tuple(shape)
+        self.start, stop, self.step = bins
+        self.n_bins = int(round((stop - self.start) / self.step))
+        n_points = int(np.prod(self.shape))
+
+        self.count = np.zeros((N_DAYS, n_points), dtype=np.uint16)
+        self.mean = np.zeros((N_DAYS, n_points))
+        self.m2 = np.zeros((N_DAYS, n_points))
+        self.hist = np.zeros((N_DAYS, self.n_bins, n_points), dtype=np.uint8 if max_count < 256 else np.uint16)
+        self.points = np.arange(n_points)
+
+    def add(self, time, field):
+        """Function: Add the field of one day."""
+        day = calendar_index(time)
+        values = np.asarray(field, dtype=np.float64).ravel()
+        valid = ~np.isnan(values)
+        points = self.points[valid]
+        values = values[valid]
+
+        self.count[day, points] += 1
+        delta = values - self.mean[day, points]
+        self.mean[day, points] += delta / self.count[day, points]
+        self.m2[day, points] += delta * (values - self.mean[day, points])
+
+        bins = np.clip(np.floor((values - self.start) / self.step).astype(np.int64), 0, self.n_bins - 1)
+        self.hist[day, bins, points] += 1
+
+    def finalize(self, window=15, percentiles=(75,)):
+        """Function: Mean, std (ddof=0) and percentiles of each calendar day over the moving window.
+        :param window: number of calendar days centred on each day (the year wraps around).
+        :type window: int
+        :param percentiles: percentiles (0-100), linearly interpolated inside the histogram bins.
+        :type percentiles: list
+        :return: dict of float32 arrays (calendar day, latitude, longitude), NaN where there are no values.
+        """
+        half = window // 2
+        n_points = self.points.size
+        out = {name: np.full((N_DAYS, n_points), np.nan, dtype=np.float32)
+               for name in ['t2m', 'std'] + [f'percentil{q:g}' for q in percentiles]}
+
+        # Sums over the window (count, count * mean, M2 + count * mean^2 and histogram),
+        # moved one day at a time: the day entering is added and the day leaving removed.
+        # The first window is also summed day by day, without a copy of its histograms
+        # (bytes_per_point)
+        count = self.count.astype(np.float64)
+        n, s1, s2 = np.zeros(n_points), np.zeros(n_points), np.zeros(n_points)
+        hist = np.zeros((self.n_bins, n_points), dtype=np.int32)
+        for offset in range(-half, half + 1):
+            day = offset % N_DAYS
+            n += count[day]
+            s1 += count[day] * self.mean[day]
+            s2 += self.m2[day] + count[day] * self.mean[day] ** 2
+            hist += self.hist[day]
+        cumulative = np.empty_like(hist)
+
+        for day in range(N_DAYS):
+            valid = n > 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = s1 / n
+                variance = np.maximum(s2 / n - mean ** 2, 0)
+            out['t2m'][day, valid] = mean[valid]
+            out['std'][day, valid] = np.sqrt(variance)[valid]
+
+            # Row by row: much faster than np.cumsum along the first axis
+            cumulative[0] = hist[0]
+            for i in range(1, self.n_bins):
+                np.add(cumulative[i - 1], hist[i], out=cumulative[i])
+            for q in percentiles:
+                target = q / 100 * n
+                idx = np.argmax(cumulative >= target, axis=0)
+                below = np.where(idx > 0, cumulative[idx - 1, self.points], 0)
+                inside = hist[idx, self.points]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    fraction = np.clip((target - below) / inside, 0, 1)
+                value = self.start + (idx + fraction) * self.step
+                out[f'percentil{q:g}'][day, valid] = value[valid]
+
+            enter, leave = (day + half + 1) % N_DAYS, (day - half) % N_DAYS
+            n += count[enter] - count[leave]
+            s1 += count[enter] * self.mean[enter] - count[leave] * self.mean[leave]
+            s2 += (self.m2[enter] + count[enter] * self.mean[enter] ** 2
+                   - self.m2[leave] - count[leave] * self.mean[leave] ** 2)
+            hist += self.hist[enter]
+            hist -= self.hist[leave]
+
+        return {name: value.reshape((N_DAYS,) + self.shape) for name, value in out.items()}
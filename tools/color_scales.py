@@ -0,0 +1,58 @@
+import numpy as np
+from matplotlib.colors import BoundaryNorm, ListedColormap, to_hex
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Color scales of the heat wave maps, shared by the PNG panels (tools/make_figure_map_days.py)
+# and the map tiles (tools/tiles.py).
+#   levels: bounds of the classes (BoundaryNorm).
+#   colors: one color per class.
+#   over / under: colors above the last / below the first level (None: matplotlib default).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+TMAX_SCALE = {
+    'levels': [30, 32, 34, 36, 38, 39, 40],
+    'colors': ('#ffe0b3', '#ffb84d', '#FF7F00', '#FF0000', '#c10000', '#880000'),
+    'over': '#540002',
+    'under': '#f8fa7a',
+    'units': '°C',
+}
+
+ANOMALY_SCALE = {
+    'levels': [1, 2, 3, 4, 5],
+    'colors': ('#f8fa7a', '#ffb84d', '#FF7F00', '#FF0000', '#c10000'),
+    'over': '#540002',
+    'under': None,
+    'units': '°C',
+}
+
+
+def scale_colormap(scale):
+    """Function: ListedColormap of a color scale, with its over and under colors."""
+    cmap = ListedColormap(scale['colors'])
+    if scale['over'] is not None:
+        cmap.set_over(scale['over'])
+    if scale['under'] is not None:
+        cmap.set_under(scale['under'])
+    return cmap
+
+
+def scale_lut(scale):
+    """Function: RGBA table (uint8) of a color scale: under, one color per class between the levels, over.
+    Index np.searchsorted(levels, value, side='right') of a value gives its color. Each
+    class takes the color of BoundaryNorm(levels, cmap.N, clip=False) in the PNG panels,
+    which spreads the colors over the classes when there are more colors than classes.
+    """
+    cmap = scale_colormap(scale)
+    levels = np.asarray(scale['levels'], dtype=float)
+    norm = BoundaryNorm(levels, cmap.N, clip=False)
+
+    # One value below the levels, one inside each class and one above
+    values = np.concatenate([[levels[0] - 1], (levels[:-1] + levels[1:]) / 2, [levels[-1] + 1]])
+    return np.round(cmap(norm(values)) * 255).astype(np.uint8)
+
+
+def scale_legend(scale):
+    """Function: Legend of a color scale for the tiles (levels and the colors of scale_lut as hex)."""
+    colors = [to_hex(rgba / 255, keep_alpha=False) for rgba in scale_lut(scale)]
+    return {'levels': list(scale['levels']), 'colors': colors[1:-1], 'under': colors[0], 'over': colors[-1],
+            'units': scale['units']}
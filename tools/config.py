@@ -0,0 +1,123 @@
+import configparser
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Run configuration.
+# The settings are read, in this order (the last one wins), from:
+#   1. hwi_config.ini in the repository directory;
+#   2. the file given by the HWI_CONFIG environment variable;
+#   3. environment variables HWI_<SECTION>_<KEY> (e.g. HWI_PATHS_DATA_ROOT=/scratch/hwi/data).
+# Values may refer to other keys of the same section (${key}) or of another
+# section (${section:key}); ${cwd} is the working directory of the run.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+DIR_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = f'{DIR_REPO}/hwi_config.ini'
+
+_config = None
+
+
+def load_config(filename=None):
+    """Function: Read the run configuration.
+    :param filename: extra configuration file (default: HWI_CONFIG).
+    :type filename: str
+    :return: configparser.ConfigParser
+    """
+    config = configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
+    config['DEFAULT']['cwd'] = os.getcwd()
+
+    filename = filename or os.environ.get('HWI_CONFIG')
+    files = [CONFIG_FILE] + ([filename] if filename else [])
+    for name in files:
+        if not os.path.isfile(name):
+            print(f'ERROR in Accessing {name}')
+            exit()
+    config.read(files)
+
+    # Environment overrides: HWI_<SECTION>_<KEY>
+    for section in config.sections():
+        for key in config[section]:
+            value = os.environ.get(f'HWI_{section}_{key}'.upper())
+            if value is not None:
+                config[section][key] = value
+
+    return config
+
+
+def get_config():
+    """Function: Configuration of the run (read once)."""
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
+
+
+def get_path(key):
+    """Function: Path of the [paths] section (e.g. era5, climatology, heatwaves)."""
+    return get_config().get('paths', key)
+
+
+def get_option(section, key, kind=str):
+    """Function: Value of an option, None when it is empty.
+    :param kind: str, int, float or bool.
+    """
+    config = get_config()
+    if config.get(section, key, fallback='').strip() == '':
+        return None
+    if kind is bool:
+        return config.getboolean(section, key)
+    return kind(config.get(section, key))
+
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Stage-in of the inputs to fast local storage
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _copy(source, target):
+    """Copy a file unless an up-to-date copy already exists."""
+    if os.path.isfile(target):
+        src, dst = os.stat(source), os.stat(target)
+        if src.st_size == dst.st_size and dst.st_mtime >= src.st_mtime:
+            return 0
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = f'{target}.part'
+    shutil.copy2(source, partial)
+    os.replace(partial, target)
+    return os.path.getsize(target)
+
+
+def stage_in(root, patterns, name):
+    """Function: Copy the inputs of a stage to the scratch directory.
+    Does nothing (returns root) when [scratch] stage_in is disabled.
+    :param root: data directory (e.g. the ERA5 directory).
+    :type root: str
+    :param patterns: glob patterns of the needed files, relative to root.
+    :type patterns: list
+    :param name: subdirectory of the copy inside the scratch directory.
+    :type name: str
+    :return: directory to be read instead of root.
+    """
+    if not get_option('scratch', 'stage_in', bool):
+        return root
+
+    target_root = f'{get_option("scratch", "dir")}/{name}'
+    files = sorted({f for pattern in patterns for f in glob(f'{root}/{pattern}')})
+    targets = [f'{target_root}/{os.path.relpath(f, root)}' for f in files]
+
+    with ThreadPoolExecutor(max_workers=get_option('scratch', 'workers', int)) as executor:
+        copied = list(executor.map(_copy, files, targets))
+
+    print(f'Stage-in: {sum(c > 0 for c in copied)} of {len(files)} files copied to {target_root} '
+          f'({sum(copied) / 2**20:.1f} MB)')
+
+    return target_root
+
+
+def stage_in_file(filename, name):
+    """Function: stage_in of a single file; returns the path to be read."""
+    root = stage_in(os.path.dirname(filename), [os.path.basename(filename)], name)
+    return f'{root}/{os.path.basename(filename)}'
@@ -0,0 +1,71 @@
+from glob import glob
+
+import numpy as np
+
+from tools.prefetch import load_netcdf, prefetch
+from tools.tools_idhw_v2 import subset_region
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Daily Tmax of the forecasts.
+# '18z': the 18Z field of each valid day is taken as Tmax (one file per day).
+# 'hourly': maximum of all the hourly (or sub-daily) files of the valid day. The files
+# are read ahead in background threads (one at a time: tools/prefetch.py) and reduced
+# into one running-maximum field, so the hourly series is never held in memory
+# (only the files read ahead).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+TMAX_SOURCES = {
+    '18z': '18',
+    'hourly': '[0-2][0-9]',
+}
+
+
+def forecast_files(dir_init, valid, source='18z'):
+    """Function: Forecast files of one valid day in an initialization directory.
+    :param dir_init: initialization directory ({dir_fcst}/<YYYYMMDD>00[/<member>]).
+    :type dir_init: str
+    :param valid: valid day.
+    :type valid: datetime
+    :param source: '18z' or 'hourly' (TMAX_SOURCES).
+    :type source: str
+    :return: sorted list of files (stops when there is none).
+    """
+    pattern = f'{dir_init}/*{valid.strftime("%Y%m%d")}{TMAX_SOURCES[source]}.00.00*.nc'
+    files = sorted(glob(pattern))
+    if len(files) == 0:
+        print(f'ERROR in Accessing {pattern}')
+        exit()
+
+    return files
+
+
+def file_pattern(source='18z'):
+    """Function: Glob pattern of the forecast files of any valid day (stage-in and cache inputs)."""
+    return f'*{TMAX_SOURCES[source]}.00.00*.nc'
+
+
+def daily_max(files, time, bounds=None, variable='t2m', workers=None):
+    """Function: Daily maximum of the fields of the files of one valid day.
+    :param files: forecast files of the day (one for '18z').
+    :type files: list
+    :param time: time stamp of the daily field (the 18Z of the valid day, as the 18Z files).
+    :type time: datetime
+    :param bounds: region window (region_bounds), None for the full grid.
+    :type bounds: tuple
+    :param variable: variable of the files.
+    :type variable: str
+    :param workers: number of files read ahead (default: [run] prefetch).
+    :type workers: int
+    :return: xarray.DataArray (Time, latitude, longitude), float32, units of the files.
+    """
+    def read(filename):
+        return load_netcdf(filename, lambda ds: subset_region(ds[variable], bounds))
+
+    tmax = None
+    for field in prefetch(files, read, depth=workers):
+        if tmax is None:
+            tmax = field.astype(np.float32)  # running maximum (the only buffer kept)
+        else:
+            np.fmax(tmax.data, field.data, out=tmax.data)
+
+    return tmax.assign_coords(Time=[time])
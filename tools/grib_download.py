@@ -0,0 +1,235 @@
+import http.client
+import io
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Partial download of GRIB files (https://www.cpc.ncep.noaa.gov/products/wesley/fast_downloading_grib.html).
+# The .idx inventory of each file gives the first byte of every record; only the
+# records of the selected variables and levels are requested (HTTP Range), with the
+# adjacent ones merged in a single request. The forecast hours are downloaded in a
+# pool of threads, each keeping its HTTP connections open between requests. The
+# data go to <file>.part first, so an interrupted download continues where it stopped.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+CHUNK_SIZE = 2**20
+RETRIES = 4
+BACKOFF = 2.0  # seconds, doubled after each failure
+TIMEOUT = 60
+
+_local = threading.local()
+
+
+class DownloadError(Exception):
+    """Unexpected answer of the server."""
+
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Inventory
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+def parse_inventory(text):
+    """Function: Records of a wgrib2 .idx inventory.
+    Lines such as '4:1234567:d=2024042200:TMP:2 m above ground:6 hour fcst:'.
+    :param text: content of the inventory.
+    :type text: str
+    :return: list of dicts with line, start and end (last byte, None for the last record).
+    """
+    records = []
+    for line in text.splitlines():
+        fields = line.split(':')
+        if len(fields) < 2 or not fields[1].isdigit():
+            continue
+        records.append({'line': line, 'start': int(fields[1]), 'end': None})
+
+    # A record ends before the next one that starts at another byte (submessages share the start)
+    starts = sorted({record['start'] for record in records})
+    following = dict(zip(starts[:-1], starts[1:]))
+    for record in records:
+        if record['start'] in following:
+            record['end'] = following[record['start']] - 1
+
+    return records
+
+
+def select_records(records, variables='all', levels='all'):
+    """Function: Records of some variables and levels (as in get_gfs.pl, case insensitive).
+    :param variables: variables separated by colons (e.g. TMP:TMAX) or all.
+    :type variables: str
+    :param levels: levels separated by colons, blanks replaced by underscores (e.g. 2_m_above_ground) or all.
+    :type levels: str
+    """
+    def pattern(names, suffix):
+        if names.lower() == 'all':
+            return re.compile('.')
+        names = '|'.join(re.escape(name.replace('_', ' ')) for name in names.split(':'))
+        return re.compile(f':({names}){suffix}', re.IGNORECASE)
+
+    variables, levels = pattern(variables, ':'), pattern(levels, '')
+    return [record for record in records if variables.search(record['line']) and levels.search(record['line'])]
+
+
+def merge_ranges(records):
+    """Function: Byte ranges (start, end) of the records, adjacent records merged."""
+    ranges = []
+    for record in sorted(records, key=lambda record: record['start']):
+        if ranges and ranges[-1][1] is None:
+            break  # the last range already goes to the end of the file
+        if ranges and ranges[-1][1] + 1 >= record['start']:
+            end = None if record['end'] is None else max(ranges[-1][1], record['end'])
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((record['start'], record['end']))
+    return ranges
+
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# HTTP
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _connection(url):
+    """Open connection of this thread to the server of the url (kept between requests)."""
+    parts = urlsplit(url)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    key = (parts.scheme, parts.netloc)
+    if key not in connections:
+        kind = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        connections[key] = kind(parts.netloc, timeout=TIMEOUT)
+    return connections[key]
+
+
+def _close(url):
+    """Drop the connection of this thread to the server of the url (after an error)."""
+    parts = urlsplit(url)
+    connection = getattr(_local, 'connections', {}).pop((parts.scheme, parts.netloc), None)
+    if connection is not None:
+        connection.close()
+
+
+def _get(url, output, start=None, end=None):
+    """GET the url (or the bytes start-end) and write the body into an open file."""
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    headers = {}
+    if start is not None:
+        headers['Range'] = f'bytes={start}-{"" if end is None else end}'
+
+    connection = _connection(url)
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    if response.status not in (200, 206):
+        response.read()
+        raise DownloadError(f'HTTP {response.status} {response.reason}: {url}')
+    if start is not None and response.status != 206:
+        response.read()
+        raise DownloadError(f'the server ignored the byte range: {url}')
+
+    while chunk := response.read(CHUNK_SIZE):
+        output.write(chunk)
+
+
+def _retry(url, function, retries=RETRIES):
+    """Call function, retrying with exponential backoff after network errors."""
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except (OSError, http.client.HTTPException, DownloadError) as exc:
+            _close(url)
+            if attempt == retries:
+                raise
+            print(f'Retrying {url.split("/")[-1]} ({exc})')
+            time.sleep(BACKOFF * 2**attempt)
+
+
+def read_inventory(url, retries=RETRIES):
+    """Function: Records of the .idx inventory of a GRIB file."""
+    def fetch():
+        buffer = io.BytesIO()
+        _get(f'{url}.idx', buffer)
+        return buffer.getvalue().decode()
+
+    return parse_inventory(_retry(f'{url}.idx', fetch, retries))
+
+
+def download_ranges(url, ranges, filename, retries=RETRIES):
+    """Function: Download byte ranges of a file, continuing a previous partial download.
+    The ranges are written one after the other in <filename>.part, renamed to
+    filename at the end; <filename>.part.ranges keeps the ranges of the partial file.
+    :param url: url of the file.
+    :type url: str
+    :param ranges: (start, end) byte ranges, end None for the end of the file.
+    :type ranges: list
+    :param filename: output file.
+    :type filename: str
+    :return: size of the file (bytes).
+    """
+    part = f'{filename}.part'
+    signature = ','.join(f'{start}-{"" if end is None else end}' for start, end in ranges)
+    previous = open(f'{part}.ranges').read() if os.path.isfile(f'{part}.ranges') else None
+    if previous != signature or not os.path.isfile(part):
+        open(part, 'wb').close()
+        with open(f'{part}.ranges', 'w') as f:
+            f.write(signature)
+
+    def fetch():
+        done = os.path.getsize(part)
+        offset = 0
+        with open(part, 'ab') as output:
+            for start, end in ranges:
+                length = None if end is None else end - start + 1
+                if length is not None and done >= offset + length:
+                    offset += length
+                    continue
+                _get(url, output, start + (done - offset), end)
+                if length is None:
+                    break
+                offset += length
+                done = offset
+
+    _retry(url, fetch, retries)
+    os.replace(part, filename)
+    os.remove(f'{part}.ranges')
+
+    return os.path.getsize(filename)
+
+
+def download_grib(url, filename, variables='all', levels='all', retries=RETRIES):
+    """Function: Download the records of some variables and levels of a GRIB file.
+    :return: size of the file (bytes), 0 when no record matches (no file is written).
+    """
+    records = select_records(read_inventory(url, retries), variables, levels)
+    if len(records) == 0:
+        print(f'no matches (no download) for {url.split("/")[-1]}')
+        return 0
+    return download_ranges(url, merge_ranges(records), filename, retries)
+
+
+def download_forecast(urls, dir_out, variables='all', levels='all', workers=8, retries=RETRIES):
+    """Function: Download several GRIB files (e.g. the forecast hours of a run) at the same time.
+    :param urls: urls of the files (the output files have the same names).
+    :type urls: list
+    :param dir_out: output directory.
+    :type dir_out: str
+    :param workers: number of files downloaded at the same time.
+    :type workers: int
+    :return: dict url -> output file (None when the file failed or had no matching record).
+    """
+    def download(url):
+        filename = f'{dir_out}/{url.split("/")[-1]}'
+        try:
+            size = download_grib(url, filename, variables, levels, retries)
+        except (OSError, http.client.HTTPException, DownloadError) as exc:
+            print(f'ERROR in getting {url}: {exc}')
+            return url, None
+        return url, filename if size > 0 else None
+
+    os.makedirs(dir_out, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(download, urls))
@@ -0,0 +1,209 @@
+import numpy as np
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Vectorized heatwave criteria.
+# Arrays are (..., time, latitude, longitude): any leading dimension (e.g. ensemble member)
+# is processed at once, and the daily series are (..., time).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def run_length(flags):
+    """Function: Length of the sequence of consecutive days each day belongs to.
+    :param flags: boolean array with time as the last axis.
+    :type flags: numpy.ndarray
+    :return: int array (0 on the days where flags is False).
+    """
+    flags = np.asarray(flags, dtype=bool)
+    n_days = flags.shape[-1]
+    forward = np.zeros(flags.shape, dtype=np.int32)
+    backward = np.zeros(flags.shape, dtype=np.int32)
+
+    for t in range(n_days):
+        previous = forward[..., t - 1] if t > 0 else 0
+        forward[..., t] = np.where(flags[..., t], previous + 1, 0)
+
+    for t in range(n_days - 1, -1, -1):
+        following = backward[..., t + 1] if t < n_days - 1 else 0
+        backward[..., t] = np.where(flags[..., t], following + 1, 0)
+
+    return np.where(flags, forward + backward - 1, 0)
+
+
+def label_runs(flags):
+    """Function: Label each sequence of consecutive days with a unique integer.
+    :param flags: boolean array with time as the last axis.
+    :type flags: numpy.ndarray
+    :return: int array (0 on the days where flags is False).
+    """
+    flags = np.asarray(flags, dtype=bool)
+    previous = np.zeros(flags.shape, dtype=bool)
+    previous[..., 1:] = flags[..., :-1]
+    starts = flags & ~previous
+
+    # The first day of each row is always a start, so sequences never cross rows
+    labels = np.cumsum(starts.ravel()).reshape(flags.shape)
+
+    return np.where(flags, labels, 0)
+
+
+def run_mean(labels, sums, counts):
+    """Function: Average of a daily quantity over each labelled sequence.
+    :param labels: output of label_runs.
+    :type labels: numpy.ndarray
+    :param sums: daily sums (broadcastable to labels).
+    :type sums: numpy.ndarray
+    :param counts: daily number of values in sums (broadcastable to labels).
+    :type counts: numpy.ndarray
+    :return: float array with the sequence mean on each of its days (NaN outside sequences).
+    """
+    sums = np.broadcast_to(sums, labels.shape).ravel()
+    counts = np.broadcast_to(counts, labels.shape).ravel()
+    n_labels = labels.max() + 1
+
+    total = np.bincount(labels.ravel(), weights=sums, minlength=n_labels)
+    number = np.bincount(labels.ravel(), weights=counts, minlength=n_labels)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / number
+    mean[0] = np.nan
+
+    return mean[labels]
+
+
+def daily_statistics(tmax, threshold, p75):
+    """Function: Exceedance of the threshold and the daily regional sums used by the criteria.
+    :param tmax: maximum temperature, NaN outside the region (..., time, lat, lon).
+    :type tmax: numpy.ndarray
+    :param threshold: extreme Tmax threshold (clim Tmax + std), broadcastable to tmax.
+    :type threshold: numpy.ndarray
+    :param p75: climatological 75th percentile, NaN outside the region (time, lat, lon).
+    :type p75: numpy.ndarray
+    """
+    return exceedance_statistics(tmax > threshold, tmax, p75)  # NaN compares as False
+
+
+def exceedance_statistics(exceed, tmax, p75):
+    """Function: Daily regional sums used by the criteria for any exceedance field (tools/thresholds.py).
+    :param exceed: boolean exceedance field (..., time, lat, lon).
+    :type exceed: numpy.ndarray
+    :param tmax: maximum temperature, NaN outside the region (..., time, lat, lon).
+    :type tmax: numpy.ndarray
+    :param p75: climatological 75th percentile, NaN outside the region (time, lat, lon).
+    :type p75: numpy.ndarray
+    """
+    return {
+        'exceed': exceed,
+        # Total number of grid points over the continent (first day)
+        'points': np.count_nonzero(~np.isnan(tmax[..., 0, :, :]), axis=(-2, -1)),
+        'count': np.count_nonzero(exceed, axis=(-2, -1)),
+        'tmax_sum': np.sum(tmax, axis=(-2, -1), where=exceed, dtype=np.float64),
+        'p75_sum': np.nansum(p75, axis=(-2, -1)),
+        'p75_count': np.count_nonzero(~np.isnan(p75), axis=(-2, -1)),
+    }
+
+
+def heatwave_days(stats, coverage=0.25, min_days=3):
+    """Function: Days that meet the spatial coverage, minimum duration and intensity criteria.
+    :param stats: output of daily_statistics.
+    :type stats: dict
+    :param coverage: minimum fraction of the region above the threshold.
+    :type coverage: float
+    :param min_days: minimum number of consecutive days.
+    :type min_days: int
+    :return: dict with the daily 'extreme', 'heatwave' flags and the event 'intensity' and 'p75'.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = stats['count'] / np.expand_dims(stats['points'], -1)
+    extreme = fraction > coverage
+
+    in_run = run_length(extreme) >= min_days
+    labels = label_runs(in_run)
+
+    # Intensity parameter (PI): mean Tmax above the threshold between the days of the event
+    intensity = run_mean(labels, stats['tmax_sum'], stats['count'])
+    p75 = run_mean(labels, stats['p75_sum'], stats['p75_count'])
+
+    return {
+        'fraction': fraction,
+        'extreme': extreme,
+        'heatwave': in_run & (intensity > p75),
+        'intensity': intensity,
+        'p75': p75,
+    }
+
+
+def sweep_statistics(tmax, clim_tmax, clim_std, p75, std_factors):
+    """Function: daily_statistics for several std multipliers (clim Tmax + k * std).
+    :param tmax: maximum temperature, NaN outside the region (time, lat, lon).
+    :type tmax: numpy.ndarray
+    :param clim_tmax: climatological Tmax (time, lat, lon).
+    :type clim_tmax: numpy.ndarray
+    :param clim_std: climatological standard deviation (time, lat, lon).
+    :type clim_std: numpy.ndarray
+    :param p75: climatological 75th percentile, NaN outside the region (time, lat, lon).
+    :type p75: numpy.ndarray
+    :param std_factors: std multipliers.
+    :type std_factors: list
+    :return: daily statistics with a leading std multiplier dimension (without 'exceed').
+    """
+    stats = {'count': [], 'tmax_sum': []}
+    threshold = np.empty(np.broadcast_shapes(np.shape(clim_tmax), np.shape(clim_std)), dtype=np.float32)
+    for factor in std_factors:
+        # The threshold of each multiplier is computed in the same buffer
+        np.multiply(clim_std, factor, out=threshold)
+        threshold += clim_tmax
+        daily = daily_statistics(tmax, threshold, p75)
+        stats['count'].append(daily['count'])
+        stats['tmax_sum'].append(daily['tmax_sum'])
+
+    stats = {key: np.stack(value) for key, value in stats.items()}
+    stats['points'] = np.broadcast_to(daily['points'], (len(std_factors),))
+    stats['p75_sum'] = daily['p75_sum']
+    stats['p75_count'] = daily['p75_count']
+
+    return stats
+
+
+def sweep_events(stats, coverages, min_days):
+    """Function: Heat wave events for every combination of coverage and minimum duration.
+    :param stats: output of sweep_statistics (std multiplier, time).
+    :type stats: dict
+    :param coverages: spatial coverages.
+    :type coverages: list
+    :param min_days: minimum numbers of consecutive days.
+    :type min_days: list
+    :return: dict of arrays (std multiplier, coverage, min days, P75 test) with the number of
+        events, the number of heat wave days and the mean duration of the events.
+    """
+    coverages = np.asarray(coverages, dtype=float)
+    min_days = np.asarray(min_days, dtype=int)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = stats['count'] / stats['points'][:, None]
+
+    # (std, coverage, time)
+    extreme = fraction[:, None, :] > coverages[None, :, None]
+    length = run_length(extreme)
+
+    # (std, coverage, min days, time)
+    in_run = length[:, :, None, :] >= min_days[None, None, :, None]
+    labels = label_runs(in_run)
+
+    intensity = run_mean(labels, stats['tmax_sum'][:, None, None, :], stats['count'][:, None, None, :])
+    p75 = run_mean(labels, stats['p75_sum'], stats['p75_count'])
+
+    # (std, coverage, min days, P75 test, time): without / with the intensity test
+    heatwave = np.stack([in_run, in_run & (intensity > p75)], axis=-2)
+
+    previous = np.zeros(heatwave.shape, dtype=bool)
+    previous[..., 1:] = heatwave[..., :-1]
+    n_events = np.count_nonzero(heatwave & ~previous, axis=-1)
+    n_days = np.count_nonzero(heatwave, axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        duration = np.where(n_events > 0, n_days / n_events, np.nan)
+
+    return {
+        'n_events': n_events,
+        'heatwave_days': n_days,
+        'mean_duration': duration,
+    }
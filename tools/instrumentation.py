@@ -0,0 +1,163 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from tools.config import get_path
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Stage-level instrumentation.
+# Each entry point calls start_report() and save_report(); the steps are measured with
+# `with stage('name'):` anywhere in the chain (nested steps are recorded with their parent).
+# Environment:
+#   HWI_REPORT_DIR: directory of the reports (default: [paths] reports of hwi_config.ini).
+#   HWI_RUN_ID: groups the reports of the stages of one run (set by exec_heatwaves_forecast.sh).
+#   HWI_TRACE=1: also write a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+_report = None
+_local = threading.local()
+
+
+def _io_counters():
+    """Bytes read/written by the process (Linux /proc/self/io), None elsewhere."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def start_report(name, **attrs):
+    """Function: Start the run report of an entry point.
+    :param name: name of the stage (e.g. bias_correction).
+    :type name: str
+    :param attrs: run parameters saved in the report (date, region, model...).
+    """
+    global _report
+    _report = {
+        'stage': name,
+        'run_id': os.environ.get('HWI_RUN_ID', datetime.now().strftime('%Y%m%d%H%M%S')),
+        'attrs': {key: str(value) for key, value in attrs.items()},
+        'pid': os.getpid(),
+        'start': datetime.now().isoformat(timespec='seconds'),
+        'origin': time.perf_counter(),
+        'steps': [],
+    }
+    return _report
+
+
+@contextmanager
+def stage(name, **attrs):
+    """Function: Measure a step (wall time, CPU time, bytes read/written and peak RSS).
+    Does nothing when no report was started.
+    :param name: name of the step (e.g. read_era5, regrid, detection).
+    :type name: str
+    :param attrs: extra information saved with the step.
+    """
+    if _report is None:
+        yield
+        return
+
+    parents = getattr(_local, 'parents', [])
+    _local.parents = parents + [name]
+
+    read0, written0 = _io_counters()
+    cpu0 = time.process_time()
+    wall0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall1 = time.perf_counter()
+        read1, written1 = _io_counters()
+        _local.parents = parents
+        _report['steps'].append({
+            'name': name,
+            'path': '/'.join(parents + [name]),
+            'start_s': wall0 - _report['origin'],
+            'wall_s': wall1 - wall0,
+            'cpu_s': time.process_time() - cpu0,
+            'bytes_read': None if read0 is None else read1 - read0,
+            'bytes_written': None if written0 is None else written1 - written0,
+            'peak_rss_mb': _peak_rss_mb(),
+            'thread': threading.get_ident(),
+            'attrs': {key: str(value) for key, value in attrs.items()},
+        })
+
+
+def summarize(steps):
+    """Function: Totals of the steps with the same path (e.g. one bias computation per lead)."""
+    summary = {}
+    for step in steps:
+        total = summary.setdefault(step['path'], {
+            'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'bytes_read': 0, 'bytes_written': 0, 'peak_rss_mb': 0.0,
+        })
+        total['count'] += 1
+        total['wall_s'] += step['wall_s']
+        total['cpu_s'] += step['cpu_s']
+        total['bytes_read'] += step['bytes_read'] or 0
+        total['bytes_written'] += step['bytes_written'] or 0
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], step['peak_rss_mb'])
+    return summary
+
+
+def chrome_trace(report):
+    """Function: Steps of a report in the Chrome trace event format."""
+    events = [
+        {
+            'name': step['name'],
+            'cat': report['stage'],
+            'ph': 'X',
+            'ts': step['start_s'] * 1e6,
+            'dur': step['wall_s'] * 1e6,
+            'pid': report['pid'],
+            'tid': step['thread'],
+            'args': dict(step['attrs'], cpu_s=step['cpu_s'], bytes_read=step['bytes_read'],
+                         bytes_written=step['bytes_written'], peak_rss_mb=step['peak_rss_mb']),
+        }
+        for step in report['steps']
+    ]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def save_report(dir_report=None, trace=None):
+    """Function: Save the JSON run report (and optionally the Chrome trace).
+    :param dir_report: output directory (default: HWI_REPORT_DIR or the reports path of the configuration).
+    :type dir_report: str
+    :param trace: write the Chrome trace (default: HWI_TRACE=1).
+    :type trace: bool
+    :return: path of the JSON report.
+    """
+    if _report is None:
+        return None
+
+    dir_report = dir_report or os.environ.get('HWI_REPORT_DIR') or get_path('reports')
+    dir_run = f'{dir_report}/{_report["run_id"]}'
+    os.makedirs(dir_run, exist_ok=True)
+    if trace is None:
+        trace = os.environ.get('HWI_TRACE', '0') == '1'
+
+    report = {key: value for key, value in _report.items() if key != 'origin'}
+    report['wall_s'] = time.perf_counter() - _report['origin']
+    report['cpu_s'] = time.process_time()
+    report['peak_rss_mb'] = _peak_rss_mb()
+    report['summary'] = summarize(_report['steps'])
+
+    file_report = f'{dir_run}/{_report["stage"]}.json'
+    with open(file_report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if trace:
+        with open(f'{dir_run}/{_report["stage"]}.trace.json', 'w') as f:
+            json.dump(chrome_trace(_report), f)
+
+    print(f'Run report: {file_report}')
+    return file_report
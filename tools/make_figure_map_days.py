@@ -1,20 +1,19 @@
 import warnings
-import os
-import geopandas as gpd
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from matplotlib.colors import ListedColormap
 from matplotlib.offsetbox import (  # The OffsetBox is a simple container artist.
     AnnotationBbox, OffsetImage)
 from matplotlib.patches import Path, PathPatch
 from mpl_toolkits.basemap import Basemap
 from shapely.geometry import Point
 
-mpl.use("agg")
+from tools.assets import read_shapefile
+from tools.color_scales import ANOMALY_SCALE, TMAX_SCALE, scale_colormap
+from tools.config import get_path
 
-dir_local = os.getcwd()
+mpl.use("agg")
 
 warnings.filterwarnings('ignore')
 
@@ -72,9 +71,9 @@ def make_figure(
     if area == 'area1-summer':
         lon_min, lon_max, lat_min, lat_max = (-88, -30, -52, 16)
 
-    shapefile = dir_local + '/shape/BR_UF_2021/BR_UF_2021.shp'
+    shapefile = get_path('shapes') + '/BR_UF_2021/BR_UF_2021.shp'
 
-    shp = gpd.read_file(shapefile)
+    shp = read_shapefile(shapefile)
     shp = shp[shp.NM_UF == 'Ceará']
     shp = shp.explode().iloc[0].geometry
 
@@ -92,22 +91,10 @@ def make_figure(
 
     temp = np.array(data['t2m'][:])  # Lendo todo o tempo da variável t2m para usar o min e o max no levels
 
-    levs = [30, 32, 34, 36, 38, 39, 40]
-
-    jet_white = (
-        '#ffe0b3',
-        '#ffb84d',
-        '#FF7F00',
-        '#FF0000',
-        '#c10000',
-        '#880000'
-        )
-
-    levs = np.array(levs)
+    # Same scale as the map tiles (tools/color_scales.py)
+    levs = np.array(TMAX_SCALE['levels'])
 
-    my_cmap = ListedColormap(jet_white)
-    my_cmap.set_over('#540002')
-    my_cmap.set_under('#f8fa7a')
+    my_cmap = scale_colormap(TMAX_SCALE)
 
     for index, ax in enumerate(axarr.ravel()):
 
@@ -120,7 +107,7 @@ def make_figure(
             mymap.drawmeridians(np.arange(0, 360, 1), labels=[0, 0, 0, 1], linewidth=0.01, fontsize=10)
             mymap.drawparallels(np.arange(-90, 90, 1), labels=[1, 0, 0, 0], linewidth=0.01, fontsize=10)
             mymap.readshapefile(
-                f'{dir_local}/shape/i3geomap_limite_municipal/i3geomap_limite_municipal',
+                f'{get_path("shapes")}/i3geomap_limite_municipal/i3geomap_limite_municipal',
                 'i3geomap_limite_municipal',
                 color='black',
                 linewidth=0.2,
@@ -138,7 +125,7 @@ def make_figure(
 
         x, y = mymap(lon2d, lat2d)
 
-        mymap.readshapefile(f'{dir_local}/shape/BR_UF_2021/BR_UF_2021', 'BR_UF_2021', color='black', linewidth=0.9)
+        mymap.readshapefile(f'{get_path("shapes")}/BR_UF_2021/BR_UF_2021', 'BR_UF_2021', color='black', linewidth=0.9)
 
         tp = mymap.pcolormesh(x, y, temp[index], ax=ax, cmap=my_cmap,
                               norm=mpl.colors.BoundaryNorm(levs, ncolors=my_cmap.N, clip=False)
@@ -197,9 +184,9 @@ def make_figure_anomaly(
     if area == 'area1-summer':
         lon_min, lon_max, lat_min, lat_max = (-88, -30, -52, 16)
 
-    shapefile = dir_local + '/shape/BR_UF_2021/BR_UF_2021.shp'
+    shapefile = get_path('shapes') + '/BR_UF_2021/BR_UF_2021.shp'
 
-    shp = gpd.read_file(shapefile)
+    shp = read_shapefile(shapefile)
     shp = shp[shp.NM_UF == 'Ceará']
     shp = shp.explode().iloc[0].geometry
 
@@ -217,19 +204,10 @@ def make_figure_anomaly(
 
     temp = np.array(data['anomalia'][:])  # Lendo todo o tempo da variável t2m para usar o min e o max no levels
 
-    levs = [1, 2, 3, 4, 5]
-    jet_white = (
-        '#f8fa7a',
-        '#ffb84d',
-        '#FF7F00',
-        '#FF0000',
-        '#c10000'
-        )
+    # Same scale as the map tiles (tools/color_scales.py)
+    levs = np.array(ANOMALY_SCALE['levels'])
 
-    levs = np.array(levs)
-
-    my_cmap = ListedColormap(jet_white)
-    my_cmap.set_over('#540002')
+    my_cmap = scale_colormap(ANOMALY_SCALE)
 
     for index, ax in enumerate(axarr.ravel()):
 
@@ -242,7 +220,7 @@ def make_figure_anomaly(
             mymap.drawmeridians(np.arange(0, 360, 1), labels=[0, 0, 0, 1], linewidth=0.01, fontsize=10)
             mymap.drawparallels(np.arange(-90, 90, 1), labels=[1, 0, 0, 0], linewidth=0.01, fontsize=10)
             mymap.readshapefile(
-                f'{dir_local}/shape/i3geomap_limite_municipal/i3geomap_limite_municipal',
+                f'{get_path("shapes")}/i3geomap_limite_municipal/i3geomap_limite_municipal',
                 'i3geomap_limite_municipal',
                 color='black',
                 linewidth=0.2,
@@ -260,7 +238,7 @@ def make_figure_anomaly(
 
         x, y = mymap(lon2d, lat2d)
 
-        mymap.readshapefile(f'{dir_local}/shape/BR_UF_2021/BR_UF_2021', 'BR_UF_2021', color='black', linewidth=0.9)
+        mymap.readshapefile(f'{get_path("shapes")}/BR_UF_2021/BR_UF_2021', 'BR_UF_2021', color='black', linewidth=0.9)
 
         tp = mymap.pcolormesh(
             x, y, temp[index], ax=ax, cmap=my_cmap,
@@ -317,9 +295,9 @@ def make_figure_reference(
     if area == 'area1-summer':
         lon_min, lon_max, lat_min, lat_max = (-88, -30, -52, 16)
 
-    shapefile = dir_local + '/shape/BR_UF_2021/BR_UF_2021.shp'
+    shapefile = get_path('shapes') + '/BR_UF_2021/BR_UF_2021.shp'
 
-    shp = gpd.read_file(shapefile)
+    shp = read_shapefile(shapefile)
     shp = shp[shp.NM_UF == 'Ceará']
     shp = shp.explode().iloc[0].geometry
 
@@ -337,22 +315,10 @@ def make_figure_reference(
 
     temp = np.array(data['t2m'][:])  # Lendo todo o tempo da variável t2m para usar o min e o max no levels
 
-    levs = [30, 32, 34, 36, 38, 39, 40]
-
-    jet_white = (
-        '#ffe0b3',
-        '#ffb84d',
-        '#FF7F00',
-        '#FF0000',
-        '#c10000',
-        '#880000'
-        )
-
-    levs = np.array(levs)
+    # Same scale as the map tiles (tools/color_scales.py)
+    levs = np.array(TMAX_SCALE['levels'])
 
-    my_cmap = ListedColormap(jet_white)
-    my_cmap.set_over('#540002')
-    my_cmap.set_under('#f8fa7a')
+    my_cmap = scale_colormap(TMAX_SCALE)
 
     for index, ax in enumerate(axarr.ravel()):
 
@@ -365,7 +331,7 @@ def make_figure_reference(
             mymap.drawmeridians(np.arange(0, 360, 1), labels=[0, 0, 0, 1], linewidth=0.01, fontsize=10)
             mymap.drawparallels(np.arange(-90, 90, 1), labels=[1, 0, 0, 0], linewidth=0.01, fontsize=10)
             mymap.readshapefile(
-                f'{dir_local}/shape/i3geomap_limite_municipal/i3geomap_limite_municipal',
+                f'{get_path("shapes")}/i3geomap_limite_municipal/i3geomap_limite_municipal',
                 'i3geomap_limite_municipal',
                 color='black',
                 linewidth=0.2,
@@ -383,7 +349,7 @@ def make_figure_reference(
 
         x, y = mymap(lon2d, lat2d)
 
-        mymap.readshapefile(f'{dir_local}/shape/BR_UF_2021/BR_UF_2021', 'BR_UF_2021', color='black', linewidth=0.9)
+        mymap.readshapefile(f'{get_path("shapes")}/BR_UF_2021/BR_UF_2021', 'BR_UF_2021', color='black', linewidth=0.9)
 
         tp = mymap.pcolormesh(x, y, temp[index], ax=ax, cmap=my_cmap,
                               norm=mpl.colors.BoundaryNorm(levs, ncolors=my_cmap.N, clip=False)
@@ -0,0 +1,107 @@
+import json
+import os
+
+import pandas as pd
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# State of the incremental monitor of the reference heat waves (id_heatwaves_obs.py --monitor).
+# Only the regional daily sums of the criteria are kept (tools/heatwave_core.py):
+#   last_day: last day processed.
+#   run: open sequence of days above the coverage (start, days and the running sums of
+#        the intensity parameter and of the P75), None when the last day is below it.
+#   events: sequences of at least min_days days (start, end, intensity, P75, heat wave).
+# A new day only updates the open run, so the days before it are never read again.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+SUMS = ['count', 'tmax_sum', 'p75_sum', 'p75_count']
+
+
+def new_state(params):
+    """Function: Empty state of the monitor for some parameters (region, coverage, definition, ...)."""
+    return {'params': params, 'last_day': None, 'run': None, 'events': []}
+
+
+def load_state(filename, params):
+    """Function: State saved by save_state, a new state when there is none or the parameters changed."""
+    if not os.path.isfile(filename):
+        return new_state(params)
+
+    with open(filename) as f:
+        state = json.load(f)
+    if state['params'] != params:
+        print(f'The parameters changed ({state["params"]} -> {params}): the monitor starts again')
+        return new_state(params)
+
+    return state
+
+
+def save_state(state, filename):
+    """Function: Save the state (atomically: a run stopped while writing keeps the previous state)."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f'{filename}.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(f'{filename}.tmp', filename)
+
+
+def update_state(state, day, stats, coverage=0.25, min_days=3):
+    """Function: Add the regional sums of a new day to the state.
+    :param state: state of the monitor (modified in place).
+    :type state: dict
+    :param day: new day (the day after state['last_day']).
+    :type day: datetime
+    :param stats: regional sums of the day (points, count, tmax_sum, p75_sum, p75_count).
+    :type stats: dict
+    :param coverage: minimum fraction of the region above the threshold.
+    :type coverage: float
+    :param min_days: minimum number of consecutive days.
+    :type min_days: int
+    :return: dict with the 'event' updated by the day (None if any) and the 'closed'
+        run (start and number of days, None if the day did not close a run).
+    """
+    day = pd.Timestamp(day)
+    if state['last_day'] is not None and day != pd.Timestamp(state['last_day']) + pd.Timedelta(days=1):
+        raise ValueError(f'{day:%Y-%m-%d} does not follow the last day of the monitor ({state["last_day"]})')
+
+    state['last_day'] = day.strftime('%Y-%m-%d')
+    extreme = stats['points'] > 0 and stats['count'] / stats['points'] > coverage
+    closed = None
+    if not extreme:
+        if state['run'] is not None:
+            closed = {'start': state['run']['start'], 'days': state['run']['days']}
+            if state['run']['days'] >= min_days:
+                state['events'][-1]['ongoing'] = False
+        state['run'] = None
+        return {'event': None, 'closed': closed}
+
+    run = state['run']
+    if run is None:
+        run = state['run'] = {'start': state['last_day'], 'days': 0, **{key: 0.0 for key in SUMS}}
+    run['days'] += 1
+    for key in SUMS:
+        run[key] += float(stats[key])
+
+    if run['days'] < min_days:
+        return {'event': None, 'closed': None}
+
+    # Intensity parameter (PI) and P75 of the event up to this day
+    event = {
+        'start': run['start'],
+        'end': state['last_day'],
+        'days': run['days'],
+        'intensity': run['tmax_sum'] / run['count'],
+        'p75': run['p75_sum'] / run['p75_count'] if run['p75_count'] > 0 else float('nan'),
+        'ongoing': True,
+    }
+    event['heatwave'] = bool(event['intensity'] > event['p75'])
+    if run['days'] > min_days:
+        state['events'][-1] = event
+    else:
+        state['events'].append(event)
+
+    return {'event': event, 'closed': None}
+
+
+def events_table(state):
+    """Function: Events of the state as a table."""
+    columns = ['start', 'end', 'days', 'intensity', 'p75', 'heatwave', 'ongoing']
+    return pd.DataFrame(state['events'], columns=columns)
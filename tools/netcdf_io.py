@@ -0,0 +1,129 @@
+import numpy as np
+import xarray as xr
+
+from tools.config import get_option
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Encoding settings for each stage of the heatwave chain.
+#   compression: 'zlib' or 'zstd' (zstd needs netCDF4 >= 1.6 built with the zstd plugin); None disables it.
+#   complevel: compression level.
+#   pack: temperature variables stored as int16 with scale_factor=0.01 (0.01 °C precision);
+#         scale_factor/add_offset are float32, so the next stages decode them as float32.
+#   float32: downcast the remaining float64 variables to float32.
+# [netcdf] compression/complevel of hwi_config.ini override the compression of every stage.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+STAGE_ENCODING = {
+    'default': {'compression': 'zlib', 'complevel': 4, 'pack': [], 'float32': True},
+    'bias_correction': {'compression': 'zlib', 'complevel': 4, 'pack': ['t2m'], 'float32': True},
+    'forecast_detection': {'compression': 'zlib', 'complevel': 4, 'pack': ['t2m'], 'float32': True},
+    'reference_detection': {'compression': 'zlib', 'complevel': 4, 'pack': ['t2m'], 'float32': True},
+}
+
+PACK_SCALE = 0.01
+PACK_FILL = np.int16(-32767)
+
+
+def packing_parameters(var, scale=PACK_SCALE):
+    """Function: int16 scale/offset packing for a float variable.
+    The offset is centred on the data range, so both °C and K fields fit.
+    :param var: variable to be packed.
+    :type var: xarray.DataArray
+    :param scale: packing precision.
+    :type scale: float
+    :return: encoding entries, or None when the data range does not fit in int16.
+    """
+    vmin = float(var.min(skipna=True))
+    vmax = float(var.max(skipna=True))
+    if np.isnan(vmin):
+        # Only NaNs (e.g. forecast without heatwave days)
+        add_offset = 0.0
+    else:
+        add_offset = float(np.round((vmin + vmax) / 2))
+        if max(vmax - add_offset, add_offset - vmin) > (np.iinfo(np.int16).max - 1) * scale:
+            return None
+
+    return {
+        'dtype': 'int16',
+        'scale_factor': np.float32(scale),
+        'add_offset': np.float32(add_offset),
+        '_FillValue': PACK_FILL,
+    }
+
+
+def netcdf_encoding(
+        ds,
+        compression='zlib',
+        complevel=4,
+        pack=(),
+        float32=True,
+        time_dim='time',
+):
+    """Function: Build the to_netcdf encoding of a dataset.
+    Variables are chunked one time slice per chunk, which is how the
+    next stages (detection and figures) read them.
+    :param ds: dataset to be written.
+    :type ds: xarray.Dataset
+    :param compression: 'zlib', 'zstd' or None.
+    :type compression: str
+    :param complevel: compression level.
+    :type complevel: int
+    :param pack: names of the variables packed as int16.
+    :type pack: list
+    :param float32: downcast float64 variables to float32.
+    :type float32: bool
+    :param time_dim: name of the time dimension.
+    :type time_dim: str
+    """
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        enc = {}
+
+        if compression is not None and complevel > 0:
+            if compression == 'zlib':
+                enc.update(zlib=True, complevel=complevel)
+            else:
+                enc.update(compression=compression, complevel=complevel)
+            enc['shuffle'] = True
+
+        if var.ndim > 0:
+            enc['chunksizes'] = tuple(
+                1 if dim == time_dim else size
+                for dim, size in var.sizes.items()
+            )
+
+        packing = None
+        if name in pack and np.issubdtype(var.dtype, np.floating):
+            packing = packing_parameters(var)
+        if packing is not None:
+            enc.update(packing)
+        elif float32 and var.dtype == np.float64:
+            enc['dtype'] = 'float32'
+
+        encoding[name] = enc
+
+    return encoding
+
+
+def write_netcdf(data, filename, stage='default', **kwargs):
+    """Function: Save a dataset with the compression settings of a stage.
+    :param data: dataset (or data array) to be written.
+    :type data: xarray.Dataset
+    :param filename: output file.
+    :type filename: str
+    :param stage: key of STAGE_ENCODING.
+    :type stage: str
+    :param kwargs: overrides of the stage settings (compression, complevel, pack, float32).
+    """
+    if isinstance(data, xr.DataArray):
+        data = data.to_dataset(name=data.name or 't2m')
+
+    settings = dict(STAGE_ENCODING.get(stage, STAGE_ENCODING['default']))
+    compression = get_option('netcdf', 'compression')
+    if compression is not None:
+        settings['compression'] = None if compression == 'none' else compression
+    complevel = get_option('netcdf', 'complevel', int)
+    if complevel is not None:
+        settings['complevel'] = complevel
+    settings.update(kwargs)
+
+    data.to_netcdf(filename, encoding=netcdf_encoding(data, **settings))
@@ -0,0 +1,53 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import xarray as xr
+
+from tools.config import get_option
+
+# netCDF-C/HDF5 are not thread safe and xarray does not lock every metadata read
+# (e.g. the attributes when a file is opened): the files read in threads are opened
+# and loaded one at a time, while the previous ones are processed.
+NETCDF_LOCK = threading.Lock()
+
+
+def load_netcdf(filename, select=None):
+    """Function: Open a netCDF file and load it (or a selection of it) holding NETCDF_LOCK.
+    :param filename: netCDF file.
+    :type filename: str
+    :param select: function applied to the dataset before loading (e.g. a region window).
+    :type select: function
+    :return: xarray.Dataset (or what select returns) in memory.
+    """
+    with NETCDF_LOCK, xr.open_dataset(filename) as ds:
+        return (ds if select is None else select(ds)).load()
+
+
+def prefetch(items, load, depth=None):
+    """Function: Load the items in background threads while the previous ones are processed.
+    The results are yielded in the order of the items. At most `depth` items are
+    loaded ahead of the one being processed, which caps the memory held by the queue.
+    :param items: items to be loaded (e.g. file names or dates).
+    :type items: iterable
+    :param load: function reading one item (it should return data already in memory, e.g. .load()).
+    :type load: function
+    :param depth: number of items loaded ahead (default: [run] prefetch of hwi_config.ini).
+    :type depth: int
+    """
+    depth = max(1, depth or get_option('run', 'prefetch', int) or 1)
+    items = iter(items)
+
+    executor = ThreadPoolExecutor(max_workers=depth)
+    pending = deque(executor.submit(load, item) for _, item in zip(range(depth), items))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in items:
+                pending.append(executor.submit(load, item))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
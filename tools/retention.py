@@ -0,0 +1,181 @@
+import os
+import re
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Retention of the data directories.
+# Each directory is indexed once (path, size, modification time and date of the
+# file); the policies are applied to the index:
+#   max_age: days kept, by the date in the file name (e.g. 20240422 in
+#            monan.20240422.onda_de_calor.nc or in the 2024042200/ directory of the
+#            forecasts) or, when there is none, by the modification time;
+#   max_files: number of newest files kept;
+#   max_size: MB kept (the oldest files go first);
+#   compact: days after which the files with a date in the name are moved to
+#            monthly archives (archive/<YYYYMM>.tar in the directory).
+# The files are removed in batches by a pool of threads.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+LIMITS = ['max_age', 'max_files', 'max_size', 'compact']
+ARCHIVE_DIR = 'archive'
+BATCH_SIZE = 500
+
+# YYYYMMDD, possibly followed by the hour (YYYYMMDDHH), not inside a longer number
+DATE_PATTERN = re.compile(r'(?<!\d)(\d{8})(?:\d{2})?(?!\d)')
+
+
+def file_date(path):
+    """Function: First valid date (YYYYMMDD) in a path, None when there is none."""
+    for match in DATE_PATTERN.finditer(path):
+        try:
+            return datetime.strptime(match.group(1), '%Y%m%d')
+        except ValueError:
+            continue
+    return None
+
+
+def index_directory(root):
+    """Function: Files of a directory and its subdirectories (the archives are not included).
+    :param root: directory.
+    :type root: str
+    :return: pandas.DataFrame with path, size (bytes), mtime and date (date in the
+    path relative to root, or the modification day), oldest first.
+    """
+    rows = []
+    directories = [root] if os.path.isdir(root) else []
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path != os.path.join(root, ARCHIVE_DIR):
+                        directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    info = entry.stat(follow_symlinks=False)
+                    rows.append((entry.path, info.st_size, info.st_mtime, file_date(os.path.relpath(entry.path, root))))
+
+    index = pd.DataFrame(rows, columns=['path', 'size', 'mtime', 'date'])
+    index['mtime'] = pd.to_datetime(index['mtime'], unit='s')
+    index['named'] = index['date'].notna()
+    index['date'] = pd.to_datetime(index['date']).fillna(index['mtime'].dt.normalize())
+
+    return index.sort_values(['date', 'mtime']).reset_index(drop=True)
+
+
+def apply_policy(index, now, max_age=None, max_files=None, max_size=None, compact=None):
+    """Function: Files removed and files archived by a policy.
+    :param index: index_directory of the directory.
+    :type index: pandas.DataFrame
+    :param now: reference time of the ages.
+    :type now: datetime
+    :param max_age: days kept (None: no limit).
+    :type max_age: float
+    :param max_files: newest files kept (None: no limit).
+    :type max_files: int
+    :param max_size: MB kept (None: no limit).
+    :type max_size: float
+    :param compact: days after which the dated files are archived (None: no archives).
+    :type compact: float
+    :return: boolean arrays (remove, archive) aligned with the index.
+    """
+    age = (pd.Timestamp(now) - index['date']).dt.days.to_numpy()
+    remove = np.zeros(len(index), dtype=bool)
+
+    if max_age is not None:
+        remove |= age > max_age
+    if max_files is not None:
+        remove[:max(0, len(index) - int(max_files))] = True
+    if max_size is not None:
+        # Size of the file and of all the newer ones
+        newer = index['size'].to_numpy()[::-1].cumsum()[::-1]
+        remove |= newer > max_size * 2**20
+
+    archive = np.zeros(len(index), dtype=bool)
+    if compact is not None:
+        archive = ~remove & index['named'].to_numpy() & (age > compact)
+
+    return remove, archive
+
+
+def _remove_batch(paths):
+    """Remove a batch of files (missing files are ignored)."""
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def remove_files(paths, workers=None, batch_size=BATCH_SIZE):
+    """Function: Remove files in batches in a pool of threads.
+    :param paths: files.
+    :type paths: list
+    :param workers: number of threads (default: Python's default).
+    :type workers: int
+    :return: number of files removed.
+    """
+    paths = list(paths)
+    batches = [paths[start:start + batch_size] for start in range(0, len(paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(_remove_batch, batches))
+
+
+def remove_empty_dirs(root):
+    """Function: Remove the empty subdirectories of root (e.g. old forecast initializations)."""
+    for path, dirs, files in os.walk(root, topdown=False):
+        if path != root and not os.listdir(path):
+            os.rmdir(path)
+
+
+def archive_files(root, files, dates, workers=None):
+    """Function: Add files to the monthly archives of a directory (archive/<YYYYMM>.tar).
+    :param root: directory (the names in the archives are relative to it).
+    :type root: str
+    :param files: files to be archived.
+    :type files: list
+    :param dates: date of each file (month of the archive).
+    :type dates: list
+    :return: list of the archives written.
+    """
+    months = {}
+    for path, day in zip(files, dates):
+        months.setdefault(pd.Timestamp(day).strftime('%Y%m'), []).append(path)
+
+    os.makedirs(os.path.join(root, ARCHIVE_DIR), exist_ok=True)
+
+    def write(item):
+        month, paths = item
+        filename = os.path.join(root, ARCHIVE_DIR, f'{month}.tar')
+        names = {os.path.relpath(path, root): path for path in paths}
+        archived = []
+        if os.path.isfile(filename):
+            with tarfile.open(filename) as tar:
+                archived = tar.getnames()
+
+        # Uncompressed: the outputs are already compressed (netCDF, PNG), new files are appended
+        if not names.keys() & set(archived):
+            with tarfile.open(filename, 'a' if archived else 'w') as tar:
+                for name, path in names.items():
+                    tar.add(path, arcname=name)
+            return filename
+
+        # Files archived again (e.g. rewritten by a rerun): a new archive replaces their old copies
+        partial = f'{filename}.{os.getpid()}.part'
+        with tarfile.open(filename) as old, tarfile.open(partial, 'w') as tar:
+            for member in old:
+                if member.name not in names:
+                    tar.addfile(member, old.extractfile(member) if member.isfile() else None)
+            for name, path in names.items():
+                tar.add(path, arcname=name)
+        os.replace(partial, filename)
+        return filename
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(write, sorted(months.items())))
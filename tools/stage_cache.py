@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+from glob import glob
+
+from tools.config import DIR_REPO, get_path
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Stage-level result cache.
+# A stage is skipped when its key (digests of the input files + parameters) is
+# the one recorded by its last run and its outputs were not modified since.
+# The digest of a file is recomputed only when its size or modification time
+# change, so a rerun only reads the files that changed.
+# The code of a stage (its script and the tools package, see code_files) is part
+# of its inputs, so a change of the code also runs the stage again.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+BLOCK_SIZE = 2**22
+
+
+def cache_dir():
+    directory = f'{get_path("cache")}/stages'
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _read_json(filename, default):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(filename, data):
+    partial = f'{filename}.{os.getpid()}.part'
+    with open(partial, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(partial, filename)
+
+
+def file_digests(files):
+    """Function: Content digests (blake2b) of the files, None for missing files.
+    :param files: file names.
+    :type files: list
+    :return: dict file -> digest.
+    """
+    index_file = f'{cache_dir()}/digests.json'
+    index = _read_json(index_file, {})
+
+    digests = {}
+    changed = False
+    for filename in files:
+        if not os.path.isfile(filename):
+            digests[filename] = None
+            continue
+
+        path = os.path.realpath(filename)
+        status = os.stat(path)
+        entry = index.get(path)
+        if entry is None or entry[:2] != [status.st_size, status.st_mtime_ns]:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                    digest.update(block)
+            entry = [status.st_size, status.st_mtime_ns, digest.hexdigest()]
+            index[path] = entry
+            changed = True
+        digests[filename] = entry[2]
+
+    if changed:
+        _write_json(index_file, index)
+
+    return digests
+
+
+def code_files(script):
+    """Function: Code of a stage: its script and every module of the tools package.
+    :param script: __file__ of the stage script.
+    :type script: str
+    """
+    return [os.path.abspath(script)] + sorted(glob(f'{DIR_REPO}/tools/*.py'))
+
+
+def stage_key(inputs, params):
+    """Function: Key of a stage run.
+    The key depends on the content of the inputs and on their position in the
+    list (not on their paths, so staged-in copies give the same key) and on
+    the parameters.
+    :param inputs: input files, in a fixed order (add code_files for the code of the stage).
+    :type inputs: list
+    :param params: parameters of the run (JSON serializable).
+    :type params: dict
+    """
+    digests = file_digests(inputs)
+    digests = [[position, digests[f]] for position, f in enumerate(inputs)]
+    text = json.dumps({'inputs': digests, 'params': params}, sort_keys=True, default=str)
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _manifest(stage, tag):
+    return f'{cache_dir()}/{stage}.{tag}.json'
+
+
+def is_fresh(stage, tag, key, outputs):
+    """Function: True when the outputs of the stage are still valid for this key.
+    :param stage: name of the stage (e.g. bias_correction).
+    :type stage: str
+    :param tag: run identification (e.g. model.date.region).
+    :type tag: str
+    :param key: output of stage_key.
+    :type key: str
+    :param outputs: output files of the stage.
+    :type outputs: list
+    """
+    manifest = _read_json(_manifest(stage, tag), None)
+    if manifest is None or manifest['key'] != key or sorted(manifest['outputs']) != sorted(outputs):
+        return False
+
+    # The outputs must be the ones written by that run
+    return file_digests(outputs) == manifest['outputs']
+
+
+def record(stage, tag, key, outputs):
+    """Function: Save the key and the output digests of a finished stage."""
+    _write_json(_manifest(stage, tag), {'key': key, 'outputs': file_digests(outputs)})
+
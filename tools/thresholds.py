@@ -0,0 +1,155 @@
+import numpy as np
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Heat wave definitions.
+# Each definition turns the daily fields (Tmax, and Tmin when it needs it) and the
+# climatology into a boolean exceedance field (..., time, latitude, longitude). The
+# spatial coverage, minimum duration and intensity (P75) criteria are the same for
+# every definition (tools/heatwave_core.py).
+#
+#   fields: input variables of the detectors ('tmax', 'tmin').
+#   climatology: variables of the climatology file.
+#   lookback: days read before the period (e.g. EHF acclimatization window).
+#
+# The arrays may be numpy or dask arrays (chunked mode).
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+EHF_WINDOW = 3
+EHF_ACCLIMATIZATION = 30
+
+
+def exceed_std(fields, clim):
+    """Function: Tmax > clim Tmax + std."""
+    return fields['tmax'] > clim['t2m'].data + clim['std'].data
+
+
+def exceed_p90(fields, clim):
+    """Function: Tmax > climatological 90th percentile of Tmax."""
+    return fields['tmax'] > clim['percentil90'].data
+
+
+def exceed_tmax_tmin(fields, clim):
+    """Function: Tmax and Tmin above their climatological 90th percentiles on the same day."""
+    return (fields['tmax'] > clim['percentil90'].data) & (fields['tmin'] > clim['tmin_percentil90'].data)
+
+
+def excess_heat_factor(temperature, t95, window=EHF_WINDOW, acclimatization=EHF_ACCLIMATIZATION):
+    """Function: Excess Heat Factor (Nairn & Fawcett, 2015) of each day.
+    EHF = EHI_sig * max(1, EHI_accl), where EHI_sig is the mean of the day and the
+    next (window - 1) days minus the climatological 95th percentile and EHI_accl the
+    same mean minus the mean of the previous `acclimatization` days.
+    :param temperature: daily temperature (..., time, lat, lon).
+    :type temperature: numpy.ndarray
+    :param t95: climatological 95th percentile of the same temperature (time, lat, lon).
+    :type t95: numpy.ndarray
+    :return: EHF (NaN on the days without the full windows).
+    """
+    n_days = temperature.shape[-3]
+    empty = np.full_like(temperature[..., 0, :, :], np.nan)
+
+    days = []
+    for t in range(n_days):
+        if t < acclimatization or t + window > n_days:
+            days.append(empty)
+            continue
+        mean_window = temperature[..., t:t + window, :, :].mean(axis=-3)
+        mean_previous = temperature[..., t - acclimatization:t, :, :].mean(axis=-3)
+        significance = mean_window - t95[..., t, :, :]
+        days.append(significance * np.maximum(1, mean_window - mean_previous))
+
+    return np.stack(days, axis=-3)
+
+
+def exceed_ehf(fields, clim):
+    """Function: Excess Heat Factor of Tmax above zero."""
+    ehf = excess_heat_factor(fields['tmax'], clim['percentil95'].data)
+    return ehf > 0  # NaN compares as False
+
+
+DEFINITIONS = {
+    'std': {
+        'exceedance': exceed_std,
+        'fields': ['tmax'],
+        'climatology': ['t2m', 'std'],
+        'lookback': 0,
+        'long_name': 'Tmax > clim Tmax + std',
+    },
+    'p90': {
+        'exceedance': exceed_p90,
+        'fields': ['tmax'],
+        'climatology': ['percentil90'],
+        'lookback': 0,
+        'long_name': 'Tmax > clim P90 of Tmax',
+    },
+    'tmax_tmin': {
+        'exceedance': exceed_tmax_tmin,
+        'fields': ['tmax', 'tmin'],
+        'climatology': ['percentil90', 'tmin_percentil90'],
+        'lookback': 0,
+        'long_name': 'Tmax > clim P90 of Tmax and Tmin > clim P90 of Tmin',
+    },
+    'ehf': {
+        'exceedance': exceed_ehf,
+        'fields': ['tmax'],
+        'climatology': ['percentil95'],
+        'lookback': EHF_ACCLIMATIZATION,
+        'long_name': 'Excess Heat Factor of Tmax > 0',
+    },
+}
+
+
+def definition_suffix(name):
+    """Function: Suffix of the output files of a definition ('' for the default std definition)."""
+    return '' if name == 'std' else f'.{name}'
+
+
+def check_definitions(names, fields=('tmax',), lookback=True):
+    """Function: Stop when a definition is unknown or needs inputs the detector does not have.
+    :param names: names of the definitions.
+    :type names: list
+    :param fields: input variables available.
+    :type fields: list
+    :param lookback: whether days before the period can be read.
+    :type lookback: bool
+    """
+    for name in names:
+        if name not in DEFINITIONS:
+            print(f'Unknown definition {name}: {", ".join(DEFINITIONS)}')
+            exit()
+        spec = DEFINITIONS[name]
+        missing = [field for field in spec['fields'] if field not in fields]
+        if missing:
+            print(f'The {name} definition needs {", ".join(missing)}, which is not available here')
+            exit()
+        if spec['lookback'] and not lookback:
+            print(f'The {name} definition needs the {spec["lookback"]} days before the period, which are not available here')
+            exit()
+
+
+def check_climatology(names, clim, filename=''):
+    """Function: Stop when the climatology lacks a variable of the definitions."""
+    for name in names:
+        missing = [var for var in DEFINITIONS[name]['climatology'] if var not in clim]
+        if missing:
+            print(f'Climatology {filename} has no {", ".join(missing)} (needed by the {name} definition)')
+            exit()
+
+
+def requirements(names):
+    """Function: Input fields and days before the period needed by the definitions together."""
+    fields = sorted({field for name in names for field in DEFINITIONS[name]['fields']})
+    lookback = max(DEFINITIONS[name]['lookback'] for name in names)
+    return fields, lookback
+
+
+def exceedance(names, fields, clim):
+    """Function: Exceedance field of each definition from the same data in memory.
+    :param names: names of the definitions.
+    :type names: list
+    :param fields: input arrays ('tmax', 'tmin'), NaN outside the region (..., time, lat, lon).
+    :type fields: dict
+    :param clim: climatology on the same grid and days (xarray.Dataset).
+    :type clim: xarray.Dataset
+    :return: dict name -> boolean array.
+    """
+    return {name: DEFINITIONS[name]['exceedance'](fields, clim) for name in names}
@@ -0,0 +1,224 @@
+import json
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from tools.color_scales import scale_lut
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# XYZ map tiles (Web Mercator, 256x256 PNG) of the heat wave fields for the web viewer:
+#   <dir>/<layer>/<z>/<x>/<y>.png  and  <dir>/tiles.json (bounds, zooms, layers and legends)
+# Each pixel takes the color of the grid cell it falls in (as pcolormesh) with the
+# classes of the PNG panels (tools/color_scales.py); NaN is transparent. Only the
+# tiles over the grid are considered, and the tiles without any value are skipped
+# before rendering (count of valid cells of the tile window in a summed-area table).
+# The tiles of all layers and zoom levels are rendered in parallel processes.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+
+# Layers of the worker processes (inherited at the fork, not copied to each task)
+_layers = {}
+
+
+def tile_bounds(z, x, y):
+    """Function: (lon_min, lat_min, lon_max, lat_max) of a tile."""
+    n = 2**z
+    lat_max = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    lat_min = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return x / n * 360 - 180, lat_min, (x + 1) / n * 360 - 180, lat_max
+
+
+def tile_range(bounds, z):
+    """Function: Tiles of zoom z over the bounds (lon_min, lat_min, lon_max, lat_max): x and y ranges."""
+    n = 2**z
+    lon_min, lat_min, lon_max, lat_max = bounds
+    lat_min, lat_max = max(lat_min, -MAX_LATITUDE), min(lat_max, MAX_LATITUDE)
+
+    def column(lon):
+        return int(np.clip(np.floor((lon + 180) / 360 * n), 0, n - 1))
+
+    def row(lat):
+        y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n
+        return int(np.clip(np.floor(y), 0, n - 1))
+
+    return range(column(lon_min), column(lon_max) + 1), range(row(lat_max), row(lat_min) + 1)
+
+
+def pixel_coordinates(z, x, y):
+    """Function: Longitudes (columns) and latitudes (rows) of the pixel centres of a tile."""
+    n = 2**z * TILE_SIZE
+    offsets = np.arange(TILE_SIZE) + 0.5
+    lon = (x * TILE_SIZE + offsets) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y * TILE_SIZE + offsets) / n))))
+    return lon, lat
+
+
+def cell_edges(centres):
+    """Function: Edges of the cells of ascending grid coordinates."""
+    middle = (centres[1:] + centres[:-1]) / 2
+    first = centres[0] - (middle[0] - centres[0]) if len(centres) > 1 else centres[0] - 0.5
+    last = centres[-1] + (centres[-1] - middle[-1]) if len(centres) > 1 else centres[-1] + 0.5
+    return np.concatenate([[first], middle, [last]])
+
+
+def prepare_layer(field, latitude, longitude, scale):
+    """Function: Layer of one 2D field: classes of the color scale and the table of valid cells.
+    :param field: field (latitude, longitude), NaN where nothing is drawn.
+    :type field: numpy.ndarray
+    :param latitude: latitudes of the grid.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the grid (-180..180 or 0..360).
+    :type longitude: numpy.ndarray
+    :param scale: color scale (tools/color_scales.py).
+    :type scale: dict
+    :return: dict with the class of each cell (0: NaN), the cell edges, the summed-area
+        table of the valid cells, the color table and the bounds of the grid.
+    """
+    field = np.asarray(field)
+    latitude, longitude = np.asarray(latitude), np.asarray(longitude)
+    if latitude[0] > latitude[-1]:
+        field, latitude = field[::-1], latitude[::-1]
+
+    # Web Mercator tiles span -180..180 (e.g. the 0..360 grid of GFS)
+    longitude = (longitude.astype(float) + 180) % 360 - 180
+    order = np.argsort(longitude, kind='stable')
+    field, longitude = field[:, order], longitude[order]
+
+    valid = ~np.isnan(field)
+    classes = np.zeros(field.shape, dtype=np.uint8)
+    classes[valid] = np.searchsorted(scale['levels'], field[valid], side='right') + 1
+
+    # counts[i, j]: valid cells in the rows < i and the columns < j
+    counts = np.zeros((field.shape[0] + 1, field.shape[1] + 1), dtype=np.int64)
+    counts[1:, 1:] = np.cumsum(np.cumsum(valid, axis=0), axis=1)
+
+    lat_edges, lon_edges = cell_edges(latitude), cell_edges(longitude)
+    return {
+        'classes': classes,
+        'counts': counts,
+        'lat_edges': lat_edges,
+        'lon_edges': lon_edges,
+        'lut': scale_lut(scale),
+        'bounds': (lon_edges[0], lat_edges[0], lon_edges[-1], lat_edges[-1]),
+    }
+
+
+def is_empty(layer, z, x, y):
+    """Function: True when the tile has no valid cell (O(1) with the summed-area table)."""
+    lon_min, lat_min, lon_max, lat_max = tile_bounds(z, x, y)
+    i0, i1 = np.searchsorted(layer['lat_edges'], [lat_min, lat_max]) - [1, 0]
+    j0, j1 = np.searchsorted(layer['lon_edges'], [lon_min, lon_max]) - [1, 0]
+    n_lat, n_lon = layer['classes'].shape
+    i0, i1 = max(i0, 0), min(i1, n_lat)
+    j0, j1 = max(j0, 0), min(j1, n_lon)
+    if i0 >= i1 or j0 >= j1:
+        return True
+
+    counts = layer['counts']
+    return counts[i1, j1] - counts[i0, j1] - counts[i1, j0] + counts[i0, j0] == 0
+
+
+def render_tile(layer, z, x, y):
+    """Function: Image of one tile (PIL palette image, index 0 transparent), None when it has no value."""
+    lon, lat = pixel_coordinates(z, x, y)
+    n_lat, n_lon = layer['classes'].shape
+
+    # Cell of each pixel column / row (-1 outside the grid)
+    j = np.searchsorted(layer['lon_edges'], lon, side='right') - 1
+    i = np.searchsorted(layer['lat_edges'], lat, side='right') - 1
+    j[(j < 0) | (j >= n_lon)] = -1
+    i[(i < 0) | (i >= n_lat)] = -1
+
+    pixels = layer['classes'][np.ix_(np.maximum(i, 0), np.maximum(j, 0))]
+    pixels[i < 0, :] = 0
+    pixels[:, j < 0] = 0
+    if not pixels.any():
+        return None
+
+    # Palette: transparent, under, classes, over
+    lut = layer['lut']
+    image = Image.fromarray(pixels, mode='P')
+    image.putpalette(np.vstack([[0, 0, 0], lut[:, :3]]).astype(np.uint8).ravel().tolist())
+    image.info['transparency'] = bytes([0] + lut[:, 3].tolist())
+    return image
+
+
+def write_tile(name, z, x, y, directory):
+    """Function: Render and write one tile of a layer (run in a worker process).
+    :return: True when the tile was written.
+    """
+    image = render_tile(_layers[name], z, x, y)
+    if image is None:
+        return False
+
+    filename = f'{directory}/{name}/{z}/{x}/{y}.png'
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    image.save(filename, optimize=False, transparency=image.info['transparency'])
+    return True
+
+
+def _init_worker(layers):
+    _layers.clear()
+    _layers.update(layers)
+
+
+def render_pyramid(layers, directory, zooms, workers=1, metadata=None):
+    """Function: XYZ tile pyramid of several layers.
+    :param layers: dict name -> (field, latitude, longitude, scale), e.g. 'tmax/20240422'.
+    :type layers: dict
+    :param directory: output directory.
+    :type directory: str
+    :param zooms: zoom levels.
+    :type zooms: list
+    :param workers: number of processes rendering the tiles.
+    :type workers: int
+    :param metadata: entries added to tiles.json.
+    :type metadata: dict
+    :return: (tiles written, empty tiles skipped).
+    """
+    prepared = {name: prepare_layer(*layer) for name, layer in layers.items()}
+
+    # Tiles of a previous run that are now empty would not be overwritten
+    for name in layers:
+        shutil.rmtree(f'{directory}/{name}', ignore_errors=True)
+
+    tasks, skipped = [], 0
+    for name, layer in prepared.items():
+        for z in zooms:
+            columns, rows = tile_range(layer['bounds'], z)
+            for x in columns:
+                for y in rows:
+                    if is_empty(layer, z, x, y):
+                        skipped += 1
+                    else:
+                        tasks.append((name, z, x, y, directory))
+
+    if workers > 1 and len(tasks) > 1:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_init_worker, initargs=(prepared,)) as pool:
+            written = pool.starmap(write_tile, tasks, chunksize=max(1, len(tasks) // (8 * workers)))
+    else:
+        _init_worker(prepared)
+        written = [write_tile(*task) for task in tasks]
+    n_written = int(sum(written))
+
+    bounds = np.array([layer['bounds'] for layer in prepared.values()])
+    index = {
+        'format': 'png',
+        'tile_size': TILE_SIZE,
+        'minzoom': min(zooms),
+        'maxzoom': max(zooms),
+        'bounds': [float(bounds[:, 0].min()), float(bounds[:, 1].min()), float(bounds[:, 2].max()), float(bounds[:, 3].max())],
+        'layers': {name: f'{name}/{{z}}/{{x}}/{{y}}.png' for name in layers},
+        **(metadata or {}),
+    }
+    os.makedirs(directory, exist_ok=True)
+    with open(f'{directory}/tiles.json', 'w') as f:
+        json.dump(index, f, indent=1, ensure_ascii=False)
+
+    return n_written, skipped + len(tasks) - n_written
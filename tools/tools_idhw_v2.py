@@ -6,6 +6,9 @@ import numpy as np
 import pandas as pd
 from shapely.geometry import Point
 
+from tools.assets import read_mask_file
+from tools.retention import remove_files
+
 
 def check_dir(dir):
     """ Create temporary directory where GEFS05 crude data
@@ -25,8 +28,9 @@ def delete_old_files(files=list, reference_time=str):
     os arquivos com datas menores do que a data de referência serão exluídos.
     :type dir: str (format %Y%m%d)
     """
-    # Remove arquivos antigos
+    # Remove arquivos antigos (removidos em lotes)
     list_remove = []
+    old = []
     files_to_remove = sorted(files)
     for f in files_to_remove:
         name_data = f.split('/')[-2]
@@ -39,7 +43,8 @@ def delete_old_files(files=list, reference_time=str):
             if name_data == 'gfs':
                 list_remove.append(f)
             else:
-                os.remove(f)
+                old.append(f)
+    remove_files(old)
     return list_remove
 
 
@@ -109,3 +114,108 @@ def split_list(mylist):
               if len(int_list[idx]) > 2]  # tirar as listas menores que 3
 
     return list(filter)
+
+
+def read_region_mask(area, target_coords, dir_mask):
+    """Função: Lê a máscara da região e interpola para a grade de destino.
+    :param area: região de interesse (BR, NEB, CE, area1-summer).
+    :type area: str
+    :param target_coords: coordenadas 'latitude' e 'longitude' da grade de destino.
+    :type target_coords: dict
+    :param dir_mask: diretório com os arquivos mask_region_{area}.nc.
+    :type dir_mask: str
+    """
+    read_mask = read_mask_file(area, dir_mask)
+    regrid_mask = read_mask.interp(coords=target_coords, method='linear')
+
+    if len(regrid_mask.mask.data.shape) == 2:
+        mask = regrid_mask.mask.data
+    else:
+        mask = regrid_mask.mask[0].data
+
+    return mask
+
+
+def region_bounds(area, dir_mask, halo=1.0):
+    """Função: Limites (lat_min, lat_max, lon_min, lon_max) da máscara da região.
+    Os limites são ampliados por uma borda (halo), para que a interpolação
+    nas bordas da região use os mesmos pontos da grade completa.
+    :param area: região de interesse (BR, NEB, CE, area1-summer).
+    :type area: str
+    :param dir_mask: diretório com os arquivos mask_region_{area}.nc.
+    :type dir_mask: str
+    :param halo: borda em graus.
+    :type halo: float
+    """
+    read_mask = read_mask_file(area, dir_mask)
+
+    mask = read_mask.mask
+    if 'time' in mask.dims:
+        mask = mask.isel(time=0)
+    inside = (mask > 0).transpose('latitude', 'longitude').data
+
+    lat = read_mask.latitude.data[inside.any(axis=1)]
+    lon = read_mask.longitude.data[inside.any(axis=0)]
+
+    # One grid spacing of the mask plus the halo
+    step = float(np.abs(np.diff(read_mask.latitude.data)).max())
+    border = step + halo
+
+    return (
+        float(lat.min()) - border, float(lat.max()) + border,
+        float(lon.min()) - border, float(lon.max()) + border,
+    )
+
+
+def subset_region(data, bounds):
+    """Função: Recorta os dados nos limites da região.
+    Funciona com latitudes crescentes ou decrescentes e longitudes em
+    -180..180 ou 0..360.
+    :param data: dados com as coordenadas latitude e longitude.
+    :type data: xarray.Dataset
+    :param bounds: saída de region_bounds, ou None para manter a grade completa.
+    :type bounds: tuple
+    """
+    if bounds is None:
+        return data
+
+    lat_min, lat_max, lon_min, lon_max = bounds
+
+    latitude = data['latitude'].data
+    if latitude[0] > latitude[-1]:
+        lat_slice = slice(lat_max, lat_min)
+    else:
+        lat_slice = slice(lat_min, lat_max)
+
+    if data['longitude'].data.max() > 180:
+        lon_min, lon_max = lon_min % 360, lon_max % 360
+
+    return data.sel(latitude=lat_slice, longitude=slice(lon_min, lon_max))
+
+
+def corrected_file(dir_forecast, model, region=None, day=None, members=0):
+    """Função: Arquivo da previsão corrigida (bias_correction.py).
+    {model}[.<YYYYMMDD>][.<region>].t00z.t2m.p18Z[.ens].nc: a região (recorte de
+    --region) e a inicialização (--dated) fazem parte do nome, para que as execuções
+    de regiões diferentes não sobrescrevam o arquivo umas das outras.
+    :param region: região do recorte, None para a grade completa.
+    :type region: str
+    :param day: inicialização (--dated), None para o arquivo da última execução.
+    :type day: datetime
+    :param members: número de membros do ensemble (0: determinística).
+    :type members: int
+    """
+    dated = '' if day is None else f'.{day.strftime("%Y%m%d")}'
+    window = '' if region is None else f'.{region}'
+    suffix = '.ens' if members > 0 else ''
+    return f'{dir_forecast}/{model}{dated}{window}.t00z.t2m.p18Z{suffix}.nc'
+
+
+def find_corrected(dir_forecast, model, region, day=None, members=0):
+    """Função: Previsão corrigida lida para uma região: o arquivo recortado na
+    região ou, se não existir, o da grade completa (que contém a região).
+    """
+    filename = corrected_file(dir_forecast, model, region, day, members)
+    if os.path.isfile(filename):
+        return filename
+    return corrected_file(dir_forecast, model, None, day, members)
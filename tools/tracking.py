@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+from scipy import ndimage, sparse
+from scipy.sparse import csgraph
+
+EARTH_RADIUS = 6371.0  # km
+
+
+def cell_area(latitude, longitude):
+    """Function: Area (km²) of each grid cell of a regular lat/lon grid.
+    :param latitude: latitudes of the grid.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the grid.
+    :type longitude: numpy.ndarray
+    :return: array (latitude, longitude).
+    """
+    dlat = np.deg2rad(np.abs(np.diff(latitude)).mean())
+    dlon = np.deg2rad(np.abs(np.diff(longitude)).mean())
+    area = EARTH_RADIUS**2 * dlat * dlon * np.cos(np.deg2rad(latitude))
+
+    return np.broadcast_to(area[:, None], (len(latitude), len(longitude)))
+
+
+def label_daily_regions(exceed, connectivity=2):
+    """Function: Label the connected regions above the threshold of each day.
+    All days are labelled in a single call; the structuring element has no
+    connection along time, so each label belongs to one day.
+    :param exceed: boolean array (time, latitude, longitude).
+    :type exceed: numpy.ndarray
+    :param connectivity: 1 (4 neighbours) or 2 (8 neighbours, including diagonals).
+    :type connectivity: int
+    :return: (labels, number of regions).
+    """
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, connectivity)
+
+    return ndimage.label(exceed, structure=structure)
+
+
+def link_regions(labels, n_regions, min_overlap=1):
+    """Function: Group the daily regions into events by their overlap on consecutive days.
+    The overlaps are counted in a sparse (region x region) matrix and the
+    events are the connected components of this graph (merging and
+    splitting regions belong to the same event).
+    :param labels: output of label_daily_regions.
+    :type labels: numpy.ndarray
+    :param n_regions: number of regions.
+    :type n_regions: int
+    :param min_overlap: minimum number of common grid points to link two regions.
+    :type min_overlap: int
+    :return: event of each region (array of size n_regions + 1, -1 for label 0).
+    """
+    today = labels[:-1].ravel()
+    tomorrow = labels[1:].ravel()
+    both = (today > 0) & (tomorrow > 0)
+
+    overlap = sparse.coo_matrix(
+        (np.ones(np.count_nonzero(both), dtype=np.int32), (today[both], tomorrow[both])),
+        shape=(n_regions + 1, n_regions + 1),
+    ).tocsr()  # duplicated pairs are summed
+    overlap.data = (overlap.data >= min_overlap).astype(np.int8)
+    overlap.eliminate_zeros()
+
+    _, component = csgraph.connected_components(overlap, directed=False)
+
+    # Renumber the events from 0 (label 0 is the background)
+    _, event = np.unique(component[1:], return_inverse=True)
+
+    return np.concatenate([[-1], event])
+
+
+def region_statistics(labels, n_regions, tmax, latitude, longitude):
+    """Function: Day, area, centroid and intensity of each labelled region.
+    :param labels: output of label_daily_regions.
+    :type labels: numpy.ndarray
+    :param n_regions: number of regions.
+    :type n_regions: int
+    :param tmax: maximum temperature (time, latitude, longitude).
+    :type tmax: numpy.ndarray
+    :param latitude: latitudes of the grid.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the grid.
+    :type longitude: numpy.ndarray
+    :return: pandas.DataFrame indexed by label.
+    """
+    n_days = labels.shape[0]
+    area = np.broadcast_to(cell_area(latitude, longitude), labels.shape)
+    lat2d, lon2d = np.meshgrid(latitude, longitude, indexing='ij')
+
+    flat = labels.ravel()
+    inside = flat > 0
+    index = flat[inside]
+
+    def total(values):
+        values = np.broadcast_to(values, labels.shape).ravel()[inside]
+        return np.bincount(index, weights=values, minlength=n_regions + 1)[1:]
+
+    region_area = total(area)
+    day = np.broadcast_to(np.arange(n_days)[:, None, None], labels.shape)
+
+    return pd.DataFrame({
+        'label': np.arange(1, n_regions + 1),
+        'day': total(day) / total(1.0),
+        'n_points': total(1.0).astype(int),
+        'area_km2': region_area,
+        'centroid_lat': total(area * lat2d) / region_area,
+        'centroid_lon': total(area * lon2d) / region_area,
+        'tmax_mean': total(area * np.nan_to_num(tmax)) / region_area,
+        'tmax_max': ndimage.maximum(np.nan_to_num(tmax, nan=-np.inf), labels, np.arange(1, n_regions + 1)),
+    }).set_index('label')
+
+
+def track_heatwaves(
+        exceed,
+        tmax,
+        times,
+        latitude,
+        longitude,
+        min_points=1,
+        min_days=3,
+        min_overlap=1,
+        connectivity=2,
+):
+    """Function: Spatial heat wave tracking.
+    Connected regions above the threshold are labelled for each day and
+    linked across consecutive days by overlap.
+    :param exceed: Tmax above the threshold (time, latitude, longitude).
+    :type exceed: numpy.ndarray
+    :param tmax: maximum temperature (time, latitude, longitude).
+    :type tmax: numpy.ndarray
+    :param times: days of the time dimension.
+    :type times: pandas.DatetimeIndex
+    :param latitude: latitudes of the grid.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the grid.
+    :type longitude: numpy.ndarray
+    :param min_points: regions with fewer grid points are ignored.
+    :type min_points: int
+    :param min_days: minimum duration of a tracked event.
+    :type min_days: int
+    :param min_overlap: minimum number of common grid points to link two regions.
+    :type min_overlap: int
+    :param connectivity: 1 (4 neighbours) or 2 (8 neighbours).
+    :type connectivity: int
+    :return: (event labels (time, latitude, longitude) with 0 outside the events,
+        daily path of the events, summary of the events).
+    """
+    labels, n_regions = label_daily_regions(exceed, connectivity=connectivity)
+
+    # Small regions are removed before linking
+    if min_points > 1:
+        size = np.bincount(labels.ravel(), minlength=n_regions + 1)
+        small = size < min_points
+        small[0] = False
+        labels[small[labels]] = 0
+
+    event = link_regions(labels, n_regions, min_overlap=min_overlap)
+    regions = region_statistics(labels, n_regions, tmax, latitude, longitude)
+    regions = regions[regions['n_points'] > 0]
+    regions['event'] = event[regions.index]
+
+    # Daily path: regions of the same event on the same day are aggregated
+    regions['lat_area'] = regions['centroid_lat'] * regions['area_km2']
+    regions['lon_area'] = regions['centroid_lon'] * regions['area_km2']
+    regions['tmax_area'] = regions['tmax_mean'] * regions['area_km2']
+    path = regions.groupby(['event', 'day']).agg(
+        n_points=('n_points', 'sum'),
+        area_km2=('area_km2', 'sum'),
+        lat_area=('lat_area', 'sum'),
+        lon_area=('lon_area', 'sum'),
+        tmax_area=('tmax_area', 'sum'),
+        tmax_max=('tmax_max', 'max'),
+        n_regions=('n_points', 'size'),
+    )
+    path['centroid_lat'] = path.pop('lat_area') / path['area_km2']
+    path['centroid_lon'] = path.pop('lon_area') / path['area_km2']
+    path['tmax_mean'] = path.pop('tmax_area') / path['area_km2']
+    path = path.reset_index()
+
+    # Events with the minimum duration
+    duration = path.groupby('event')['day'].agg(['min', 'max'])
+    duration = duration['max'] - duration['min'] + 1
+    kept = duration.index[duration >= min_days]
+    path = path[path['event'].isin(kept)].copy()
+
+    # Events numbered from 1 in chronological order
+    first_day = path.groupby('event')['day'].min().sort_values(kind='stable')
+    number = pd.Series(np.arange(1, len(first_day) + 1), index=first_day.index)
+    path['event'] = path['event'].map(number)
+
+    lookup = np.zeros(n_regions + 1, dtype=np.int32)
+    tracked = event >= 0
+    tracked[tracked] = np.isin(event[tracked], kept)
+    lookup[tracked] = number.reindex(event[tracked]).values
+    event_labels = lookup[labels]
+
+    path['date'] = times[path['day'].astype(int)]
+    path = path.drop(columns='day').sort_values(['event', 'date'])
+
+    summary = path.groupby('event').agg(
+        start=('date', 'min'),
+        end=('date', 'max'),
+        duration=('date', 'size'),
+        max_area_km2=('area_km2', 'max'),
+        mean_area_km2=('area_km2', 'mean'),
+        tmax_mean=('tmax_mean', 'mean'),
+        tmax_max=('tmax_max', 'max'),
+    )
+    summary['displacement_km'] = _displacement(path)
+
+    return event_labels, path.reset_index(drop=True), summary.reset_index()
+
+
+def _displacement(path):
+    """Great-circle distance between the first and last centroid of each event."""
+    ends = path.groupby('event')[['centroid_lat', 'centroid_lon']].agg(['first', 'last'])
+    lat1 = np.deg2rad(ends[('centroid_lat', 'first')])
+    lat2 = np.deg2rad(ends[('centroid_lat', 'last')])
+    dlon = np.deg2rad(ends[('centroid_lon', 'last')] - ends[('centroid_lon', 'first')])
+    angle = np.arccos(np.clip(
+        np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(dlon), -1, 1
+    ))
+
+    return EARTH_RADIUS * angle
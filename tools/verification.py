@@ -0,0 +1,233 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from tools.heatwave_core import daily_statistics, heatwave_days, run_length
+from tools.netcdf_io import write_netcdf
+from tools.prefetch import load_netcdf
+from tools.stage_cache import code_files, file_digests, is_fresh, record, stage_key
+from tools.tools_idhw_v2 import (check_dir, read_region_mask, region_bounds,
+                                 subset_region)
+
+STAT_VARS = ['points', 'count', 'tmax_sum', 'p75_sum', 'p75_count']
+
+
+def era5_file(dir_reference, day):
+    return f'{dir_reference}/{day.year}/t2m_max_era5_{day.strftime("%Y%m%d")}_p050.nc'
+
+
+def era5_day_statistics(
+        day,
+        clim_regions=dict,
+        dir_reference=str,
+):
+    """Function: Daily regional sums of one ERA5 day for several regions.
+    The ERA5 file is read once and evaluated for every region.
+    :param day: reference day.
+    :type day: pandas.Timestamp
+    :param clim_regions: {region: (masked climatology, mask, target_coords, bounds)}.
+    :type clim_regions: dict
+    :param dir_reference: ERA5 directory.
+    :type dir_reference: str
+    :return: (day, {region: {statistic: value}}), or (day, None) if the file is missing.
+    """
+    filename = era5_file(dir_reference, day)
+    if not os.path.isfile(filename):
+        print(f'ERROR in Accessing {filename.split("/")[-1]}')
+        return day, None
+
+    nc_ref = load_netcdf(filename)
+
+    doy = day.strftime('2020-%m-%d')
+    result = {}
+    for region, (clim, mask, target_coords, bounds) in clim_regions.items():
+        tmax = subset_region(nc_ref['t2m'], bounds).interp(coords=target_coords, method='linear').where(mask, np.nan).data
+        clim_day = clim.sel(time=doy)
+        threshold = (clim_day['t2m'] + clim_day['std']).data
+        stats = daily_statistics(tmax[-1:], threshold, clim_day['percentil75'].data[None])
+        result[region] = {var: float(np.squeeze(stats[var])) for var in STAT_VARS}
+
+    return day, result
+
+
+def reference_statistics(
+        dates,
+        regions=list,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_mask=str,
+        dir_cache=str,
+        workers=4,
+):
+    """Function: Daily regional sums of ERA5 with a per-region cache.
+    Only the days that are not in the cache are read (in threads, one file at a time: tools/prefetch.py).
+    The cache of a region is dropped when the climatology, the mask or the code change
+    (tools/stage_cache.py), and a day is read again when its ERA5 file changed.
+    :param dates: reference days.
+    :type dates: pandas.DatetimeIndex
+    :param regions: regions of interest.
+    :type regions: list
+    :param dir_reference: ERA5 directory.
+    :type dir_reference: str
+    :param dir_climatology: climatology file.
+    :type dir_climatology: str
+    :param dir_mask: directory of the region masks.
+    :type dir_mask: str
+    :param dir_cache: directory of the cached statistics.
+    :type dir_cache: str
+    :param workers: number of reading threads.
+    :type workers: int
+    :return: {region: xarray.Dataset with the daily statistics}.
+    """
+    check_dir(dir_cache)
+    files = {day: era5_file(dir_reference, day) for day in dates}
+    digests = file_digests(list(files.values()))
+
+    cached, keys = {}, {}
+    missing = set()
+    for region in regions:
+        file_cache = f'{dir_cache}/reference_stats.{region}.nc'
+        inputs = [dir_climatology, f'{dir_mask}/mask_region_{region}.nc'] + code_files(__file__)
+        keys[region] = stage_key(inputs, {'region': region})
+        ds = None
+        if is_fresh('verification', f'reference_stats.{region}', keys[region], [file_cache]):
+            with xr.open_dataset(file_cache) as ds:
+                ds = ds.load()
+            # Days whose ERA5 file changed (or is gone) since they were cached are read again
+            previous = json.loads(ds.attrs.get('era5_digests', '{}'))
+            keep = [previous.get(str(day.date())) == digests[files[day]] if day in files else True
+                    for day in pd.to_datetime(ds.time.data)]
+            ds = ds.isel(time=np.flatnonzero(keep))
+        cached[region] = ds
+
+        known = set() if ds is None else set(pd.to_datetime(ds.time.data))
+        missing.update(day for day in dates if day not in known)
+
+    if len(missing) != 0:
+        print(f'Reading {len(missing)} ERA5 days missing from the cache...')
+        clim = xr.open_dataset(dir_climatology)
+        clim_regions = {}
+        for region in regions:
+            # Only the window around the region is processed
+            bounds = region_bounds(region, dir_mask)
+            clim_region = subset_region(clim, bounds)
+            target_coords = {
+                'latitude': clim_region['latitude'],
+                'longitude': clim_region['longitude']
+            }
+            mask = read_region_mask(region, target_coords, dir_mask)
+            clim_regions[region] = (clim_region.where(mask, np.nan).load(), mask, target_coords, bounds)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda day: era5_day_statistics(day, clim_regions, dir_reference),
+                sorted(missing),
+            ))
+
+        for region in regions:
+            days = [day for day, values in results if values is not None]
+            new = xr.Dataset(
+                {var: ('time', [values[region][var] for day, values in results if values is not None])
+                 for var in STAT_VARS},
+                coords={'time': pd.DatetimeIndex(days)},
+            )
+            ds = new if cached[region] is None else xr.concat([cached[region], new], dim='time')
+            ds = ds.sortby('time')
+            previous = {} if cached[region] is None else json.loads(cached[region].attrs.get('era5_digests', '{}'))
+            previous.update({str(day.date()): digests[files[day]] for day in days})
+            previous = {day: previous[day] for day in pd.to_datetime(ds.time.data).strftime('%Y-%m-%d') if day in previous}
+            ds.attrs = {'era5_digests': json.dumps(previous, sort_keys=True)}
+
+            # float64 sums and a single chunk: the series is read whole
+            file_cache = f'{dir_cache}/reference_stats.{region}.nc'
+            write_netcdf(ds, file_cache, float32=False, time_dim=None)
+            record('verification', f'reference_stats.{region}', keys[region], [file_cache])
+            cached[region] = ds
+
+    return {
+        region: cached[region].reindex(time=dates)
+        for region in regions
+    }
+
+
+def reference_flags(stats, coverage=0.25, min_days=3):
+    """Function: Observed heat wave days from the cached daily statistics.
+    :param stats: daily statistics of one region.
+    :type stats: xarray.Dataset
+    :return: pandas.Series indexed by day (1: heat wave, 0: no heat wave, NaN: missing ERA5 day).
+    """
+    daily = {var: stats[var].fillna(0).data for var in STAT_VARS}
+    # Number of grid points in the region (constant for the reference)
+    daily['points'] = np.asarray(stats['points'].max())
+
+    criteria = heatwave_days(daily, coverage=coverage, min_days=min_days)
+    flags = pd.Series(criteria['heatwave'].astype(float), index=pd.to_datetime(stats.time.data))
+
+    return flags.where(stats['count'].notnull().data)
+
+
+def forecast_flags(filename, min_days=3):
+    """Function: Forecast heat wave days from an id_heatwaves_fcst.py output.
+    Days with values that belong to sequences of at least min_days days.
+    :param filename: forecast heat wave file.
+    :type filename: str
+    :return: pandas.Series of booleans indexed by valid day, or None if the file is missing.
+    """
+    if not os.path.isfile(filename):
+        print(f'ERROR in Accessing {filename.split("/")[-1]}')
+        return None
+
+    ds = load_netcdf(filename, lambda ds: ds[['t2m']])
+    has_values = ds['t2m'].notnull().any(dim=['latitude', 'longitude']).data
+    days = pd.to_datetime(ds.time.data).normalize()
+
+    flags = run_length(has_values) >= min_days
+    return pd.Series(flags, index=days)
+
+
+def contingency_table(forecasts, observed, n_leads):
+    """Function: Hits, misses, false alarms and correct negatives for each lead day.
+    :param forecasts: {init: pandas.Series of forecast flags}.
+    :type forecasts: dict
+    :param observed: observed flags indexed by day.
+    :type observed: pandas.Series
+    :param n_leads: number of forecast days.
+    :type n_leads: int
+    """
+    fcst = np.zeros((len(forecasts), n_leads), dtype=bool)
+    obs = np.zeros((len(forecasts), n_leads), dtype=bool)
+    valid = np.zeros((len(forecasts), n_leads), dtype=bool)
+
+    for i, flags in enumerate(forecasts.values()):
+        n = min(len(flags), n_leads)
+        o = observed.reindex(flags.index[:n])
+        fcst[i, :n] = flags.values[:n]
+        obs[i, :n] = o.fillna(0).values.astype(bool)
+        valid[i, :n] = o.notnull().values
+
+    return pd.DataFrame({
+        'lead': np.arange(1, n_leads + 1),
+        'hits': (fcst & obs & valid).sum(axis=0),
+        'misses': (~fcst & obs & valid).sum(axis=0),
+        'false_alarms': (fcst & ~obs & valid).sum(axis=0),
+        'correct_negatives': (~fcst & ~obs & valid).sum(axis=0),
+    })
+
+
+def skill_scores(table):
+    """Function: POD, FAR, CSI and frequency bias of a contingency table."""
+    hits = table['hits'].astype(float)
+    misses = table['misses']
+    false_alarms = table['false_alarms']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['pod'] = hits / (hits + misses)
+        table['far'] = false_alarms / (hits + false_alarms)
+        table['csi'] = hits / (hits + misses + false_alarms)
+        table['bias'] = (hits + false_alarms) / (hits + misses)
+
+    return table
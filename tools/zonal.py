@@ -0,0 +1,194 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+from tools.assets import cached, read_shapefile
+from tools.config import get_path
+from tools.heatwave_core import heatwave_days
+from tools.stage_cache import stage_key
+from tools.tracking import cell_area
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Zonal statistics of shapefile features (states, municipalities, ...).
+# The area of each grid cell inside each feature is computed once per (shapefile, grid)
+# and kept as a sparse (feature x cell) matrix in [paths] cache/zonal. Every
+# statistic of every feature and day is then a product of this matrix with the
+# (cell x day) fields, the means weighted by the area of the cells inside the feature.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def cell_edges(centres):
+    """Function: Edges of the cells of regular grid coordinates (ascending or descending)."""
+    step = (centres[-1] - centres[0]) / (len(centres) - 1) if len(centres) > 1 else 1.0
+    return np.concatenate([centres - step / 2, [centres[-1] + step / 2]])
+
+
+def feature_weights(geometries, latitude, longitude):
+    """Function: Area (km²) of each grid cell inside each feature.
+    Cells entirely inside a feature take the cell area; only the cells crossed by the
+    border of a feature are intersected with it.
+    :param geometries: geometries of the features (longitude/latitude).
+    :type geometries: numpy.ndarray
+    :param latitude: latitudes of the grid.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the grid.
+    :type longitude: numpy.ndarray
+    :return: scipy.sparse.csr_matrix (feature, latitude * longitude).
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    lat_edges = cell_edges(np.asarray(latitude, dtype=float))
+    lon_edges = cell_edges((np.asarray(longitude, dtype=float) + 180) % 360 - 180)
+
+    lon0, lat0 = np.meshgrid(lon_edges[:-1], lat_edges[:-1])
+    lon1, lat1 = np.meshgrid(lon_edges[1:], lat_edges[1:])
+    cells = shapely.box(np.minimum(lon0, lon1).ravel(), np.minimum(lat0, lat1).ravel(),
+                        np.maximum(lon0, lon1).ravel(), np.maximum(lat0, lat1).ravel())
+
+    # Candidate (feature, cell) pairs
+    feature, cell = shapely.STRtree(cells).query(geometries, predicate='intersects')
+
+    shapely.prepare(geometries)
+    fraction = np.ones(len(cell))
+    border = ~shapely.contains_properly(geometries[feature], cells[cell])
+    fraction[border] = shapely.area(shapely.intersection(geometries[feature[border]], cells[cell[border]])) \
+        / shapely.area(cells[cell[border]])
+
+    area = cell_area(np.asarray(latitude), np.asarray(longitude)).ravel()
+    weights = sparse.coo_matrix(
+        (fraction * area[cell], (feature, cell)),
+        shape=(len(geometries), len(cells)),
+    ).tocsr()
+    weights.eliminate_zeros()
+
+    return weights
+
+
+def read_features(shapefile, id_column):
+    """Function: Names and geometries (longitude/latitude) of the features of a shapefile."""
+    features = read_shapefile(shapefile)
+    if id_column not in features.columns:
+        print(f'{id_column} is not a column of {shapefile}: {", ".join(c for c in features.columns if c != "geometry")}')
+        exit()
+    if features.crs is not None and not features.crs.is_geographic:
+        features = features.to_crs(4326)
+
+    return features[id_column].astype(str).to_numpy(), features.geometry.to_numpy()
+
+
+def zonal_weights(shapefile, id_column, latitude, longitude):
+    """Function: Weights of the features of a shapefile on a grid, computed once and cached.
+    The cache file depends on the content of the shapefile, the id column and the grid.
+    :param shapefile: .shp file.
+    :type shapefile: str
+    :param id_column: attribute with the name of each feature (e.g. NM_UF).
+    :type id_column: str
+    :param latitude: latitudes of the grid.
+    :type latitude: numpy.ndarray
+    :param longitude: longitudes of the grid.
+    :type longitude: numpy.ndarray
+    :return: (feature names, scipy.sparse.csr_matrix of feature_weights).
+    """
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    grid = hashlib.blake2b(latitude.tobytes() + b'/' + longitude.tobytes(), digest_size=16).hexdigest()
+    parts = sorted(glob.glob(f'{os.path.splitext(shapefile)[0]}.*'))
+    key = stage_key(parts, {'id': id_column, 'grid': grid})
+
+    name = os.path.splitext(os.path.basename(shapefile))[0]
+    directory = f'{get_path("cache")}/zonal'
+    filename = f'{directory}/{name}.{key[:16]}.npz'
+
+    def build():
+        if os.path.isfile(filename):
+            with np.load(filename, allow_pickle=False) as data:
+                weights = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+                return data['names'], weights
+
+        names, geometries = read_features(shapefile, id_column)
+        weights = feature_weights(geometries, latitude, longitude)
+        os.makedirs(directory, exist_ok=True)
+        np.savez(f'{filename}.tmp.npz', names=np.asarray(names, dtype=str), data=weights.data, indices=weights.indices,
+                 indptr=weights.indptr, shape=np.array(weights.shape))
+        os.replace(f'{filename}.tmp.npz', filename)
+        return names, weights
+
+    return cached(('zonal', filename), build)
+
+
+def zonal_sum(weights, field):
+    """Function: Area-weighted sum of a field over each feature.
+    :param weights: output of feature_weights (feature, cell).
+    :type weights: scipy.sparse.csr_matrix
+    :param field: field (time, latitude, longitude), NaN counts as 0.
+    :type field: numpy.ndarray
+    :return: array (feature, time).
+    """
+    field = np.asarray(field)
+    columns = field.reshape(field.shape[0], -1).T  # (cell, time)
+    if np.issubdtype(columns.dtype, np.floating):
+        columns = np.nan_to_num(columns)
+    return np.asarray(weights @ columns.astype(np.float64, copy=False))
+
+
+def zonal_statistics(weights, tmax, clim_tmax, exceed, p75, coverage=0.25, min_days=3):
+    """Function: Daily statistics and heat wave criteria of each feature.
+    The criteria are the ones of the region (tools/heatwave_core.py), with the feature
+    as the region and each grid cell weighted by its area inside the feature.
+    :param weights: output of feature_weights (feature, cell).
+    :type weights: scipy.sparse.csr_matrix
+    :param tmax: maximum temperature (time, latitude, longitude).
+    :type tmax: numpy.ndarray
+    :param clim_tmax: climatological Tmax (time, latitude, longitude).
+    :type clim_tmax: numpy.ndarray
+    :param exceed: exceedance of the definition (time, latitude, longitude).
+    :type exceed: numpy.ndarray
+    :param p75: climatological 75th percentile (time, latitude, longitude).
+    :type p75: numpy.ndarray
+    :param coverage: minimum fraction of the feature area above the threshold.
+    :type coverage: float
+    :return: dict of arrays (feature, time).
+    """
+    valid = ~np.isnan(tmax)
+    exceed = np.asarray(exceed) & valid
+    area = zonal_sum(weights, valid)
+    anomaly = tmax - clim_tmax
+
+    stats = {
+        'points': area[:, 0],
+        'count': zonal_sum(weights, exceed),
+        'tmax_sum': zonal_sum(weights, np.where(exceed, tmax, 0)),
+        'p75_sum': zonal_sum(weights, p75),
+        'p75_count': zonal_sum(weights, ~np.isnan(p75)),
+    }
+    criteria = heatwave_days(stats, coverage=coverage, min_days=min_days)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'area_km2': area,
+            'tmax': zonal_sum(weights, tmax) / area,
+            'anomaly': zonal_sum(weights, np.where(np.isnan(anomaly), 0, anomaly)) / zonal_sum(weights, ~np.isnan(anomaly)),
+            'coverage': criteria['fraction'],
+            'extreme': criteria['extreme'],
+            'heatwave': criteria['heatwave'],
+            'intensity': criteria['intensity'],
+            'p75': criteria['p75'],
+        }
+
+
+def statistics_table(names, times, statistics):
+    """Function: Long table (feature, date) of the output of zonal_statistics."""
+    n_features, n_days = statistics['tmax'].shape
+    table = pd.DataFrame({
+        'feature': np.repeat(names, n_days),
+        'date': np.tile(pd.DatetimeIndex(times).strftime('%Y-%m-%d'), n_features),
+    })
+    for name, value in statistics.items():
+        table[name] = np.asarray(value).ravel()
+    for name in ('extreme', 'heatwave'):
+        table[name] = table[name].astype(int)
+
+    return table
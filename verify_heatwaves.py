@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+__author__ = ["Glícia R. G. Araújo"]
+__credits__ = ["Glícia Garcia"]
+__license__ = "GPL"
+__version__ = "1.0"
+__email__ = "glicia.garcia@inpe.br"
+
+
+import argparse
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+from tools.config import get_option, get_path, stage_in_file
+from tools.tools_idhw_v2 import check_dir
+from tools.verification import (contingency_table, forecast_flags,
+                                reference_flags, reference_statistics,
+                                skill_scores)
+
+warnings.filterwarnings('ignore')
+
+
+def verificacao_onda_de_calor(
+        day_init,
+        day_final,
+        model=str,
+        regions=list,
+        coverage=float,
+        n_leads=6,
+        min_days=3,
+        pattern=str,
+        dir_heatwave=str,
+        dir_reference=str,
+        dir_climatology=str,
+        dir_cache=str,
+        workers=4,
+):
+    """This script verifies the heat wave forecasts against the ERA5 heat waves.
+
+    Args:
+        day_init (str): first forecast initialization.
+        day_final (str): last forecast initialization.
+        model (str): model name.
+        regions (list): regions of interest.
+        coverage (float): spatial coverage of the heat wave.
+        n_leads (int): number of forecast days.
+        min_days (int): minimum number of consecutive days.
+        pattern (str): forecast heat wave file name ({model}, {date} and {region}).
+        dir_heatwave (str): forecast heat wave directory (id_heatwaves_fcst.py output).
+        dir_reference (str): reference data directory.
+        dir_climatology (str): climatology data directory.
+        dir_cache (str): directory of the cached reference statistics.
+        workers (int): number of reading threads.
+    """
+    inits = pd.date_range(start=day_init, end=day_final, freq='D')
+
+    # Margin so that the events crossing the verification period are complete
+    margin = timedelta(days=10)
+    dates = pd.date_range(start=inits[0] - margin, end=inits[-1] + timedelta(days=n_leads) + margin, freq='D')
+
+    print(f'\nInitializations: {inits[0].strftime("%d-%m-%Y")} - {inits[-1].strftime("%d-%m-%Y")} ({len(inits)})\n')
+
+    # ----------------------------------------------------------------
+    # Reference (ERA5) heat waves
+    # ----------------------------------------------------------------
+    stats = reference_statistics(
+        dates,
+        regions=regions,
+        dir_reference=dir_reference,
+        dir_climatology=dir_climatology,
+        dir_mask=get_path('masks'),
+        dir_cache=dir_cache,
+        workers=workers,
+    )
+
+    list_tables = []
+    for region in regions:
+        observed = reference_flags(stats[region], coverage=coverage, min_days=min_days)
+
+        # ----------------------------------------------------------------
+        # Forecast heat waves (one file per initialization)
+        # ----------------------------------------------------------------
+        files = [
+            dir_heatwave + pattern.format(model=model, date=init.strftime('%Y%m%d'), region=region)
+            for init in inits
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            flags = list(executor.map(lambda f: forecast_flags(f, min_days=min_days), files))
+
+        forecasts = {init: f for init, f in zip(inits, flags) if f is not None}
+        print(f'{region}: {len(forecasts)} forecasts, {int(observed.sum())} observed heat wave days')
+
+        table = skill_scores(contingency_table(forecasts, observed, n_leads))
+        table.insert(0, 'region', region)
+        list_tables.append(table)
+
+    return pd.concat(list_tables, ignore_index=True)
+
+
+def arguments():
+    parser = argparse.ArgumentParser(prog='verify_heatwaves.py')
+    parser.add_argument(
+        '--date-init',
+        type=str,
+        default=(datetime.today() - timedelta(days=50)).strftime("%Y%m%d"),
+        help='First initialization date: %Y%m%d',
+    )
+
+    parser.add_argument(
+        '--date-end',
+        type=str,
+        default=(datetime.today() - timedelta(days=12)).strftime("%Y%m%d"),
+        help='Last initialization date: %Y%m%d',
+    )
+
+    parser.add_argument(
+        '--model',
+        type=str,
+        default='monan',
+        help='Forecasting model',
+    )
+
+    parser.add_argument(
+        '--region',
+        type=str,
+        default='BR',
+        help='Regions separated by commas: CE,NEB,BR,area1-summer',
+    )
+
+    parser.add_argument(
+        '--cov',
+        type=float,
+        default=0.25,
+        help='Spatial coverage of the heat wave',
+    )
+
+    parser.add_argument(
+        '--pattern',
+        type=str,
+        default='{model}.{date}.onda_de_calor.nc',
+        help='Forecast heat wave file name ({model}, {date} and {region} are replaced)',
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=get_option('run', 'workers', int) or 4,
+        help='Number of reading threads',
+    )
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = arguments()
+    regions = args.region.split(',')
+
+    if len(regions) > 1 and '{region}' not in args.pattern:
+        print('Com mais de uma região, o --pattern deve conter {region}!\n')
+        print("Exemplo: --pattern '{model}.{date}.{region}.onda_de_calor.nc'")
+        exit()
+
+    path_ref = get_path('era5')
+    path_clim = stage_in_file(get_path('climatology'), 'era5_reanalysis')
+
+    print(f'\n\nVerification of the heat wave forecast - {args.model.upper()}\n\n')
+    table = verificacao_onda_de_calor(
+        pd.to_datetime(args.date_init),
+        pd.to_datetime(args.date_end),
+        model=args.model,
+        regions=regions,
+        coverage=args.cov,
+        pattern=args.pattern,
+        dir_heatwave=get_path('heatwaves') + '/',
+        dir_reference=path_ref,
+        dir_climatology=path_clim,
+        dir_cache=get_path('cache'),
+        workers=args.workers,
+    )
+
+    dir_out = get_path('verification') + '/'
+    check_dir(dir_out)
+    file_out = dir_out + f'verification.{args.model}.{args.date_init}-{args.date_end}.cov{args.cov}.csv'
+    table.to_csv(file_out, index=False, float_format='%.3f')
+
+    print()
+    print(table.to_string(index=False, float_format='%.2f'))
+    print(f'\nSaving file in... {file_out}\n')
+
+
+if __name__ == '__main__':
+    main()
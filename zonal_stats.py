@@ -0,0 +1,255 @@
+import argparse
+import os
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from tools.assets import read_climatology
+from tools.config import get_path, stage_in_file
+from tools.instrumentation import save_report, stage, start_report
+from tools.prefetch import load_netcdf, prefetch
+from tools.stage_cache import code_files, is_fresh, record, stage_key
+from tools.thresholds import DEFINITIONS, check_climatology, check_definitions, definition_suffix, exceedance
+from tools.tools_idhw_v2 import check_dir, find_corrected, subset_region
+from tools.zonal import read_features, statistics_table, zonal_statistics, zonal_weights
+
+warnings.filterwarnings('ignore')
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+# Daily heat wave statistics of every feature of a shapefile (e.g. the states of BR_UF_2021
+# or the municipalities of i3geomap_limite_municipal): area-weighted mean Tmax and
+# anomaly, fraction of the feature above the threshold and the heat wave criteria with
+# the feature as the region. Either the corrected forecast of a model (--model) or the
+# ERA5 reference of a period.
+# --------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def shapefile_path(shape):
+    """Function: .shp file of a shapefile name in [paths] shapes (or a path to a .shp file)."""
+    if shape.endswith('.shp'):
+        return shape
+    return f'{get_path("shapes")}/{shape}/{shape}.shp'
+
+
+def shape_bounds(shapefile, id_column, halo=1.0):
+    """Function: Window (lat_min, lat_max, lon_min, lon_max) of the features, as region_bounds."""
+    _, geometries = read_features(shapefile, id_column)
+    lon_min, lat_min, lon_max, lat_max = np.array([g.bounds for g in geometries]).T
+    return lat_min.min() - halo, lat_max.max() + halo, lon_min.min() - halo, lon_max.max() + halo
+
+
+def forecast_file(dir_forecast, model, region, day):
+    """Function: Corrected forecast of an initialization: the file of bias_correction.py --dated, else the one of
+    the last run (each with the window of the region, else the full grid); None when there is none.
+    """
+    for dated in (day, None):
+        filename = find_corrected(dir_forecast, model, region, day=dated)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def read_forecast(filename, bounds):
+    """Function: Corrected forecast (°C) of the window."""
+    return load_netcdf(filename, lambda ds: subset_region(ds['t2m'], bounds))
+
+
+def read_reference(dir_reference, times, bounds):
+    """Function: ERA5 daily Tmax (°C) of the days of the window."""
+    def read(time):
+        filename = f'{dir_reference}/{time.year}/t2m_max_era5_{time.strftime("%Y%m%d")}_p050.nc'
+        return load_netcdf(filename, lambda ds: subset_region(ds['t2m'], bounds))
+
+    return xr.concat(list(prefetch(times, read)), dim='time')
+
+
+def statistics_features(
+        tmax,
+        shapefile=str,
+        id_column=str,
+        coverage=0.25,
+        dir_climatology=str,
+        bounds=None,
+        definition='std',
+):
+    """Zonal statistics of the daily Tmax of a grid for the features of a shapefile.
+
+    Args:
+        tmax (DataArray): daily Tmax in °C (time, latitude, longitude).
+        shapefile (str): .shp file.
+        id_column (str): attribute with the name of each feature.
+        coverage (float): fraction of the feature area above the threshold.
+        dir_climatology (str): climatology file.
+        bounds (tuple): window of the features.
+        definition (str): heat wave definition (tools/thresholds.py).
+
+    Returns:
+        pandas.DataFrame with one row per feature and day.
+    """
+    target_coords = {
+        'latitude': tmax['latitude'],
+        'longitude': tmax['longitude']
+    }
+    times = tmax.time.dt.strftime('2020-%m-%d').data
+
+    with stage('read_climatology'):
+        # Border of the window for the interpolation (as region_bounds(halo=2.0))
+        nc = read_climatology(dir_climatology, (bounds[0] - 1, bounds[1] + 1, bounds[2] - 1, bounds[3] + 1))
+        check_climatology([definition], nc, dir_climatology)
+        nc = nc[sorted(set(DEFINITIONS[definition]['climatology'] + ['t2m', 'percentil75']))]
+        nc = nc.sel(time=times).load()
+    with stage('regrid'):
+        nc = nc.interp(coords=target_coords, method='linear').astype(np.float32, copy=False)
+
+    # Computed once per shapefile and grid ([paths] cache/zonal)
+    with stage('zonal_weights'):
+        names, weights = zonal_weights(shapefile, id_column, tmax.latitude.data, tmax.longitude.data)
+    print(f'{len(names)} features, {weights.nnz} (feature, cell) weights')
+
+    with stage('zonal_statistics', features=len(names)):
+        data = tmax.data.astype(np.float32, copy=False)
+        exceed = exceedance([definition], {'tmax': data}, nc)[definition]
+        statistics = zonal_statistics(weights, data, nc['t2m'].data, exceed, nc['percentil75'].data, coverage=coverage)
+
+    return statistics_table(names, tmax.time.data, statistics)
+
+
+def arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='zonal_stats.py')
+    parser.add_argument(
+        '--shape',
+        type=str,
+        default='BR_UF_2021',
+        help='Shapefile: name in [paths] shapes (e.g. BR_UF_2021, i3geomap_limite_municipal) or .shp file',
+    )
+    parser.add_argument(
+        '--id',
+        type=str,
+        default='NM_UF',
+        help='Attribute with the name of each feature (e.g. NM_UF)',
+    )
+    parser.add_argument(
+        '--model',
+        type=str,
+        default=None,
+        help='Corrected forecast of the model (default: ERA5 reference from --date-init to --date-end)',
+    )
+    parser.add_argument(
+        '--region',
+        type=str,
+        default=None,
+        help='Region of the corrected forecast (bias_correction.py --region), default: full grid',
+    )
+    parser.add_argument(
+        '--date',
+        type=str,
+        default=datetime.today().strftime('%Y%m%d'),
+        help='Forecast initialization: %Y%m%d',
+    )
+    parser.add_argument(
+        '--date-init',
+        type=str,
+        default=(datetime.today() - timedelta(days=50)).strftime('%Y%m%d'),
+        help='Reference: first day %Y%m%d',
+    )
+    parser.add_argument(
+        '--date-end',
+        type=str,
+        default=(datetime.today() - timedelta(days=6)).strftime('%Y%m%d'),
+        help='Reference: last day %Y%m%d',
+    )
+    parser.add_argument(
+        '--cov',
+        type=float,
+        default=0.25,
+        help='Spatial coverage of the heat wave (fraction of the feature area)',
+    )
+    parser.add_argument(
+        '--definition',
+        type=str,
+        default='std',
+        choices=list(DEFINITIONS),
+        help='Heat wave definition (tools/thresholds.py)',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Recompute even if the output is up to date',
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = arguments(argv)
+    check_definitions([args.definition], fields=['tmax'], lookback=False)
+    shapefile = shapefile_path(args.shape)
+    if not os.path.isfile(shapefile):
+        print(f'ERROR in Accessing {shapefile}')
+        exit()
+    name = os.path.splitext(os.path.basename(shapefile))[0]
+
+    if args.model is not None:
+        day = pd.to_datetime(args.date)
+        label = f'{args.model}.{day.strftime("%Y%m%d")}'
+        file_forecast = forecast_file(get_path('corrected'), args.model, args.region, day)
+        if file_forecast is None:
+            print(f'ERROR in Accessing {find_corrected(get_path("corrected"), args.model, args.region, day=day)}')
+            exit()
+        inputs = [file_forecast]
+    else:
+        times = pd.date_range(pd.to_datetime(args.date_init), pd.to_datetime(args.date_end), freq='D')
+        label = f'reference.{times[0].strftime("%Y%m%d")}-{times[-1].strftime("%Y%m%d")}'
+        inputs = [f'{get_path("era5")}/{t.year}/t2m_max_era5_{t.strftime("%Y%m%d")}_p050.nc' for t in times]
+        missing = [filename for filename in inputs if not os.path.isfile(filename)]
+        if missing:
+            print(f'ERROR in Accessing {missing[0]} ({len(missing)} of {len(inputs)} daily files missing)')
+            exit()
+    start_report('zonal_stats', label=label, shape=name, definition=args.definition)
+
+    dir_out = get_path('heatwaves') + '/'
+    file_out = f'{dir_out}{label}.zonal.{name}{definition_suffix(args.definition)}.csv'
+
+    # Skipped when the last run had the same inputs and parameters
+    with stage('cache_check'):
+        inputs += [get_path('climatology'), shapefile] + code_files(__file__)
+        key = stage_key(inputs, {'cov': args.cov, 'id': args.id, 'definition': args.definition})
+    if not args.force and is_fresh('zonal', f'{label}.{name}', key, [file_out]):
+        print(f'{file_out} is up to date (same inputs and parameters)\n')
+        save_report()
+        return
+
+    bounds = shape_bounds(shapefile, args.id)
+    with stage('read_tmax'):
+        if args.model is not None:
+            tmax = read_forecast(file_forecast, bounds)
+        else:
+            tmax = read_reference(get_path('era5'), times, bounds)
+
+    with stage('stage_in'):
+        path_clim = stage_in_file(get_path('climatology'), 'era5_reanalysis')
+    table = statistics_features(
+        tmax,
+        shapefile=shapefile,
+        id_column=args.id,
+        coverage=args.cov,
+        dir_climatology=path_clim,
+        bounds=bounds,
+        definition=args.definition,
+    )
+
+    check_dir(dir_out)
+    with stage('write_output'):
+        table.to_csv(file_out, index=False, float_format='%.3f')
+    record('zonal', f'{label}.{name}', key, [file_out])
+
+    heatwave = table.groupby('feature')['heatwave'].sum()
+    print(f'Heat wave days in {np.count_nonzero(heatwave)} of {len(heatwave)} features')
+    print(f'\nSaving file in... {file_out}\n')
+    save_report()
+
+
+if __name__ == '__main__':
+    main()